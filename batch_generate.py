@@ -0,0 +1,225 @@
+"""Generates Mesop apps in bulk from a JSONL file of prompts.
+
+Each input line is a JSON object with these fields:
+
+- prompt: Description of the app, or of the changes to make when revising
+- app_type: "general" (default) or "chat"
+- id: Optional unique ID. Defaults to the line number.
+- code: Optional code to revise instead of generating a new app
+- template: Optional file name in `templates/` to revise, such as "basic_chat.txt"
+
+Results are appended to the output JSONL as each prompt finishes, so an interrupted run can be
+resumed by running the same command again. Prompts that already succeeded are skipped, and
+failed prompts are retried. Input lines that are not valid prompts are recorded as failures
+instead of stopping the run, once per line and error.
+
+Usage:
+
+  GEMINI_API_KEY=... python batch_generate.py prompts.jsonl results.jsonl --concurrency 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import llm
+from constants import TEMPLATES
+from scheduler import PRIORITY_GENERATE, PRIORITY_REVISE, Scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("prompts", help="JSONL file of prompts")
+  parser.add_argument("output", help="JSONL file to append results to")
+  parser.add_argument("--model", default="gemini-1.5-flash")
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--rate-per-minute", type=float, default=15)
+  parser.add_argument("--code-dir", help="Also write each generated app to <code-dir>/<id>.py")
+  args = parser.parse_args()
+
+  api_key = os.getenv("GEMINI_API_KEY", "")
+  items, invalid = _read_items(args.prompts)
+  completed, recorded_invalid = _read_results(args.output)
+  pending = [item for item in items if item["id"] not in completed]
+  # Invalid lines stay invalid until the input is fixed, so only record them once.
+  new_invalid = [
+    result for result in invalid if (result["id"], result["error"]) not in recorded_invalid
+  ]
+  print(
+    f"{len(items)} prompts, {len(items) - len(pending)} already completed, {len(pending)} to run,"
+    f" {len(invalid)} invalid.",
+    file=sys.stderr,
+  )
+  if args.code_dir:
+    os.makedirs(args.code_dir, exist_ok=True)
+
+  # Everything is queued up front, so there is no need to bound the queue or the wait.
+  scheduler = Scheduler(
+    rate_per_minute=args.rate_per_minute,
+    burst=args.concurrency,
+    max_concurrent=args.concurrency,
+    max_queue=len(pending) + 1,
+    max_wait_seconds=float("inf"),
+  )
+  start = time.monotonic()
+  succeeded = 0
+  failed = len(new_invalid)
+  _drop_partial_line(args.output)
+  with (
+    open(args.output, "a") as output,
+    ThreadPoolExecutor(max_workers=args.concurrency) as executor,
+  ):
+    for result in new_invalid:
+      output.write(json.dumps(result) + "\n")
+      print(f"Invalid {result['id']}: {result['error']}", file=sys.stderr)
+    output.flush()
+    futures = [executor.submit(_run_item, item, scheduler, api_key, args.model) for item in pending]
+    for future in as_completed(futures):
+      result = future.result()
+      output.write(json.dumps(result) + "\n")
+      output.flush()
+      if "error" in result:
+        failed += 1
+        print(f"Failed {result['id']}: {result['error']}", file=sys.stderr)
+      else:
+        succeeded += 1
+        if args.code_dir:
+          with open(os.path.join(args.code_dir, f"{result['id']}.py"), "w") as f:
+            f.write(result["code"])
+      print(f"Finished {succeeded + failed}/{len(pending)}", file=sys.stderr)
+
+  seconds = time.monotonic() - start
+  summary = {
+    "total": len(items) + len(invalid),
+    "skipped": len(items) - len(pending) + len(invalid) - len(new_invalid),
+    "succeeded": succeeded,
+    "failed": failed,
+    "seconds": seconds,
+    "apps_per_minute": succeeded / seconds * 60 if seconds else 0.0,
+    "avg_queue_seconds": scheduler.stats.total_wait_seconds / max(scheduler.stats.admitted, 1),
+  }
+  print(json.dumps(summary), file=sys.stderr)
+
+
+def _read_items(path: str) -> tuple[list[dict], list[dict]]:
+  """Reads the prompts to run.
+
+  Returns the valid items, and an error result for each line that is not a valid item.
+  """
+  items = []
+  invalid = []
+  ids = set()
+  with open(path) as f:
+    for line_number, line in enumerate(f, start=1):
+      if not line.strip():
+        continue
+      try:
+        item = json.loads(line)
+      except json.JSONDecodeError as e:
+        invalid.append(
+          _invalid_result(str(line_number), f"Invalid JSON on line {line_number}: {e}")
+        )
+        continue
+      if not isinstance(item, dict):
+        invalid.append(_invalid_result(str(line_number), f"Line {line_number} is not an object"))
+        continue
+      item["id"] = str(item.get("id", line_number))
+      item.setdefault("app_type", "general")
+      error = _validate_item(item, ids)
+      if error:
+        invalid.append(_invalid_result(item["id"], f"{error} on line {line_number}"))
+        continue
+      ids.add(item["id"])
+      items.append(item)
+  return items, invalid
+
+
+def _validate_item(item: dict, ids: set[str]) -> str | None:
+  """Returns why the item cannot be run, or None if it can."""
+  if item["id"] in ids:
+    return f"Duplicate id {item['id']}"
+  if not isinstance(item.get("prompt"), str) or not item["prompt"].strip():
+    return "Missing prompt"
+  if item["app_type"] not in ("general", "chat"):
+    return f"Unknown app_type {item['app_type']}"
+  if item.get("code") is not None and not isinstance(item["code"], str):
+    return "code must be a string"
+  if item.get("template") and item["template"] not in TEMPLATES:
+    return f"Unknown template {item['template']}"
+  return None
+
+
+def _invalid_result(item_id: str, error: str) -> dict:
+  return {"id": item_id, "error": error, "invalid": True}
+
+
+def _read_results(path: str) -> tuple[set[str], set[tuple[str, str]]]:
+  """Reads the results of previous runs.
+
+  Returns the IDs of the prompts that succeeded, and the (ID, error) pairs of the invalid lines
+  that were recorded.
+  """
+  completed = set()
+  recorded_invalid = set()
+  if not os.path.exists(path):
+    return completed, recorded_invalid
+  with open(path) as f:
+    for line in f:
+      try:
+        result = json.loads(line)
+      except json.JSONDecodeError:
+        # The last line may be cut off if the previous run was killed mid-write.
+        continue
+      if result.get("invalid"):
+        recorded_invalid.add((result["id"], result["error"]))
+      elif "error" not in result:
+        completed.add(result["id"])
+  return completed, recorded_invalid
+
+
+def _drop_partial_line(path: str):
+  """Removes a record that was cut off mid-write, so new records start on their own line."""
+  if not os.path.exists(path):
+    return
+  with open(path, "rb+") as f:
+    data = f.read()
+    if data and not data.endswith(b"\n"):
+      f.truncate(data.rfind(b"\n") + 1)
+
+
+def _run_item(item: dict, scheduler: Scheduler, api_key: str, model_name: str) -> dict:
+  code = item.get("code") or TEMPLATES.get(item.get("template", ""))
+  ticket = scheduler.enqueue(api_key, PRIORITY_REVISE if code else PRIORITY_GENERATE)
+  result = {"id": item["id"], "prompt": item["prompt"], "app_type": item["app_type"]}
+  try:
+    while not ticket.wait(timeout=60):
+      pass
+    start = time.monotonic()
+    if code:
+      text = llm.adjust_mesop_app(code, item["prompt"], model_name, api_key, item["app_type"])
+    else:
+      text = llm.generate_mesop_app(item["prompt"], model_name, api_key, item["app_type"])
+    result["seconds"] = time.monotonic() - start
+  except Exception as e:
+    # One failed prompt should not stop the batch. It is recorded and retried on the next run.
+    logger.debug("Failed to generate %s", item["id"], exc_info=True)
+    result["error"] = str(e)
+    return result
+  finally:
+    ticket.release()
+
+  repair = llm.postprocess_code(text)
+  result["code"] = repair.code
+  result["violations"] = [violation.message for violation in repair.remaining]
+  result["warnings"] = [violation.message for violation in repair.warnings]
+  return result
+
+
+if __name__ == "__main__":
+  main()
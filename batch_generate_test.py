@@ -0,0 +1,114 @@
+import json
+import sys
+
+import pytest
+
+import batch_generate
+import llm
+
+APP = "```python\nimport mesop as me\n```"
+
+
+@pytest.fixture
+def generate(monkeypatch):
+  """Replaces the LLM with one that fails for prompts containing "fail"."""
+  prompts = []
+
+  def generate_mesop_app(prompt, model_name, api_key, app_type):
+    prompts.append(prompt)
+    if "fail" in prompt:
+      raise RuntimeError("Quota exceeded")
+    return APP
+
+  monkeypatch.setattr(llm, "generate_mesop_app", generate_mesop_app)
+  return prompts
+
+
+def run(monkeypatch, capsys, prompts_path, output_path) -> dict:
+  monkeypatch.setattr(sys, "argv", ["batch_generate.py", str(prompts_path), str(output_path)])
+  batch_generate.main()
+  return json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+
+
+def read_results(path) -> list[dict]:
+  return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def write_prompts(path, lines: list[str]):
+  path.write_text("".join(line + "\n" for line in lines))
+
+
+def test_invalid_lines_are_recorded_and_do_not_stop_the_run(
+  tmp_path, monkeypatch, capsys, generate
+):
+  prompts = tmp_path / "prompts.jsonl"
+  output = tmp_path / "results.jsonl"
+  write_prompts(
+    prompts,
+    [
+      '{"id": "a", "prompt": "Counter"}',
+      "not json",
+      "[1, 2]",
+      '{"id": "a", "prompt": "Duplicate"}',
+      '{"id": "b", "prompt": "Chat", "app_type": "other"}',
+      '{"id": "c"}',
+    ],
+  )
+
+  summary = run(monkeypatch, capsys, prompts, output)
+
+  assert (summary["succeeded"], summary["failed"]) == (1, 5)
+  errors = {result["id"]: result["error"] for result in read_results(output) if "error" in result}
+  assert errors == {
+    "2": "Invalid JSON on line 2: Expecting value: line 1 column 1 (char 0)",
+    "3": "Line 3 is not an object",
+    "a": "Duplicate id a on line 4",
+    "b": "Unknown app_type other on line 5",
+    "c": "Missing prompt on line 6",
+  }
+
+
+def test_resume_skips_completed_prompts_and_recorded_invalid_lines(
+  tmp_path, monkeypatch, capsys, generate
+):
+  prompts = tmp_path / "prompts.jsonl"
+  output = tmp_path / "results.jsonl"
+  write_prompts(
+    prompts,
+    ['{"id": "a", "prompt": "Counter"}', '{"id": "b", "prompt": "fail"}', "not json"],
+  )
+  run(monkeypatch, capsys, prompts, output)
+  generate.clear()
+
+  summary = run(monkeypatch, capsys, prompts, output)
+
+  # Only the failed prompt is retried, and the invalid line is not recorded again.
+  assert generate == ["fail"]
+  assert (summary["succeeded"], summary["failed"], summary["skipped"]) == (0, 1, 2)
+  assert sorted(result["id"] for result in read_results(output)) == ["3", "a", "b", "b"]
+
+
+def test_fixed_invalid_line_is_run(tmp_path, monkeypatch, capsys, generate):
+  prompts = tmp_path / "prompts.jsonl"
+  output = tmp_path / "results.jsonl"
+  write_prompts(prompts, ['{"id": "a"}'])
+  run(monkeypatch, capsys, prompts, output)
+  write_prompts(prompts, ['{"id": "a", "prompt": "Counter"}'])
+
+  summary = run(monkeypatch, capsys, prompts, output)
+
+  assert summary["succeeded"] == 1
+  assert generate == ["Counter"]
+
+
+def test_partial_line_is_dropped_before_appending(tmp_path, monkeypatch, capsys, generate):
+  prompts = tmp_path / "prompts.jsonl"
+  output = tmp_path / "results.jsonl"
+  write_prompts(prompts, ['{"id": "a", "prompt": "Counter"}', '{"id": "b", "prompt": "Chat"}'])
+  output.write_text('{"id": "a", "prompt": "Counter", "code": "x"}\n{"id": "b", "pro')
+
+  summary = run(monkeypatch, capsys, prompts, output)
+
+  assert (summary["succeeded"], summary["skipped"]) == (1, 1)
+  assert generate == ["Chat"]
+  assert [result["id"] for result in read_results(output)] == ["a", "b"]
@@ -0,0 +1,378 @@
+"""Offline end-to-end benchmark of the editor against fake Gemini and runner services.
+
+Starts the services in `fake_services`, then drives the real handlers and LLM functions and
+reports latency percentiles for each stage:
+
+- prompt_assembly: building the prompt and looking up the model
+- first_chunk: time to the first streamed chunk from Gemini
+- generation: streaming the whole response from Gemini
+- post_processing: extracting and repairing the generated code
+- preflight: the local checks run before uploading the code
+- run_prompt: the `on_run_prompt` handler end to end, including the prompt animation delay
+- upload: the `on_run_code` handler, which uploads the code to the runner
+- upload_cached: the `on_run_code` handler again, which skips the upload since the runner
+  already has the code
+- preview_reload: fetching the uploaded app page, which is all a preview that is already loaded
+  needs to swap in the new version
+- preview_remount: fetching the uploaded app page and its script bundle, as a new preview iframe
+  does
+- upload_compact / upload_base64: uploading the same code in each upload format
+- run_prompt_auto_run: the `on_run_prompt` handler in auto-run mode, which also uploads the code
+  and loads the preview
+
+The bytes sent per upload in each format are reported too, along with:
+
+- history_payload_bytes: the size of the serialized state after `--history-revisions` revisions
+  of the template, with the prompt history kept in the state in full as before (`full`) and in
+  `history_store` (`store`)
+- auto_run_saved_seconds: the time auto-run saves compared to `run_prompt` followed by `upload`.
+  This does not count the time it takes the user to click Run, which auto-run also saves.
+- preview_swap_saved_seconds: the time saved by swapping the preview in place rather than
+  rebuilding the iframe. This only counts fetching the page, not starting the app in the
+  browser. The editor records the real load times from the browser in `main.preview_stats`.
+- render: the time to render the editor page with `--render-history` entries in the prompt
+  history, the number of components and serialized bytes of the rendered tree, and the
+  serialized size of the state. This is
+  measured with the dialogs and panels closed (`closed`), which is the usual case, and with all
+  of them open (`open`).
+
+Usage:
+
+  python benchmark.py --iterations 50 > results.json
+
+Results are written as JSON so that runs can be compared, such as before and after a change.
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from collections import defaultdict
+from urllib.parse import urljoin
+
+import flask
+import requests
+
+import fake_services
+from constants import EXAMPLE_CHAT_PROMPTS, TEMPLATES
+
+STAGES = [
+  "prompt_assembly",
+  "first_chunk",
+  "generation",
+  "post_processing",
+  "preflight",
+  "run_prompt",
+  "upload",
+  "upload_cached",
+  "preview_reload",
+  "preview_remount",
+  "upload_compact",
+  "upload_base64",
+  "run_prompt_auto_run",
+]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--iterations", type=int, default=20)
+  parser.add_argument("--model", default="gemini-1.5-flash")
+  parser.add_argument(
+    "--first-token-seconds", type=float, default=fake_services.GeminiConfig.first_token_seconds
+  )
+  parser.add_argument(
+    "--tokens-per-second", type=float, default=fake_services.GeminiConfig.tokens_per_second
+  )
+  parser.add_argument("--chunk-tokens", type=int, default=fake_services.GeminiConfig.chunk_tokens)
+  parser.add_argument("--exec-seconds", type=float, default=fake_services.RunnerConfig.exec_seconds)
+  parser.add_argument("--page-seconds", type=float, default=fake_services.RunnerConfig.page_seconds)
+  parser.add_argument("--history-revisions", type=int, default=20)
+  parser.add_argument("--render-history", type=int, default=200)
+  parser.add_argument("--bundle-bytes", type=int, default=fake_services.RunnerConfig.bundle_bytes)
+  parser.add_argument(
+    "--template",
+    default="advanced_chat.txt",
+    choices=sorted(TEMPLATES),
+    help="Template returned by the fake Gemini service as the generated app",
+  )
+  args = parser.parse_args()
+
+  gemini_config = fake_services.GeminiConfig(
+    first_token_seconds=args.first_token_seconds,
+    tokens_per_second=args.tokens_per_second,
+    chunk_tokens=args.chunk_tokens,
+    response_text=f"```python\n{TEMPLATES[args.template]}\n```",
+  )
+  runner_config = fake_services.RunnerConfig(
+    exec_seconds=args.exec_seconds,
+    page_seconds=args.page_seconds,
+    bundle_bytes=args.bundle_bytes,
+  )
+  gemini = fake_services.fake_gemini(gemini_config).start()
+  runner = fake_services.fake_runner(runner_config).start()
+
+  # These need to be set before the editor modules are imported.
+  os.environ["MESOP_APP_MAKER_GEMINI_ENDPOINT"] = gemini.url
+  os.environ["MESOP_APP_MAKER_RUNNER_URL"] = runner.url
+  os.environ["MESOP_APP_MAKER_RESPONSE_CACHE_DIR"] = ""
+  os.environ["MESOP_APP_MAKER_LLM_RATE_PER_MINUTE"] = "100000"
+  os.environ["MESOP_APP_MAKER_LLM_BURST"] = "100000"
+
+  try:
+    samples, upload_bytes = _run(args.iterations, args.model)
+    history_payload_bytes = _measure_history_payload(
+      TEMPLATES[args.template], args.history_revisions
+    )
+    render = _measure_render(TEMPLATES[args.template], args.render_history, args.iterations)
+  finally:
+    gemini.stop()
+    runner.stop()
+
+  stages = {stage: _summarize(samples[stage]) for stage in STAGES}
+  auto_run_saved_seconds = (
+    stages["run_prompt"]["mean"] + stages["upload"]["mean"] - stages["run_prompt_auto_run"]["mean"]
+    if args.iterations
+    else 0.0
+  )
+  print(
+    json.dumps(
+      {
+        "config": vars(args),
+        "stages": stages,
+        "upload_bytes": upload_bytes,
+        "history_payload_bytes": history_payload_bytes,
+        "render": render,
+        "auto_run_saved_seconds": auto_run_saved_seconds,
+        "preview_swap_saved_seconds": (
+          stages["preview_remount"]["mean"] - stages["preview_reload"]["mean"]
+          if args.iterations
+          else 0.0
+        ),
+      }
+    )
+  )
+
+
+def _run(iterations: int, model_name: str) -> tuple[dict[str, list[float]], dict[str, int]]:
+  import mesop as me
+
+  import llm
+  import main as editor
+  import preflight
+  import runner_client
+  from constants import PROMPT_MODE_GENERATE
+  from state import State
+
+  prompts = [
+    ("Create a counter app with increment and decrement buttons.", "general"),
+    ("Create a todo list app where items can be added and checked off.", "general"),
+  ] + [(prompt, "chat") for prompt in EXAMPLE_CHAT_PROMPTS]
+  api_key = "fake-api-key"
+  event = me.ClickEvent(key="", is_target=True)
+  samples = defaultdict(list)
+  upload_bytes = {}
+  app = flask.Flask(__name__)
+  for i in range(iterations):
+    prompt, app_type = prompts[i % len(prompts)]
+    # Vary the prompt so that nothing is served from a cache.
+    prompt = f"{prompt}\n\nBenchmark iteration {i}."
+
+    start = time.monotonic()
+    llm.get_generate_prompt_base(app_type).replace("<APP_DESCRIPTION>", prompt)
+    llm.model_registry.get(api_key, model_name, app_type, doc_query=prompt)
+    samples["prompt_assembly"].append(time.monotonic() - start)
+
+    start = time.monotonic()
+    chunks = []
+    for chunk in llm.generate_mesop_app(prompt, model_name, api_key, app_type, stream=True):
+      if not chunks:
+        samples["first_chunk"].append(time.monotonic() - start)
+      chunks.append(chunk)
+    samples["generation"].append(time.monotonic() - start)
+
+    start = time.monotonic()
+    code = llm.postprocess_code("".join(chunks)).code
+    samples["post_processing"].append(time.monotonic() - start)
+
+    start = time.monotonic()
+    preflight.find_errors(code)
+    samples["preflight"].append(time.monotonic() - start)
+
+    with app.app_context():
+      state = me.state(State)
+      state.api_key = api_key
+      state.model = model_name
+      state.prompt = prompt
+      state.prompt_mode = PROMPT_MODE_GENERATE
+      state.prompt_app_type = app_type
+
+      start = time.monotonic()
+      for _ in editor.on_run_prompt(event):
+        pass
+      samples["run_prompt"].append(time.monotonic() - start)
+
+      if runner_client.client.upload_cache:
+        runner_client.client.upload_cache.invalidate(state.runner_url.removesuffix("/"))
+      start = time.monotonic()
+      for _ in editor.on_run_code(event):
+        pass
+      samples["upload"].append(time.monotonic() - start)
+      if state.show_error_dialog:
+        print(f"Upload failed: {state.error}", file=sys.stderr)
+
+      start = time.monotonic()
+      for _ in editor.on_run_code(event):
+        pass
+      samples["upload_cached"].append(time.monotonic() - start)
+
+      start = time.monotonic()
+      requests.get(state.loaded_url, timeout=30).raise_for_status()
+      samples["preview_reload"].append(time.monotonic() - start)
+
+      start = time.monotonic()
+      page = requests.get(state.loaded_url, timeout=30)
+      page.raise_for_status()
+      for script in re.findall(r'<script src="([^"]+)"', page.text):
+        requests.get(urljoin(state.loaded_url, script), timeout=30).raise_for_status()
+      samples["preview_remount"].append(time.monotonic() - start)
+
+      runner_stats = runner_client.client.stats[state.runner_url.removesuffix("/")]
+      for upload_format in [
+        runner_client.UPLOAD_FORMAT_COMPACT,
+        runner_client.UPLOAD_FORMAT_BASE64,
+      ]:
+        bytes_sent = runner_stats.bytes_sent
+        start = time.monotonic()
+        runner_client.client.exec(state.runner_url, "", state.code, upload_format=upload_format)
+        samples[f"upload_{upload_format}"].append(time.monotonic() - start)
+        upload_bytes[upload_format] = runner_stats.bytes_sent - bytes_sent
+
+      state.prompt = f"{prompt} Auto-run."
+      state.prompt_mode = PROMPT_MODE_GENERATE
+      state.auto_run = True
+      if runner_client.client.upload_cache:
+        runner_client.client.upload_cache.invalidate(state.runner_url.removesuffix("/"))
+      start = time.monotonic()
+      for _ in editor.on_run_prompt(event):
+        pass
+      samples["run_prompt_auto_run"].append(time.monotonic() - start)
+      state.auto_run = False
+      if state.show_error_dialog:
+        print(f"Auto-run failed: {state.error}", file=sys.stderr)
+
+    print(f"Finished iteration {i + 1}/{iterations}", file=sys.stderr)
+  return samples, upload_bytes
+
+
+def _measure_history_payload(code: str, revisions: int) -> dict[str, int]:
+  """Returns the serialized state size with the prompt history in full and in the store."""
+  from mesop.dataclass_utils import serialize_dataclass
+
+  import history_store
+  import prompt_history
+  from state import State
+
+  full = State(code=code, code_placeholder=code)
+  store = State(code=code, code_placeholder=code)
+  parent_id = None
+  for i in range(revisions):
+    prompt = f"Revision {i}: change the title and add a settings button to the sidebar."
+    # Each revision changes a few lines, like a typical revise prompt.
+    code = code.replace("\n\n", f"\n\n# Revision {i}\n", 1)
+    full.prompt_history.append(
+      {"index": i, "mode": "Revise", "app_type": "chat", "prompt": prompt, "code": code}
+    )
+    parent_id = history_store.store.put(code, parent_id)
+    prompt_history.add(
+      store,
+      prompt_id=history_store.store.put(prompt),
+      prompt_preview=prompt[:100],
+      code_id=parent_id,
+      mode="Revise",
+      app_type="chat",
+    )
+  return {
+    "full": len(serialize_dataclass(full)),
+    "store": len(serialize_dataclass(store)),
+  }
+
+
+def _measure_render(code: str, history_entries: int, iterations: int) -> dict[str, dict]:
+  """Renders the editor page and returns its render time and size, with everything closed and
+  with every dialog and panel open."""
+  import mesop as me
+  import mesop.protos.ui_pb2 as pb
+  from mesop.dataclass_utils import serialize_dataclass
+  from mesop.runtime import runtime
+
+  import main as editor
+  import prompt_history
+  from state import State
+
+  results = {}
+  app = flask.Flask(__name__)
+  for name, is_open in [("closed", False), ("open", True)]:
+    with app.app_context():
+      context = runtime().context()
+      context.set_theme_settings(pb.ThemeSettings(theme_mode=pb.ThemeMode.THEME_MODE_LIGHT))
+      state = me.state(State)
+      state.code = state.code_placeholder = code
+      for i in range(history_entries):
+        prompt_history.add(
+          state,
+          prompt_id="",
+          prompt_preview=f"Revision {i}: change the title and add a settings button to the sidebar.",
+          code_id="",
+          mode="Revise",
+          app_type="chat",
+        )
+      state.error = "Traceback (most recent call last):\n" * 20
+      state.show_error_dialog = state.show_new_dialog = state.show_help_dialog = is_open
+      state.show_generate_panel = state.show_prompt_history_panel = is_open
+      state.show_status_snackbar = is_open
+
+      samples = []
+      for _ in range(max(iterations, 1)):
+        start = time.monotonic()
+        editor.main()
+        samples.append(time.monotonic() - start)
+        root = context.current_node()
+        components = _count_components(root)
+        tree_bytes = root.ByteSize()
+        context.reset_current_node()
+      results[name] = dict(
+        _summarize(samples),
+        components=components,
+        bytes=tree_bytes,
+        state_bytes=len(serialize_dataclass(state)),
+      )
+  return results
+
+
+def _count_components(component) -> int:
+  return 1 + sum(_count_components(child) for child in component.children)
+
+
+def _summarize(samples: list[float]) -> dict:
+  if not samples:
+    return {"count": 0}
+  if len(samples) == 1:
+    p50 = p95 = p99 = samples[0]
+  else:
+    quantiles = statistics.quantiles(samples, n=100, method="inclusive")
+    p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+  return {
+    "count": len(samples),
+    "mean": statistics.mean(samples),
+    "p50": p50,
+    "p95": p95,
+    "p99": p99,
+    "max": max(samples),
+  }
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,126 @@
+"""Generates several candidates in parallel and returns the first one that passes checks.
+
+Since generation uses a temperature of 1, candidates differ and one that breaks the prompt
+rules is often accompanied by one that does not. Candidates are checked locally with
+`code_checks` as they arrive, and the remaining requests are cancelled once one passes.
+
+Each candidate is a separate request to the LLM, so every candidate after the first needs its own
+admission from the scheduler. Candidates that cannot be admitted right away are skipped rather
+than going over the rate limit.
+"""
+
+import logging
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any
+
+import code_checks
+from hedging import read_stream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_CANDIDATES = 3
+
+
+@dataclass
+class CandidateResult:
+  text: str
+  violations: list[code_checks.Violation]
+  # Number of candidates that finished before this one was picked, including itself.
+  candidates_checked: int
+
+
+@dataclass
+class CandidateStats:
+  requests: int = 0
+  passed: int = 0
+  candidates_checked: int = 0
+  # Candidates that were not requested because the scheduler had no capacity for them.
+  skipped: int = 0
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, result: CandidateResult):
+    with self._lock:
+      self.requests += 1
+      self.passed += not result.violations
+      self.candidates_checked += result.candidates_checked
+
+  def record_skipped(self, count: int):
+    with self._lock:
+      self.skipped += count
+
+
+class CandidateGenerator:
+  def __init__(self, max_workers: int = 8):
+    self.stats = CandidateStats()
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="candidate")
+
+  def run(
+    self,
+    call: Callable[[int], Iterator[str]],
+    num_candidates: int,
+    extract_code: Callable[[str], str],
+    admit: Callable[[], Any] | None = None,
+  ) -> CandidateResult:
+    """Runs `call` concurrently and returns the first candidate without violations.
+
+    If no candidate passes, the one with the fewest violations is returned.
+
+    Args:
+      call: Takes the index of a candidate and returns an iterator of text chunks for it
+      num_candidates: How many candidates to request
+      extract_code: Extracts the code to check from the LLM output
+      admit: Returns a ticket with a `release` method if another candidate may be requested, or
+        None if it may not. The caller's own admission covers the first candidate.
+    """
+    cancelled = threading.Event()
+
+    def consume(index: int, ticket: Any) -> str:
+      try:
+        # Starting the stream waits for the first chunk, so do it on the worker thread too.
+        return read_stream(call(index), cancelled)
+      finally:
+        if ticket:
+          ticket.release()
+
+    pending = {self._executor.submit(consume, 0, None)}
+    for index in range(1, num_candidates):
+      ticket = admit() if admit else None
+      if admit and ticket is None:
+        self.stats.record_skipped(num_candidates - index)
+        break
+      pending.add(self._executor.submit(consume, index, ticket))
+    best = None
+    first_error = None
+    checked = 0
+    try:
+      while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          try:
+            text = future.result()
+          except Exception as e:
+            logger.warning("Candidate request failed", exc_info=True)
+            first_error = first_error or e
+            continue
+          checked += 1
+          result = CandidateResult(
+            text=text,
+            violations=code_checks.find_violations(extract_code(text)),
+            candidates_checked=checked,
+          )
+          if not result.violations:
+            self.stats.record(result)
+            return result
+          if best is None or len(result.violations) < len(best.violations):
+            best = result
+    finally:
+      cancelled.set()
+
+    if best is None:
+      raise first_error
+    best.candidates_checked = checked
+    self.stats.record(best)
+    return best
@@ -0,0 +1,43 @@
+from candidates import CandidateGenerator
+
+
+class FakeTicket:
+  def __init__(self):
+    self.released = False
+
+  def release(self):
+    self.released = True
+
+
+def test_each_candidate_gets_its_own_index():
+  generator = CandidateGenerator()
+  indexes = []
+
+  def call(index):
+    indexes.append(index)
+    return iter(["x = 1"])
+
+  result = generator.run(call, 3, lambda text: text)
+  generator._executor.shutdown(wait=True)
+
+  assert result.text == "x = 1"
+  assert sorted(indexes) == [0, 1, 2]
+
+
+def test_extra_candidates_need_admission():
+  generator = CandidateGenerator()
+  tickets = [FakeTicket()]
+  admitted = []
+
+  def admit():
+    if tickets:
+      admitted.append(tickets.pop())
+      return admitted[-1]
+    return None
+
+  generator.run(lambda index: iter(["x = 1"]), 3, lambda text: text, admit=admit)
+  generator._executor.shutdown(wait=True)
+
+  assert len(admitted) == 1
+  assert admitted[0].released
+  assert generator.stats.skipped == 1
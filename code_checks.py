@@ -0,0 +1,158 @@
+"""Local checks for the rules the generate/revise prompts ask the LLM to follow.
+
+These catch common mistakes without a round trip to the runner. Rules that only concern style,
+such as the button type, are reported as warnings, which are not repaired and do not count
+against a response.
+"""
+
+import ast
+from dataclasses import dataclass, field
+
+RULE_PAGE_DECORATOR = "page_decorator"
+RULE_LAMBDA_HANDLER = "lambda_handler"
+RULE_HANDLER_PARAMS = "handler_params"
+RULE_PADDING = "padding"
+RULE_MARGIN = "margin"
+RULE_BORDER = "border"
+RULE_BUTTON_TYPE = "button_type"
+RULE_SYNTAX = "syntax"
+
+
+@dataclass
+class Violation:
+  rule: str
+  line: int
+  message: str
+  # Node that violates the rule, so that it can be repaired.
+  node: ast.AST | None = field(default=None, repr=False, compare=False)
+  warning: bool = False
+
+
+def find_violations(code: str) -> list[Violation]:
+  """Returns the rule violations in the given code.
+
+  A syntax error is returned as the only violation since nothing else can be checked.
+  """
+  return [violation for violation in _check(code) if not violation.warning]
+
+
+def find_warnings(code: str) -> list[Violation]:
+  """Returns the style rules the given code does not follow."""
+  return [violation for violation in _check(code) if violation.warning]
+
+
+def _check(code: str) -> list[Violation]:
+  try:
+    tree = ast.parse(code)
+  except SyntaxError as e:
+    return [Violation(RULE_SYNTAX, e.lineno or 0, f"Syntax error: {e.msg}")]
+
+  functions = {
+    node.name: node
+    for node in ast.walk(tree)
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+  }
+  violations = []
+  for node in ast.walk(tree):
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+      violations.extend(_check_page_decorator(node))
+    elif isinstance(node, ast.Call):
+      violations.extend(_check_call(node, functions))
+  return sorted(violations, key=lambda violation: violation.line)
+
+
+def is_me_attribute(node: ast.AST, name: str) -> bool:
+  """Whether the node is `me.<name>`."""
+  return (
+    isinstance(node, ast.Attribute)
+    and node.attr == name
+    and isinstance(node.value, ast.Name)
+    and node.value.id == "me"
+  )
+
+
+def _check_page_decorator(node: ast.FunctionDef | ast.AsyncFunctionDef) -> list[Violation]:
+  for decorator in node.decorator_list:
+    if (
+      isinstance(decorator, ast.Call)
+      and is_me_attribute(decorator.func, "page")
+      and (decorator.args or decorator.keywords)
+    ):
+      return [
+        Violation(
+          RULE_PAGE_DECORATOR, decorator.lineno, "@me.page() should have no arguments", decorator
+        )
+      ]
+  return []
+
+
+def _check_call(node: ast.Call, functions: dict[str, ast.FunctionDef]) -> list[Violation]:
+  violations = []
+  if is_me_attribute(node.func, "button") and not any(
+    keyword.arg in ("type", None) for keyword in node.keywords
+  ):
+    violations.append(
+      Violation(
+        RULE_BUTTON_TYPE, node.lineno, 'Buttons should prefer type="flat"', node, warning=True
+      )
+    )
+  for keyword in node.keywords:
+    if keyword.arg is None:
+      continue
+    if keyword.arg.startswith("on_"):
+      violations.extend(_check_handler(keyword, functions))
+    elif keyword.arg in ("padding", "margin") and _is_plain_value(keyword.value):
+      violations.append(
+        Violation(
+          RULE_PADDING if keyword.arg == "padding" else RULE_MARGIN,
+          keyword.value.lineno,
+          f"{keyword.arg} should use me.{keyword.arg.title()} rather than a string or int",
+          keyword.value,
+        )
+      )
+    elif keyword.arg == "border" and _is_plain_value(keyword.value):
+      violations.append(
+        Violation(
+          RULE_BORDER,
+          keyword.value.lineno,
+          "border should use me.Border and me.BorderSide rather than a string",
+          keyword.value,
+        )
+      )
+  return violations
+
+
+def _check_handler(keyword: ast.keyword, functions: dict[str, ast.FunctionDef]) -> list[Violation]:
+  if isinstance(keyword.value, ast.Lambda):
+    return [
+      Violation(
+        RULE_LAMBDA_HANDLER,
+        keyword.value.lineno,
+        f"{keyword.arg} should be a function rather than a lambda",
+        keyword.value,
+      )
+    ]
+  if isinstance(keyword.value, ast.Name) and keyword.value.id in functions:
+    args = functions[keyword.value.id].args
+    num_params = len(args.posonlyargs) + len(args.args) + len(args.kwonlyargs)
+    if num_params > 1:
+      return [
+        Violation(
+          RULE_HANDLER_PARAMS,
+          keyword.value.lineno,
+          f"Event handler {keyword.value.id} should only accept the event",
+          functions[keyword.value.id],
+        )
+      ]
+  return []
+
+
+def _is_plain_value(node: ast.AST) -> bool:
+  """Whether the node is a string or number literal, such as `padding="10px"`."""
+  if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+    node = node.operand
+  return (
+    isinstance(node, ast.Constant)
+    and isinstance(node.value, (str, int, float))
+    and not isinstance(node.value, bool)
+  ) or isinstance(node, ast.JoinedStr)
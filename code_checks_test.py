@@ -0,0 +1,73 @@
+import pytest
+
+import code_checks
+from code_checks import find_violations, find_warnings
+
+VALID_CODE = """import mesop as me
+
+
+@me.page()
+def page():
+  with me.box(style=me.Style(padding=me.Padding.all(8), border=me.Border.all(me.BorderSide()))):
+    me.button("Go", type="flat", on_click=on_click)
+
+
+def on_click(e: me.ClickEvent):
+  pass
+"""
+
+
+def rules(code: str) -> list[str]:
+  return [violation.rule for violation in find_violations(code)]
+
+
+def test_valid_code_has_no_violations():
+  assert find_violations(VALID_CODE) == []
+  assert find_warnings(VALID_CODE) == []
+
+
+def test_syntax_error_is_the_only_violation():
+  violations = find_violations("def page(:\n  me.text(padding=8)\n")
+
+  assert [violation.rule for violation in violations] == [code_checks.RULE_SYNTAX]
+  assert find_warnings("def page(:\n") == []
+
+
+def test_page_decorator_with_arguments():
+  code = VALID_CODE.replace("@me.page()", '@me.page(path="/")')
+
+  assert rules(code) == [code_checks.RULE_PAGE_DECORATOR]
+
+
+def test_lambda_handler():
+  code = VALID_CODE.replace("on_click=on_click", "on_click=lambda e: on_click(e)")
+
+  assert rules(code) == [code_checks.RULE_LAMBDA_HANDLER]
+
+
+def test_handler_with_extra_params():
+  code = VALID_CODE.replace("e: me.ClickEvent", "e: me.ClickEvent, index: int")
+
+  assert rules(code) == [code_checks.RULE_HANDLER_PARAMS]
+
+
+@pytest.mark.parametrize(
+  "style, rule",
+  [
+    ('padding="8px"', code_checks.RULE_PADDING),
+    ("padding=-8", code_checks.RULE_PADDING),
+    ("margin=f'{8}px'", code_checks.RULE_MARGIN),
+    ('border="1px solid #ccc"', code_checks.RULE_BORDER),
+  ],
+)
+def test_plain_style_values(style: str, rule: str):
+  code = VALID_CODE.replace("padding=me.Padding.all(8)", style)
+
+  assert rule in rules(code)
+
+
+def test_button_without_type_is_a_warning():
+  code = VALID_CODE.replace('type="flat", ', "")
+
+  assert find_violations(code) == []
+  assert [violation.rule for violation in find_warnings(code)] == [code_checks.RULE_BUTTON_TYPE]
@@ -0,0 +1,321 @@
+"""Post-processing for generated code before it reaches the editor.
+
+Extracts the code from the LLM response, checks it against the prompt rules with
+`code_checks` and mechanically rewrites the violations that have an obvious fix, such as
+`padding="8px 16px"` to `padding=me.Padding.symmetric(vertical=8, horizontal=16)`. This is much
+cheaper than asking the LLM to fix its own output or finding out from the runner.
+
+Violations without an obvious fix, such as event handlers with extra parameters, are reported
+but left alone, as are warnings.
+"""
+
+import ast
+import json
+import re
+import textwrap
+import threading
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import code_checks
+from code_checks import Violation
+
+RULE_EXTRA_TEXT = "extra_text"
+
+BORDER_STYLES = frozenset(
+  ["none", "solid", "dashed", "dotted", "double", "groove", "ridge", "inset", "outset", "hidden"]
+)
+
+_FENCE_RE = re.compile(r"^[ \t]*```[ \t]*([\w+-]*)[ \t]*$")
+_PIXELS_RE = re.compile(r"^(-?\d+)(px)?$")
+_LENGTH_RE = re.compile(r"^-?\d+(\.\d+)?(px|em|rem|%|pt)?$|^(thin|medium|thick)$")
+# Splits CSS values on whitespace while keeping functions such as `rgba(0, 0, 0, 0.1)` whole.
+_CSS_TOKEN_RE = re.compile(r"[^\s(]+\([^)]*\)|\S+")
+
+
+@dataclass
+class RepairResult:
+  code: str
+  # All violations found in the LLM response.
+  violations: list[Violation]
+  # Violations that were repaired.
+  fixed: list[Violation]
+  # Violations that are still in the code.
+  remaining: list[Violation]
+  # Style rules the code does not follow. These are not repaired.
+  warnings: list[Violation] = field(default_factory=list)
+
+
+@dataclass
+class RepairStats:
+  responses: int = 0
+  # Responses with at least one violation.
+  responses_with_violations: int = 0
+  # Responses where every violation was repaired.
+  responses_repaired: int = 0
+  detected: Counter = field(default_factory=Counter)
+  fixed: Counter = field(default_factory=Counter)
+  warnings: Counter = field(default_factory=Counter)
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, result: RepairResult):
+    with self._lock:
+      self.responses += 1
+      self.responses_with_violations += bool(result.violations)
+      self.responses_repaired += bool(result.violations) and not result.remaining
+      self.detected.update(violation.rule for violation in result.violations)
+      self.fixed.update(violation.rule for violation in result.fixed)
+      self.warnings.update(violation.rule for violation in result.warnings)
+
+  @property
+  def repair_rate(self) -> float:
+    """Fraction of responses with violations that no longer have any."""
+    if not self.responses_with_violations:
+      return 0.0
+    return self.responses_repaired / self.responses_with_violations
+
+
+def process(text: str) -> RepairResult:
+  """Extracts, checks and repairs the code in an LLM response."""
+  code, extra_text = extract_code(text)
+  violations = code_checks.find_violations(code)
+  repaired, fixed = repair(code, violations)
+  if extra_text:
+    # Extracting the code already removed the extra text.
+    extra_text_violation = Violation(RULE_EXTRA_TEXT, 1, "Only the Python code should be output")
+    violations.insert(0, extra_text_violation)
+    fixed.insert(0, extra_text_violation)
+  return RepairResult(
+    code=repaired,
+    violations=violations,
+    fixed=fixed,
+    remaining=code_checks.find_violations(repaired) if fixed else list(violations),
+    warnings=code_checks.find_warnings(repaired),
+  )
+
+
+def extract_code(text: str) -> tuple[str, bool]:
+  """Extracts the Python code from an LLM response.
+
+  The response is usually a single ```python block, but may have text around it, several
+  blocks, or be cut off before the closing fence.
+
+  Returns:
+    The code and whether the response had anything other than the code.
+  """
+  stripped = text.strip()
+  if _parses(stripped):
+    return stripped, False
+
+  blocks = _find_code_blocks(stripped)
+  if not blocks:
+    return stripped, False
+  python_blocks = [block for block in blocks if block[0] in ("python", "py", "")] or blocks
+  _, code, start, end = max(python_blocks, key=lambda block: len(block[1]))
+  return code, bool(stripped[:start].strip() or stripped[end:].strip())
+
+
+def repair(code: str, violations: list[Violation]) -> tuple[str, list[Violation]]:
+  """Rewrites the violations that have a mechanical fix.
+
+  Returns:
+    The repaired code and the violations that were fixed.
+  """
+  source = _Source(code)
+  edits = []
+  for violation in violations:
+    fixer = _FIXERS.get(violation.rule)
+    edit = fixer(violation.node, source) if fixer and violation.node else None
+    if edit:
+      edits.append((edit, violation))
+  if not edits:
+    return code, []
+
+  # Apply edits back to front so that earlier offsets stay valid. Nested violations are not
+  # expected, but skip overlapping edits just in case.
+  fixed = []
+  repaired = code
+  next_start = len(code) + 1
+  for (start, end, replacement), violation in sorted(edits, key=lambda edit: edit[0], reverse=True):
+    if end > next_start:
+      continue
+    repaired = repaired[:start] + replacement + repaired[end:]
+    next_start = start
+    fixed.append(violation)
+
+  if not _parses(repaired):
+    return code, []
+  return repaired, sorted(fixed, key=lambda violation: violation.line)
+
+
+class _Source:
+  """Maps AST positions to offsets in the source string."""
+
+  def __init__(self, code: str):
+    self.code = code
+    self.lines = code.split("\n")
+    self.line_starts = [0]
+    for line in self.lines:
+      self.line_starts.append(self.line_starts[-1] + len(line) + 1)
+
+  def offset(self, lineno: int, col_offset: int) -> int:
+    # AST column offsets are in UTF-8 bytes.
+    line = self.lines[lineno - 1]
+    return self.line_starts[lineno - 1] + len(line.encode()[:col_offset].decode())
+
+  def start(self, node: ast.AST) -> int:
+    return self.offset(node.lineno, node.col_offset)
+
+  def end(self, node: ast.AST) -> int:
+    return self.offset(node.end_lineno, node.end_col_offset)
+
+  def segment(self, node: ast.AST) -> str:
+    return self.code[self.start(node) : self.end(node)]
+
+
+_Edit = tuple[int, int, str]
+
+
+def _fix_page_decorator(node: ast.Call, source: _Source) -> _Edit:
+  return source.start(node), source.end(node), "me.page()"
+
+
+def _fix_lambda_handler(node: ast.Lambda, source: _Source) -> _Edit | None:
+  """Replaces lambdas that only forward the event, such as `lambda e: on_click(e)`."""
+  params = node.args.args
+  body = node.body
+  if (
+    len(params) == 1
+    and not (node.args.posonlyargs or node.args.kwonlyargs or node.args.vararg)
+    and isinstance(body, ast.Call)
+    and not body.keywords
+    and len(body.args) == 1
+    and isinstance(body.args[0], ast.Name)
+    and body.args[0].id == params[0].arg
+    and isinstance(body.func, (ast.Name, ast.Attribute))
+  ):
+    return source.start(node), source.end(node), source.segment(body.func)
+  return None
+
+
+def _fix_box_spacing(class_name: str) -> Callable[[ast.AST, _Source], _Edit | None]:
+  def fix(node: ast.AST, source: _Source) -> _Edit | None:
+    value = _constant_value(node)
+    if isinstance(value, int):
+      values = [value]
+    elif isinstance(value, str):
+      values = [_css_length(token) for token in value.split()]
+    else:
+      return None
+    if not values or any(isinstance(value, str) and "(" in value for value in values):
+      return None
+
+    args = [_format_value(value) for value in values]
+    if len(args) == 1:
+      replacement = f"me.{class_name}.all({args[0]})"
+    elif len(args) == 2:
+      replacement = f"me.{class_name}.symmetric(vertical={args[0]}, horizontal={args[1]})"
+    elif len(args) == 3:
+      replacement = (
+        f"me.{class_name}(top={args[0]}, right={args[1]}, bottom={args[2]}, left={args[1]})"
+      )
+    elif len(args) == 4:
+      replacement = (
+        f"me.{class_name}(top={args[0]}, right={args[1]}, bottom={args[2]}, left={args[3]})"
+      )
+    else:
+      return None
+    return source.start(node), source.end(node), replacement
+
+  return fix
+
+
+def _fix_border(node: ast.AST, source: _Source) -> _Edit | None:
+  """Rewrites CSS border shorthand such as `1px solid #ccc`."""
+  value = _constant_value(node)
+  if value == 0:
+    value = "none"
+  if not isinstance(value, str):
+    return None
+
+  side = {}
+  for token in _CSS_TOKEN_RE.findall(value):
+    if token in BORDER_STYLES:
+      name = "style"
+    elif _LENGTH_RE.match(token):
+      name = "width"
+      token = _css_length(token)
+    else:
+      name = "color"
+    if name in side:
+      return None
+    side[name] = token
+  if not side:
+    return None
+
+  args = ", ".join(
+    f"{name}={_format_value(side[name])}" for name in ("width", "style", "color") if name in side
+  )
+  return source.start(node), source.end(node), f"me.Border.all(me.BorderSide({args}))"
+
+
+_FIXERS: dict[str, Callable[[ast.AST, _Source], _Edit | None]] = {
+  code_checks.RULE_PAGE_DECORATOR: _fix_page_decorator,
+  code_checks.RULE_LAMBDA_HANDLER: _fix_lambda_handler,
+  code_checks.RULE_PADDING: _fix_box_spacing("Padding"),
+  code_checks.RULE_MARGIN: _fix_box_spacing("Margin"),
+  code_checks.RULE_BORDER: _fix_border,
+}
+
+
+def _find_code_blocks(text: str) -> list[tuple[str, str, int, int]]:
+  """Finds fenced code blocks as (language, code, start offset, end offset)."""
+  blocks = []
+  language = None
+  block_start = content_start = 0
+  offset = 0
+  for line in text.split("\n"):
+    line_end = offset + len(line) + 1
+    match = _FENCE_RE.match(line)
+    if match and language is None:
+      language = match.group(1).lower()
+      block_start = offset
+      content_start = line_end
+    elif match and not match.group(1) and language is not None:
+      blocks.append(
+        (language, textwrap.dedent(text[content_start:offset]).strip(), block_start, line_end)
+      )
+      language = None
+    offset = line_end
+  if language is not None:
+    # The response was cut off before the closing fence.
+    blocks.append((language, textwrap.dedent(text[content_start:]).strip(), block_start, offset))
+  return blocks
+
+
+def _constant_value(node: ast.AST) -> int | float | str | None:
+  if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+    value = _constant_value(node.operand)
+    return -value if isinstance(value, (int, float)) else None
+  if isinstance(node, ast.Constant) and not isinstance(node.value, bool):
+    return node.value
+  return None
+
+
+def _css_length(token: str) -> int | str:
+  """Converts pixel lengths to ints, since that is what Mesop uses for pixels."""
+  match = _PIXELS_RE.match(token)
+  return int(match.group(1)) if match else token
+
+
+def _format_value(value: int | str) -> str:
+  return str(value) if isinstance(value, int) else json.dumps(value)
+
+
+def _parses(code: str) -> bool:
+  try:
+    ast.parse(code)
+  except SyntaxError:
+    return False
+  return True
@@ -0,0 +1,78 @@
+import pytest
+
+import code_checks
+from code_checks_test import VALID_CODE
+from code_repair import RULE_EXTRA_TEXT, extract_code, process
+
+
+def test_valid_code_is_left_alone():
+  result = process(VALID_CODE)
+
+  assert result.code == VALID_CODE.strip()
+  assert result.violations == result.fixed == result.remaining == result.warnings == []
+
+
+@pytest.mark.parametrize(
+  "valid, invalid",
+  [
+    ("@me.page()", '@me.page(path="/")'),
+    ("on_click=on_click", "on_click=lambda e: on_click(e)"),
+    ("padding=me.Padding.all(8)", 'padding="8px"'),
+    ("padding=me.Padding.all(8)", 'padding="8px 16px"'),
+    ("padding=me.Padding.all(8)", "margin=4"),
+    (
+      "border=me.Border.all(me.BorderSide())",
+      'border="1px solid #ccc"',
+    ),
+  ],
+)
+def test_violation_is_repaired(valid: str, invalid: str):
+  result = process(VALID_CODE.replace(valid, invalid))
+
+  assert len(result.fixed) == len(result.violations) == 1
+  assert result.remaining == []
+  assert invalid not in result.code
+
+
+def test_repairs_use_mesop_classes():
+  code = VALID_CODE.replace("padding=me.Padding.all(8)", 'padding="8px 16px"').replace(
+    "border=me.Border.all(me.BorderSide())", 'border="1px solid #ccc"'
+  )
+
+  result = process(code)
+
+  assert "padding=me.Padding.symmetric(vertical=8, horizontal=16)" in result.code
+  assert 'border=me.Border.all(me.BorderSide(width=1, style="solid", color="#ccc"))' in result.code
+
+
+def test_handler_with_extra_params_is_reported():
+  code = VALID_CODE.replace("e: me.ClickEvent", "e: me.ClickEvent, index: int")
+
+  result = process(code)
+
+  assert result.code == code.strip()
+  assert [violation.rule for violation in result.remaining] == [code_checks.RULE_HANDLER_PARAMS]
+
+
+def test_button_type_is_a_warning_and_not_rewritten():
+  code = VALID_CODE.replace('type="flat", ', "")
+
+  result = process(code)
+
+  assert result.code == code.strip()
+  assert result.violations == []
+  assert [violation.rule for violation in result.warnings] == [code_checks.RULE_BUTTON_TYPE]
+
+
+def test_extra_text_is_removed():
+  result = process(f"Here is the app:\n```python\n{VALID_CODE}```\nEnjoy!")
+
+  assert result.code == VALID_CODE.strip()
+  assert [violation.rule for violation in result.fixed] == [RULE_EXTRA_TEXT]
+
+
+def test_code_is_extracted_from_a_cut_off_response():
+  code, extra_text = extract_code(f"```python\n{VALID_CODE}")
+
+  assert code == VALID_CODE.strip()
+  assert not extra_text
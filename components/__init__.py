@@ -4,5 +4,7 @@ from components.card import card as card
 from components.card import expandable_card as expandable_card
 from components.dialog import dialog as dialog
 from components.dialog import dialog_actions as dialog_actions
+from components.dialog import lazy_dialog as lazy_dialog
 from components.panel import panel as panel
+from components.panel import lazy_panel as lazy_panel
 from components.snackbar import snackbar as snackbar
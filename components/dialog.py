@@ -1,3 +1,5 @@
+from collections.abc import Callable
+
 import mesop as me
 
 
@@ -29,27 +31,27 @@ def dialog(is_open: bool):
       z_index=2000,
     )
   ):
-    with me.box(
-      style=me.Style(
-        align_items="center",
-        display="grid",
-        height="100vh",
-        justify_items="center",
-      )
-    ):
-      with me.box(
-        style=me.Style(
-          background=me.theme_var("surface-container-lowest"),
-          border_radius=20,
-          box_sizing="content-box",
-          box_shadow=("0 3px 1px -2px #0003, 0 2px 2px #00000024, 0 1px 5px #0000001f"),
-          margin=me.Margin.symmetric(vertical="0", horizontal="auto"),
-          padding=me.Padding.all(20),
-        )
-      ):
+    with me.box(style=_GRID_STYLE):
+      with me.box(style=_CONTENT_STYLE):
         me.slot()
 
 
+@me.component
+def lazy_dialog(is_open: bool, content: Callable[[], None]):
+  """Renders a dialog whose content is only built while it is open.
+
+  The body of `with dialog(...)` is built on every render even when the dialog is hidden, so
+  large dialogs should use this instead.
+
+  Args:
+    is_open: Whether the dialog is visible or not.
+    content: Renders the content of the dialog.
+  """
+  if is_open:
+    with dialog(is_open=True):
+      content()
+
+
 @me.content_component
 def dialog_actions():
   """Helper component for rendering action buttons so they are right aligned.
@@ -57,7 +59,24 @@ def dialog_actions():
   This component is optional. If you want to position action buttons differently,
   you can just write your own Mesop markup.
   """
-  with me.box(
-    style=me.Style(display="flex", gap=5, justify_content="end", margin=me.Margin(top=20))
-  ):
+  with me.box(style=_ACTIONS_STYLE):
     me.slot()
+
+
+_GRID_STYLE = me.Style(
+  align_items="center",
+  display="grid",
+  height="100vh",
+  justify_items="center",
+)
+
+_CONTENT_STYLE = me.Style(
+  background=me.theme_var("surface-container-lowest"),
+  border_radius=20,
+  box_sizing="content-box",
+  box_shadow=("0 3px 1px -2px #0003, 0 2px 2px #00000024, 0 1px 5px #0000001f"),
+  margin=me.Margin.symmetric(vertical="0", horizontal="auto"),
+  padding=me.Padding.all(20),
+)
+
+_ACTIONS_STYLE = me.Style(display="flex", gap=5, justify_content="end", margin=me.Margin(top=20))
@@ -18,39 +18,62 @@ def panel(is_open: bool, title: str, on_click_close: Callable | None = None, key
       z_index=1000,
     )
   ):
-    with me.box(
-      style=me.Style(
-        align_items="center",
-        display="grid",
-        height="calc(100vh - 10px)",
-        justify_items="end",
-      )
-    ):
-      with me.box(
-        style=me.Style(
-          background=me.theme_var("surface-container-low"),
-          border_radius=5,
-          box_sizing="border-box",
-          border=me.Border.all(
-            me.BorderSide(width=1, color=me.theme_var("outline-variant"), style="solid"),
-          ),
-          margin=me.Margin(top=10, right=5),
-          padding=me.Padding.all(20),
-          pointer_events="auto",
-          height="100%",
-          width="30%",
-        )
-      ):
-        with me.box(
-          style=me.Style(
-            align_items="center",
-            display="flex",
-            justify_content="space-between",
-            margin=me.Margin(bottom=15),
-          ),
-        ):
-          me.text(title, style=me.Style(font_size=16, font_weight="bold"))
-          with me.box(key=f"show_{key}", on_click=on_click_close, style=me.Style(cursor="pointer")):
+    with me.box(style=_GRID_STYLE):
+      with me.box(style=_CONTENT_STYLE):
+        with me.box(style=_HEADER_STYLE):
+          me.text(title, style=_TITLE_STYLE)
+          with me.box(key=f"show_{key}", on_click=on_click_close, style=_CLOSE_STYLE):
             me.icon("close")
 
         me.slot()
+
+
+@me.component
+def lazy_panel(
+  is_open: bool,
+  title: str,
+  content: Callable[[], None],
+  on_click_close: Callable | None = None,
+  key: str = "",
+):
+  """Slide-in panel from right side whose content is only built while it is open.
+
+  The body of `with panel(...)` is built on every render even when the panel is hidden, so
+  large panels should use this instead.
+  """
+  if is_open:
+    with panel(is_open=True, title=title, on_click_close=on_click_close, key=key):
+      content()
+
+
+_GRID_STYLE = me.Style(
+  align_items="center",
+  display="grid",
+  height="calc(100vh - 10px)",
+  justify_items="end",
+)
+
+_CONTENT_STYLE = me.Style(
+  background=me.theme_var("surface-container-low"),
+  border_radius=5,
+  box_sizing="border-box",
+  border=me.Border.all(
+    me.BorderSide(width=1, color=me.theme_var("outline-variant"), style="solid"),
+  ),
+  margin=me.Margin(top=10, right=5),
+  padding=me.Padding.all(20),
+  pointer_events="auto",
+  height="100%",
+  width="30%",
+)
+
+_HEADER_STYLE = me.Style(
+  align_items="center",
+  display="flex",
+  justify_content="space-between",
+  margin=me.Margin(bottom=15),
+)
+
+_TITLE_STYLE = me.Style(font_size=16, font_weight="bold")
+
+_CLOSE_STYLE = me.Style(cursor="pointer")
@@ -15,7 +15,8 @@ def snackbar(
 ):
   """Creates a snackbar.
 
-  By default the snackbar is rendered at bottom center.
+  By default the snackbar is rendered at bottom center. Nothing is rendered while the snackbar
+  is hidden.
 
   The on_click_action should typically close the snackbar as part of its actions. If no
   click event is included, you'll need to manually hide the snackbar.
@@ -32,18 +33,10 @@ def snackbar(
     horizontal_position: Horizontal position of the snackbar
     vertical_position: Vertical position of the snackbar
   """
-  with me.box(
-    style=me.Style(
-      display="block" if is_visible else "none",
-      height="100%",
-      overflow_x="auto",
-      overflow_y="auto",
-      pointer_events="none",
-      position="fixed",
-      width="100%",
-      z_index=1000,
-    )
-  ):
+  if not is_visible:
+    return
+
+  with me.box(style=_OVERLAY_STYLE):
     with me.box(
       style=me.Style(
         align_items=vertical_position,
@@ -77,3 +70,15 @@ def snackbar(
             on_click=on_click_action,
             style=me.Style(color=me.theme_var("primary-container")),
           )
+
+
+_OVERLAY_STYLE = me.Style(
+  display="block",
+  height="100%",
+  overflow_x="auto",
+  overflow_y="auto",
+  pointer_events="none",
+  position="fixed",
+  width="100%",
+  z_index=1000,
+)
@@ -9,6 +9,12 @@ def app():
 PROMPT_MODE_GENERATE = "Generate"
 PROMPT_MODE_REVISE = "Revise"
 
+# Minimum time between editor updates while generated code is streaming in.
+STREAM_REFRESH_INTERVAL_SECONDS = 0.5
+
+# Prompt history entries shown per page of the history panel.
+PROMPT_HISTORY_PAGE_SIZE = 20
+
 HELP_TEXT = """
 **Generating Mesop Apps**
 
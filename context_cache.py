@@ -0,0 +1,215 @@
+"""Server-side caching of the static system instruction prefix.
+
+The system instruction plus prompt examples make up the bulk of the input tokens for every
+request. With context caching enabled, that prefix is registered once per API key, model
+and app type with Gemini's cached content API and reused until it expires.
+"""
+
+import datetime
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from google.generativeai import caching, protos
+
+logger = logging.getLogger(__name__)
+
+# Context caching only works against explicitly versioned models.
+CACHED_MODEL_VERSIONS = {
+  "gemini-1.5-flash": "gemini-1.5-flash-002",
+  "gemini-1.5-pro": "gemini-1.5-pro-002",
+}
+
+DEFAULT_TTL_SECONDS = 60 * 60
+DEFAULT_REFRESH_MARGIN_SECONDS = 5 * 60
+DEFAULT_RETRY_SECONDS = 10 * 60
+
+
+@dataclass
+class CachedPrefix:
+  """Handle to a cached prefix.
+
+  Has the same `name` and `model` attributes as `caching.CachedContent`, so it can be
+  passed directly to `genai.GenerativeModel.from_cached_content`.
+  """
+
+  name: str
+  model: str
+  expire_time: float
+
+
+class GeminiContextCacheProvider:
+  """Creates cached prefixes using Gemini's cached content API."""
+
+  def __init__(self, make_client: Callable[[str, str], object]):
+    """
+    Args:
+      make_client: Creates a client for the given API key and service name
+    """
+    self._make_client = make_client
+
+  def create(
+    self, api_key: str, model_name: str, system_instruction: str, ttl_seconds: int
+  ) -> CachedPrefix:
+    request = caching.CachedContent._prepare_create_request(
+      model=CACHED_MODEL_VERSIONS.get(model_name, model_name),
+      display_name="mesop-app-maker-prefix",
+      system_instruction=system_instruction,
+      ttl=ttl_seconds,
+    )
+    response = self._make_client(api_key, "cache").create_cached_content(request)
+    return CachedPrefix(
+      name=response.name, model=response.model, expire_time=response.expire_time.timestamp()
+    )
+
+  def refresh(self, api_key: str, prefix: CachedPrefix, ttl_seconds: int) -> CachedPrefix:
+    request = protos.UpdateCachedContentRequest(
+      cached_content=protos.CachedContent(
+        name=prefix.name, ttl=datetime.timedelta(seconds=ttl_seconds)
+      ),
+      update_mask={"paths": ["ttl"]},
+    )
+    response = self._make_client(api_key, "cache").update_cached_content(request)
+    return CachedPrefix(
+      name=prefix.name, model=prefix.model, expire_time=response.expire_time.timestamp()
+    )
+
+  def delete(self, api_key: str, prefix: CachedPrefix):
+    request = protos.DeleteCachedContentRequest(name=prefix.name)
+    self._make_client(api_key, "cache").delete_cached_content(request)
+
+
+class FakeContextCacheProvider:
+  """In-memory provider for exercising the cache lifecycle offline.
+
+  Cached prefixes expire according to the given clock. Set `available` to False to
+  simulate a provider that does not support caching.
+  """
+
+  def __init__(self, clock: Callable[[], float] = time.time):
+    self.clock = clock
+    self.available = True
+    self.prefixes: dict[str, tuple[CachedPrefix, str]] = {}
+    self.create_count = 0
+    self.refresh_count = 0
+    self.delete_count = 0
+
+  def create(
+    self, api_key: str, model_name: str, system_instruction: str, ttl_seconds: int
+  ) -> CachedPrefix:
+    self._check_available()
+    self.create_count += 1
+    prefix = CachedPrefix(
+      name=f"cachedContents/fake-{self.create_count}",
+      model="models/" + CACHED_MODEL_VERSIONS.get(model_name, model_name),
+      expire_time=self.clock() + ttl_seconds,
+    )
+    self.prefixes[prefix.name] = (prefix, system_instruction)
+    return prefix
+
+  def refresh(self, api_key: str, prefix: CachedPrefix, ttl_seconds: int) -> CachedPrefix:
+    self._check_available()
+    self._expire()
+    if prefix.name not in self.prefixes:
+      raise KeyError(f"{prefix.name} not found")
+    self.refresh_count += 1
+    refreshed = CachedPrefix(
+      name=prefix.name, model=prefix.model, expire_time=self.clock() + ttl_seconds
+    )
+    self.prefixes[prefix.name] = (refreshed, self.prefixes[prefix.name][1])
+    return refreshed
+
+  def delete(self, api_key: str, prefix: CachedPrefix):
+    self._check_available()
+    self.delete_count += 1
+    self.prefixes.pop(prefix.name, None)
+
+  def _check_available(self):
+    if not self.available:
+      raise RuntimeError("Context caching is unavailable")
+
+  def _expire(self):
+    now = self.clock()
+    self.prefixes = {
+      name: value for name, value in self.prefixes.items() if value[0].expire_time > now
+    }
+
+
+class ContextCache:
+  """Keeps one cached prefix per (api_key, model_name, app_type).
+
+  Prefixes are refreshed once they get within `refresh_margin_seconds` of expiring. If the
+  provider fails, `get` returns None so callers can fall back to sending the full system
+  instruction, and no new attempt is made for that key until `retry_seconds` have passed.
+  """
+
+  def __init__(
+    self,
+    provider: GeminiContextCacheProvider | FakeContextCacheProvider,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    refresh_margin_seconds: int = DEFAULT_REFRESH_MARGIN_SECONDS,
+    retry_seconds: int = DEFAULT_RETRY_SECONDS,
+    clock: Callable[[], float] = time.time,
+  ):
+    self.provider = provider
+    self.ttl_seconds = ttl_seconds
+    self.refresh_margin_seconds = refresh_margin_seconds
+    self.retry_seconds = retry_seconds
+    self.clock = clock
+    self._prefixes: dict[tuple[str, str, str], CachedPrefix] = {}
+    self._failed_at: dict[tuple[str, str, str], float] = {}
+    self._key_locks: dict[tuple[str, str, str], threading.Lock] = {}
+    self._lock = threading.Lock()
+
+  def get(
+    self, api_key: str, model_name: str, app_type: str, system_instruction: str
+  ) -> CachedPrefix | None:
+    """Returns a usable cached prefix, creating or refreshing it as needed."""
+    key = (api_key, model_name, app_type)
+    with self._lock:
+      key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+    # Only one thread per key talks to the provider. Others wait and reuse its result.
+    with key_lock:
+      now = self.clock()
+      prefix = self._prefixes.get(key)
+
+      if prefix and prefix.expire_time - now > self.refresh_margin_seconds:
+        return prefix
+
+      if prefix and prefix.expire_time > now:
+        try:
+          prefix = self.provider.refresh(api_key, prefix, self.ttl_seconds)
+          self._prefixes[key] = prefix
+          return prefix
+        except Exception:
+          logger.warning("Failed to refresh cached prefix %s", prefix.name, exc_info=True)
+          # Still valid for now, so keep using it and try again on the next call.
+          return prefix
+
+      self._prefixes.pop(key, None)
+
+      failed_at = self._failed_at.get(key)
+      if failed_at is not None and now - failed_at < self.retry_seconds:
+        return None
+
+      try:
+        prefix = self.provider.create(api_key, model_name, system_instruction, self.ttl_seconds)
+      except Exception:
+        logger.warning("Context caching unavailable for %s", model_name, exc_info=True)
+        self._failed_at[key] = now
+        return None
+
+      self._failed_at.pop(key, None)
+      self._prefixes[key] = prefix
+      return prefix
+
+  def invalidate(self, api_key: str, model_name: str, app_type: str):
+    """Forgets the cached prefix, for example after the provider reports it missing."""
+    key = (api_key, model_name, app_type)
+    with self._lock:
+      key_lock = self._key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+      self._prefixes.pop(key, None)
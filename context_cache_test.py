@@ -0,0 +1,67 @@
+from context_cache import ContextCache, FakeContextCacheProvider
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self) -> float:
+    return self.now
+
+
+def make_cache(clock: FakeClock) -> tuple[ContextCache, FakeContextCacheProvider]:
+  provider = FakeContextCacheProvider(clock)
+  cache = ContextCache(
+    provider, ttl_seconds=600, refresh_margin_seconds=60, retry_seconds=300, clock=clock
+  )
+  return cache, provider
+
+
+def test_prefix_is_created_once_per_key():
+  cache, provider = make_cache(FakeClock())
+
+  first = cache.get("key", "gemini-1.5-flash", "general", "instructions")
+  second = cache.get("key", "gemini-1.5-flash", "general", "instructions")
+  other = cache.get("key", "gemini-1.5-flash", "chat", "chat instructions")
+
+  assert first is second
+  assert first.model == "models/gemini-1.5-flash-002"
+  assert other.name != first.name
+  assert provider.create_count == 2
+
+
+def test_prefix_is_refreshed_before_it_expires():
+  clock = FakeClock()
+  cache, provider = make_cache(clock)
+  prefix = cache.get("key", "gemini-1.5-flash", "general", "instructions")
+
+  clock.now += 570
+  refreshed = cache.get("key", "gemini-1.5-flash", "general", "instructions")
+
+  assert refreshed.name == prefix.name
+  assert refreshed.expire_time == clock.now + 600
+  assert provider.refresh_count == 1
+
+
+def test_expired_prefix_is_recreated():
+  clock = FakeClock()
+  cache, provider = make_cache(clock)
+  prefix = cache.get("key", "gemini-1.5-flash", "general", "instructions")
+
+  clock.now += 601
+
+  assert cache.get("key", "gemini-1.5-flash", "general", "instructions").name != prefix.name
+  assert provider.create_count == 2
+
+
+def test_unavailable_provider_is_retried_later():
+  clock = FakeClock()
+  cache, provider = make_cache(clock)
+  provider.available = False
+
+  assert cache.get("key", "gemini-1.5-flash", "general", "instructions") is None
+  provider.available = True
+  assert cache.get("key", "gemini-1.5-flash", "general", "instructions") is None
+
+  clock.now += 301
+  assert cache.get("key", "gemini-1.5-flash", "general", "instructions") is not None
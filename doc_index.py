@@ -0,0 +1,192 @@
+"""Lexical index over the Mesop documentation in the system instructions.
+
+The system instructions are a preamble followed by documentation pages separated by
+`<documentation>` lines. Rather than sending every page with every request, the index picks
+the pages most relevant to the request using BM25, along with a few core pages that are
+always included.
+"""
+
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+# Rough estimate used for token budgets. Avoids a network round trip to count tokens.
+CHARS_PER_TOKEN = 4
+
+DEFAULT_TOKEN_BUDGET = 12000
+
+# Pages that are useful for almost any app. Component pages are titled by their first sentence.
+CORE_SECTION_TITLES = (
+  "Core Concepts",
+  "Event Handlers",
+  "State Management",
+  "Layouts",
+  "Box is",
+  "Button is",
+  "Text displays",
+)
+
+# Words that say nothing about which pages are relevant.
+STOPWORDS = frozenset(
+  {
+    "a",
+    "an",
+    "and",
+    "app",
+    "are",
+    "as",
+    "at",
+    "be",
+    "by",
+    "can",
+    "create",
+    "for",
+    "from",
+    "i",
+    "in",
+    "into",
+    "is",
+    "it",
+    "make",
+    "me",
+    "of",
+    "on",
+    "or",
+    "that",
+    "the",
+    "this",
+    "to",
+    "use",
+    "want",
+    "with",
+    "you",
+  }
+)
+
+_SECTION_SEPARATOR_RE = re.compile(r"^<documentation>$", re.MULTILINE)
+_TOKEN_RE = re.compile(r"[a-z0-9_]+")
+
+
+@dataclass
+class DocSection:
+  index: int
+  title: str
+  text: str
+
+  @property
+  def estimated_tokens(self) -> int:
+    return len(self.text) // CHARS_PER_TOKEN
+
+
+def tokenize(text: str) -> list[str]:
+  """Splits text into normalized lowercase words, without stopwords.
+
+  Identifiers like `me.slide_toggle` produce both `slide_toggle` and its parts so they match
+  prose such as "slide toggle".
+  """
+  tokens = []
+  for token in _TOKEN_RE.findall(text.lower()):
+    words = [token]
+    if "_" in token:
+      words.extend(part for part in token.split("_") if part)
+    tokens.extend(normalize(word) for word in words if word not in STOPWORDS)
+  return tokens
+
+
+def normalize(word: str) -> str:
+  """Strips plural endings so that "buttons" matches "button" and "boxes" matches "box"."""
+  if len(word) > 4 and word.endswith("ies"):
+    return word[:-3] + "y"
+  if len(word) > 3 and word.endswith("es") and word[:-2].endswith(("x", "ch", "sh", "ss", "z")):
+    return word[:-2]
+  if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+    return word[:-1]
+  return word
+
+
+def split_sections(system_instruction: str) -> tuple[str, list[DocSection]]:
+  """Splits the system instructions into the preamble and documentation sections."""
+  preamble, *pages = _SECTION_SEPARATOR_RE.split(system_instruction)
+  sections = []
+  for page in pages:
+    page = page.strip()
+    if page:
+      sections.append(DocSection(index=len(sections), title=_get_title(page), text=page))
+  return preamble.strip(), sections
+
+
+class DocIndex:
+  """BM25 index over the documentation sections."""
+
+  def __init__(self, system_instruction: str, k1: float = 1.5, b: float = 0.75):
+    self.preamble, self.sections = split_sections(system_instruction)
+    self.k1 = k1
+    self.b = b
+    self.core_sections = [
+      section
+      for section in self.sections
+      if any(section.title.startswith(title) for title in CORE_SECTION_TITLES)
+    ]
+
+    self._term_freqs = [Counter(tokenize(section.text)) for section in self.sections]
+    self._lengths = [sum(term_freqs.values()) for term_freqs in self._term_freqs]
+    self._avg_length = sum(self._lengths) / max(len(self._lengths), 1)
+    doc_freqs = Counter(term for term_freqs in self._term_freqs for term in term_freqs)
+    num_sections = len(self.sections)
+    self._idf = {
+      term: math.log(1 + (num_sections - freq + 0.5) / (freq + 0.5))
+      for term, freq in doc_freqs.items()
+    }
+
+  def search(self, query: str) -> list[tuple[float, DocSection]]:
+    """Returns matching sections ordered by descending score."""
+    query_terms = set(tokenize(query))
+    results = []
+    for section, term_freqs, length in zip(self.sections, self._term_freqs, self._lengths):
+      score = 0.0
+      for term in query_terms:
+        freq = term_freqs.get(term)
+        if not freq:
+          continue
+        norm = self.k1 * (1 - self.b + self.b * length / self._avg_length)
+        score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+      if score > 0:
+        results.append((score, section))
+    results.sort(key=lambda result: result[0], reverse=True)
+    return results
+
+  def select_sections(
+    self, query: str, token_budget: int = DEFAULT_TOKEN_BUDGET
+  ) -> list[DocSection]:
+    """Picks the core sections plus the best matches that fit in the token budget.
+
+    Sections are returned in their original order so related pages stay together.
+    """
+    selected = {section.index: section for section in self.core_sections}
+    used_tokens = sum(section.estimated_tokens for section in selected.values())
+    for _, section in self.search(query):
+      if section.index in selected:
+        continue
+      # Skip sections that do not fit, since a smaller one further down may still fit.
+      if used_tokens + section.estimated_tokens > token_budget:
+        continue
+      selected[section.index] = section
+      used_tokens += section.estimated_tokens
+    return [selected[index] for index in sorted(selected)]
+
+  def build_system_instruction(self, sections: list[DocSection]) -> str:
+    """Reassembles the system instructions from the given sections."""
+    return "\n\n".join(
+      [self.preamble]
+      + [f"<documentation>\n{section.text}\n<documentation>" for section in sections]
+    )
+
+
+def _get_title(page: str) -> str:
+  lines = [line.strip() for line in page.splitlines() if line.strip()]
+  title = lines[0].lstrip("#").strip()
+  # Component pages all start with an "Overview" heading, so use the first sentence instead.
+  if title == "Overview" and len(lines) > 1:
+    return lines[1]
+  return title
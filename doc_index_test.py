@@ -0,0 +1,70 @@
+import pytest
+
+from doc_index import CORE_SECTION_TITLES, DocIndex, normalize, tokenize
+
+with open("prompt/base_system_instructions.txt") as f:
+  SYSTEM_INSTRUCTION = f.read()
+
+
+@pytest.fixture(scope="module")
+def index() -> DocIndex:
+  return DocIndex(SYSTEM_INSTRUCTION)
+
+
+def titles(index: DocIndex, query: str, limit: int = 1) -> list[str]:
+  return [section.title for _, section in index.search(query)[:limit]]
+
+
+@pytest.mark.parametrize(
+  "word, expected",
+  [("buttons", "button"), ("boxes", "box"), ("entries", "entry"), ("class", "class")],
+)
+def test_plurals_are_normalized(word: str, expected: str):
+  assert normalize(word) == expected
+
+
+def test_tokenize_drops_stopwords_and_splits_identifiers():
+  assert tokenize("Create an app with me.slide_toggle") == ["slide_toggle", "slide", "toggle"]
+
+
+@pytest.mark.parametrize(
+  "query, title",
+  [
+    ("Add slide toggles for the settings", "Slide Toggle"),
+    ("A form with checkboxes", "Checkbox"),
+    ("Let users upload files", "Uploader"),
+    ("Show the results in a table", "Table"),
+    ("Pick a value with sliders", "Slider"),
+  ],
+)
+def test_query_finds_section(index: DocIndex, query: str, title: str):
+  assert titles(index, query)[0].startswith(title)
+
+
+def test_stopwords_only_query_matches_nothing(index: DocIndex):
+  assert index.search("I want to create an app that is for me") == []
+
+
+def test_core_sections_are_always_selected(index: DocIndex):
+  assert len(index.core_sections) == len(CORE_SECTION_TITLES)
+  for query in ["", "a slide toggle", "I want an app"]:
+    selected = index.select_sections(query, token_budget=0)
+
+    assert selected == index.core_sections
+
+
+def test_selection_fits_the_budget_and_keeps_the_original_order(index: DocIndex):
+  core_tokens = sum(section.estimated_tokens for section in index.core_sections)
+  selected = index.select_sections("chat with a sidebar and tooltips", core_tokens + 2000)
+
+  assert sum(section.estimated_tokens for section in selected) <= core_tokens + 2000
+  assert len(selected) > len(index.core_sections)
+  assert [section.index for section in selected] == sorted(section.index for section in selected)
+
+
+def test_sections_round_trip_into_system_instruction(index: DocIndex):
+  rebuilt = DocIndex(index.build_system_instruction(index.sections))
+
+  assert [section.text for section in rebuilt.sections] == [
+    section.text for section in index.sections
+  ]
@@ -0,0 +1,72 @@
+"""Parses and applies search/replace edit scripts returned by the LLM in Revise mode.
+
+Edit scripts are made up of blocks in this format:
+
+<<<<<<< SEARCH
+exact lines from the current code
+=======
+lines to replace them with
+>>>>>>> REPLACE
+"""
+
+import re
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+
+_EDIT_BLOCK_RE = re.compile(
+  r"^<<<<<<< SEARCH[ \t]*\n(.*?)^=======[ \t]*\n(.*?)^>>>>>>> REPLACE[ \t]*$",
+  re.MULTILINE | re.DOTALL,
+)
+
+
+class EditScriptError(Exception):
+  """Raised when an edit script cannot be parsed or applied."""
+
+
+def parse_edits(text: str) -> list[tuple[str, str]]:
+  """Extracts (search, replace) pairs from the LLM output."""
+  edits = [(search, replace) for search, replace in _EDIT_BLOCK_RE.findall(text)]
+  if not edits:
+    raise EditScriptError("No edit blocks found")
+  if text.count(SEARCH_MARKER) != len(edits):
+    raise EditScriptError("Found malformed edit blocks")
+  return edits
+
+
+def apply_edits(code: str, text: str) -> str:
+  """Applies the edit script in order to the given code.
+
+  Each search block must match exactly one location in the code. Trailing whitespace
+  differences are tolerated since LLMs are often sloppy about those.
+  """
+  for index, (search, replace) in enumerate(parse_edits(text)):
+    if not search.strip():
+      raise EditScriptError(f"Edit {index + 1} has an empty search block")
+    code = _apply_edit(code, search, replace, index)
+  return code
+
+
+def _apply_edit(code: str, search: str, replace: str, index: int) -> str:
+  count = code.count(search)
+  if count == 1:
+    return code.replace(search, replace, 1)
+  if count > 1:
+    raise EditScriptError(f"Edit {index + 1} matches {count} locations")
+
+  # Fall back to matching line by line while ignoring trailing whitespace.
+  code_lines = code.splitlines(keepends=True)
+  search_lines = [line.rstrip() for line in search.splitlines()]
+  matches = [
+    start
+    for start in range(len(code_lines) - len(search_lines) + 1)
+    if all(code_lines[start + offset].rstrip() == line for offset, line in enumerate(search_lines))
+  ]
+  if len(matches) != 1:
+    raise EditScriptError(f"Edit {index + 1} matches {len(matches)} locations")
+
+  start = matches[0]
+  end = start + len(search_lines)
+  # Keep the final newline if the replaced lines ended with one.
+  if replace and not replace.endswith("\n") and code_lines[end - 1].endswith("\n"):
+    replace += "\n"
+  return "".join(code_lines[:start]) + replace + "".join(code_lines[end:])
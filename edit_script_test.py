@@ -0,0 +1,71 @@
+import pytest
+
+from edit_script import EditScriptError, apply_edits, parse_edits
+
+CODE = """import mesop as me
+
+
+@me.page()
+def page():
+  me.text("Hello")
+  me.button("Go")
+"""
+
+
+def edit(search: str, replace: str) -> str:
+  return f"<<<<<<< SEARCH\n{search}=======\n{replace}>>>>>>> REPLACE\n"
+
+
+def test_parses_edit_blocks():
+  text = "Some changes:\n" + edit("a\n", "b\n") + edit("c\n", "")
+
+  assert parse_edits(text) == [("a\n", "b\n"), ("c\n", "")]
+
+
+def test_malformed_block_is_rejected():
+  text = edit("a\n", "b\n") + "<<<<<<< SEARCH\nc\n"
+
+  with pytest.raises(EditScriptError, match="malformed"):
+    parse_edits(text)
+
+
+def test_applies_several_edits_in_order():
+  text = edit('  me.text("Hello")\n', '  me.text("Hi")\n') + edit(
+    '  me.button("Go")\n', '  me.button("Go", type="flat")\n'
+  )
+
+  assert apply_edits(CODE, text) == CODE.replace('"Hello"', '"Hi"').replace(
+    'me.button("Go")', 'me.button("Go", type="flat")'
+  )
+
+
+def test_missing_search_text_is_an_error():
+  with pytest.raises(EditScriptError, match="matches 0 locations"):
+    apply_edits(CODE, edit('  me.text("Goodbye")\n', '  me.text("Hi")\n'))
+
+
+def test_ambiguous_search_text_is_an_error():
+  code = CODE + '  me.text("Hello")\n'
+
+  with pytest.raises(EditScriptError, match="matches 2 locations"):
+    apply_edits(code, edit('  me.text("Hello")\n', '  me.text("Hi")\n'))
+
+
+def test_ambiguous_search_text_ignoring_whitespace_is_an_error():
+  code = CODE + '  me.text("Hello")  \n'
+
+  with pytest.raises(EditScriptError, match="matches 2 locations"):
+    apply_edits(code, edit('  me.text("Hello") \n', '  me.text("Hi")\n'))
+
+
+def test_trailing_whitespace_is_ignored():
+  code = CODE.replace('me.text("Hello")', 'me.text("Hello")   ')
+
+  result = apply_edits(code, edit('  me.text("Hello")\n', '  me.text("Hi")\n'))
+
+  assert result == CODE.replace('"Hello"', '"Hi"')
+
+
+def test_empty_search_block_is_an_error():
+  with pytest.raises(EditScriptError, match="empty search block"):
+    apply_edits(CODE, edit("\n", "x = 1\n"))
@@ -0,0 +1,150 @@
+"""Compares documentation retrieval against sending the full system instructions.
+
+For each prompt, generates an app with the full documentation and with only the retrieved
+sections, then reports latency, input tokens and whether the generated code compiles.
+
+Usage:
+
+  GEMINI_API_KEY=... python eval_doc_retrieval.py --budget 12000 > results.json
+
+Use `--dry-run` to only report which sections would be selected, without calling Gemini.
+
+Prompts can list `expected_sections`, the title prefixes of sections that should be selected.
+Sections that were not selected are reported as `missing_sections`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+import llm
+from code_repair import extract_code
+from constants import EXAMPLE_CHAT_PROMPTS
+from doc_index import DEFAULT_TOKEN_BUDGET, DocIndex
+
+DEFAULT_PROMPTS = [
+  {
+    "prompt": "Create a counter app with increment and decrement buttons.",
+    "app_type": "general",
+    "expected_sections": ["Button", "Text"],
+  },
+  {
+    "prompt": "Create a todo list app where items can be added and checked off.",
+    "app_type": "general",
+  },
+  {
+    "prompt": "Create a settings form with a slide toggle, a select and a slider.",
+    "app_type": "general",
+  },
+  {"prompt": "Create a login page with username and password inputs.", "app_type": "general"},
+  # Plural words should match the singular component pages.
+  {
+    "prompt": "Create a survey with checkboxes, radio buttons, sliders and images.",
+    "app_type": "general",
+    "expected_sections": ["Checkbox", "Radio", "Slider", "Image", "Button"],
+  },
+] + [{"prompt": prompt, "app_type": "chat"} for prompt in EXAMPLE_CHAT_PROMPTS]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--prompts", help="JSONL file with prompt and app_type fields")
+  parser.add_argument("--model", default="gemini-1.5-flash")
+  parser.add_argument("--budget", type=int, default=DEFAULT_TOKEN_BUDGET)
+  parser.add_argument("--dry-run", action="store_true")
+  args = parser.parse_args()
+
+  if args.prompts:
+    with open(args.prompts) as f:
+      prompts = [json.loads(line) for line in f if line.strip()]
+  else:
+    prompts = DEFAULT_PROMPTS
+
+  doc_index = DocIndex(llm.SYSTEM_INSTRUCTION)
+  variants = {
+    "full": llm.ModelRegistry(),
+    "retrieval": llm.ModelRegistry(doc_index=doc_index, doc_token_budget=args.budget),
+  }
+
+  results = []
+  for item in prompts:
+    sections = doc_index.select_sections(item["prompt"], args.budget)
+    result = {
+      "prompt": item["prompt"][:80],
+      "app_type": item["app_type"],
+      "sections": [section.title[:60] for section in sections],
+      "expected_sections": item.get("expected_sections", []),
+      "missing_sections": [
+        title
+        for title in item.get("expected_sections", [])
+        if not any(section.title.startswith(title) for section in sections)
+      ],
+      "instruction_chars": {
+        "full": len(llm.SYSTEM_INSTRUCTION),
+        "retrieval": len(doc_index.build_system_instruction(sections)),
+      },
+    }
+    if not args.dry_run:
+      for name, registry in variants.items():
+        result[name] = _generate(registry, item["prompt"], item["app_type"], args.model)
+      print(f"Finished: {result['prompt']}", file=sys.stderr)
+    results.append(result)
+
+  print(json.dumps({"budget": args.budget, "summary": _summarize(results), "results": results}))
+
+
+def _generate(registry: llm.ModelRegistry, prompt: str, app_type: str, model_name: str) -> dict:
+  api_key = os.getenv("GEMINI_API_KEY", "")
+  model = registry.get(api_key, model_name, app_type, doc_query=prompt)
+  start = time.monotonic()
+  try:
+    response = model.generate_content(
+      llm.get_generate_prompt_base(app_type).replace("<APP_DESCRIPTION>", prompt),
+      request_options={"timeout": 120},
+    )
+    code, _ = extract_code(response.text)
+  except (api_exceptions.GoogleAPIError, ValueError) as e:
+    # ValueError is raised when the response has no text, such as when it was blocked.
+    return {"seconds": time.monotonic() - start, "error": str(e), "compiles": False}
+
+  seconds = time.monotonic() - start
+  try:
+    compile(code, "<generated>", "exec")
+    compiles = True
+  except SyntaxError:
+    compiles = False
+  return {
+    "seconds": seconds,
+    "input_tokens": response.usage_metadata.prompt_token_count,
+    "output_tokens": response.usage_metadata.candidates_token_count,
+    "compiles": compiles,
+  }
+
+
+def _summarize(results: list[dict]) -> dict:
+  expected = sum(len(result["expected_sections"]) for result in results)
+  missing = sum(len(result["missing_sections"]) for result in results)
+  summary = {"expected_section_recall": 1 - missing / expected if expected else 1.0}
+  for name in ["full", "retrieval"]:
+    runs = [result[name] for result in results if name in result]
+    summary[name] = {
+      "avg_instruction_chars": statistics.mean(
+        result["instruction_chars"][name] for result in results
+      ),
+    }
+    if runs:
+      summary[name] |= {
+        "median_seconds": statistics.median(run["seconds"] for run in runs),
+        "avg_input_tokens": statistics.mean(run.get("input_tokens", 0) for run in runs),
+        "compile_rate": sum(run["compiles"] for run in runs) / len(runs),
+      }
+  return summary
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,315 @@
+"""Local stand-ins for the Gemini API and the Mesop App Runner.
+
+These are used by the benchmarks to measure the editor without network services. The fake
+Gemini server implements the REST `generateContent` and `streamGenerateContent` methods and
+replies with a canned app after a configurable delay and token rate. The fake runner implements
+`/exec`, in both the compact and the base64 upload formats from `runner_client`, lists them on
+its root page, and serves a placeholder page for the returned URL path. The page loads a script bundle the size of Mesop's,
+and swaps in new pages in place when the preview frame asks it to.
+
+Point the editor at them with:
+
+  MESOP_APP_MAKER_GEMINI_ENDPOINT=http://127.0.0.1:8091
+  MESOP_APP_MAKER_RUNNER_URL=http://127.0.0.1:8092
+
+Usage:
+
+  python fake_services.py --gemini-port 8091 --runner-port 8092
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import runner_client
+from doc_index import CHARS_PER_TOKEN
+
+_GENERATE_PATH_RE = re.compile(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)")
+
+
+@dataclass
+class GeminiConfig:
+  # Delay before the first token.
+  first_token_seconds: float = 0.5
+  tokens_per_second: float = 200.0
+  # Tokens per streamed chunk.
+  chunk_tokens: int = 20
+  # Text returned for every request.
+  response_text: str = (
+    "```python\nimport mesop as me\n\n\n@me.page()\ndef page():\n  me.text('Hello')\n```"
+  )
+
+
+@dataclass
+class RunnerConfig:
+  exec_seconds: float = 0.3
+  page_seconds: float = 0.05
+  token: str = ""
+  # Set to False to behave like an older runner that only accepts base64 form posts.
+  compact_uploads: bool = True
+  # Set to False to behave like an older runner that does not echo the content hash of the app.
+  echo_content_hash: bool = True
+  # Set to True to serve one app at a time at the same path, like a runner that restarts the app
+  # for each upload.
+  single_app: bool = False
+  # Size of the script bundle that each app page loads.
+  bundle_bytes: int = 1_500_000
+
+
+class _Server(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(self, *args):
+    super().__init__(*args)
+    self.connections = set()
+
+  def process_request(self, request, client_address):
+    self.connections.add(request)
+    super().process_request(request, client_address)
+
+  def shutdown_request(self, request):
+    self.connections.discard(request)
+    super().shutdown_request(request)
+
+
+class FakeService:
+  """Runs an HTTP server on a background thread."""
+
+  def __init__(self, handler_class: type[BaseHTTPRequestHandler], port: int = 0):
+    self.server = _Server(("127.0.0.1", port), handler_class)
+    self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+  @property
+  def url(self) -> str:
+    host, port = self.server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def start(self) -> "FakeService":
+    self._thread.start()
+    return self
+
+  def stop(self):
+    """Stops the server and drops open keep-alive connections, as if the service went down."""
+    self.server.shutdown()
+    self.server.server_close()
+    for connection in list(self.server.connections):
+      try:
+        connection.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+
+
+def fake_gemini(config: GeminiConfig, port: int = 0) -> FakeService:
+  class Handler(_QuietHandler):
+    def do_POST(self):
+      match = _GENERATE_PATH_RE.match(self.path)
+      if not match:
+        self._send_text(404, f"Not found: {self.path}")
+        return
+      request = json.loads(self._read_body() or "{}")
+      prompt_chars = sum(
+        len(part.get("text", ""))
+        for content in request.get("contents", [])
+        for part in content.get("parts", [])
+      )
+      time.sleep(config.first_token_seconds)
+      if match.group(2) == "streamGenerateContent":
+        self._stream(prompt_chars)
+      else:
+        time.sleep(_tokens(config.response_text) / config.tokens_per_second)
+        body = json.dumps(_response(config.response_text, prompt_chars, config.response_text))
+        self._send_text(200, body, "application/json")
+
+    def _stream(self, prompt_chars: int):
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Connection", "close")
+      self.end_headers()
+      chunk_chars = config.chunk_tokens * CHARS_PER_TOKEN
+      text = config.response_text
+      chunks = [text[i : i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+      self.wfile.write(b"[")
+      for i, chunk in enumerate(chunks):
+        if i:
+          time.sleep(_tokens(chunk) / config.tokens_per_second)
+          self.wfile.write(b",\n")
+        self.wfile.write(
+          json.dumps(_response(chunk, prompt_chars, text[: (i + 1) * chunk_chars])).encode()
+        )
+        self.wfile.flush()
+      self.wfile.write(b"]")
+      self.close_connection = True
+
+  return FakeService(Handler, port)
+
+
+_BUNDLE_PATH = "/__fake_runner__/bundle.js"
+
+# Announces that it can swap in new pages, and replies to the preview frame's request to show a
+# new page by swapping in its body.
+_APP_PAGE = """<html>
+<head>
+<script src="<BUNDLE_PATH>"></script>
+<script>
+window.parent.postMessage({type: "mesop-app-maker:ready", capabilities: ["navigate"]}, "*");
+window.addEventListener("message", async (event) => {
+  if (event.source !== window.parent || event.data?.type !== "mesop-app-maker:navigate") {
+    return;
+  }
+  const response = await fetch(event.data.url);
+  const page = new DOMParser().parseFromString(await response.text(), "text/html");
+  document.body.replaceWith(page.body);
+  history.replaceState(null, "", event.data.url);
+  window.parent.postMessage({type: "mesop-app-maker:navigated"}, event.origin);
+});
+</script>
+</head>
+<body>Fake Mesop app</body>
+</html>
+""".replace("<BUNDLE_PATH>", _BUNDLE_PATH)
+
+
+def fake_runner(config: RunnerConfig, port: int = 0) -> FakeService:
+  # Content hashes of uploaded apps by path. These are lost when the runner restarts, like the
+  # real runner.
+  paths = {}
+  bundle = "//" + "x" * max(config.bundle_bytes - 2, 0)
+
+  class Handler(_QuietHandler):
+    def do_POST(self):
+      if self.path != "/exec":
+        self._send_text(404, f"Not found: {self.path}")
+        return
+      body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+      if config.compact_uploads and self.headers.get("Content-Type") == "application/octet-stream":
+        token = self.headers.get(runner_client.TOKEN_HEADER, "")
+        try:
+          code = runner_client.decode_compact_upload(body, self.headers)
+        except ValueError as e:
+          self._send_text(400, str(e))
+          return
+      else:
+        # Like the real runner, reads the form whatever the content type, so a compact upload to
+        # an older runner fails on the missing token, or on the missing code without a token.
+        form = parse_qs(body.decode("utf-8", errors="replace"))
+        token = form.get("token", [""])[0]
+        code = base64.b64decode(form["code"][0]).decode("utf-8") if "code" in form else None
+      if config.token and token != config.token:
+        self._send_text(403, "Invalid token")
+        return
+      if code is None:
+        self._send_text(500, "KeyError: 'code'")
+        return
+      time.sleep(config.exec_seconds)
+      try:
+        compile(code, "<runner>", "exec")
+      except SyntaxError as e:
+        self._send_text(500, f"SyntaxError: {e}")
+        return
+      content_hash = hashlib.sha256(code.encode()).hexdigest()
+      path = "/app" if config.single_app else "/~" + content_hash[:16]
+      paths[path] = content_hash
+      self._send_text(200, path)
+
+    def do_GET(self):
+      if self.path == "/":
+        formats = [runner_client.UPLOAD_FORMAT_BASE64]
+        if config.compact_uploads:
+          formats.append(runner_client.UPLOAD_FORMAT_COMPACT)
+        self._send_text(
+          200, "Mesop App Runner", headers={runner_client.UPLOAD_FORMATS_HEADER: ",".join(formats)}
+        )
+        return
+      if self.path == _BUNDLE_PATH:
+        self._send_text(200, bundle, "text/javascript")
+        return
+      if self.path not in paths:
+        self._send_text(404, f"Not found: {self.path}")
+        return
+      time.sleep(config.page_seconds)
+      headers = {runner_client.HASH_HEADER: paths[self.path]} if config.echo_content_hash else {}
+      self._send_text(200, _APP_PAGE, "text/html", headers=headers)
+
+  return FakeService(Handler, port)
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    pass
+
+  def _read_body(self) -> str:
+    return self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+
+  def _send_text(
+    self,
+    status: int,
+    text: str,
+    content_type: str = "text/plain",
+    headers: dict[str, str] | None = None,
+  ):
+    body = text.encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def _tokens(text: str) -> int:
+  return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _response(text: str, prompt_chars: int, text_so_far: str) -> dict:
+  return {
+    "candidates": [
+      {"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}
+    ],
+    "usageMetadata": {
+      "promptTokenCount": prompt_chars // CHARS_PER_TOKEN,
+      "candidatesTokenCount": _tokens(text_so_far),
+      "totalTokenCount": prompt_chars // CHARS_PER_TOKEN + _tokens(text_so_far),
+    },
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--gemini-port", type=int, default=8091)
+  parser.add_argument("--runner-port", type=int, default=8092)
+  parser.add_argument("--first-token-seconds", type=float, default=GeminiConfig.first_token_seconds)
+  parser.add_argument("--tokens-per-second", type=float, default=GeminiConfig.tokens_per_second)
+  parser.add_argument("--response-file", help="File with the text Gemini should return")
+  parser.add_argument("--exec-seconds", type=float, default=RunnerConfig.exec_seconds)
+  args = parser.parse_args()
+
+  gemini_config = GeminiConfig(
+    first_token_seconds=args.first_token_seconds, tokens_per_second=args.tokens_per_second
+  )
+  if args.response_file:
+    with open(args.response_file) as f:
+      gemini_config.response_text = f.read()
+  gemini = fake_gemini(gemini_config, args.gemini_port).start()
+  runner = fake_runner(RunnerConfig(exec_seconds=args.exec_seconds), args.runner_port).start()
+  print(f"Fake Gemini: {gemini.url}\nFake runner: {runner.url}")
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    gemini.stop()
+    runner.stop()
+
+
+if __name__ == "__main__":
+  main()
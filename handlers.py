@@ -1,27 +1,39 @@
 import mesop as me
 
+import state_payload
 from state import State
 
 
+@state_payload.handler
 def on_show_component(e: me.ClickEvent):
   """Generic event to show a component."""
   state = me.state(State)
   setattr(state, e.key, True)
 
 
+@state_payload.handler
 def on_hide_component(e: me.ClickEvent):
   """Generic event to hide a component."""
   state = me.state(State)
   setattr(state, e.key, False)
 
 
+@state_payload.handler
 def on_update_input(e: me.InputBlurEvent | me.InputEvent | me.InputEnterEvent):
   """Generic event to update input values."""
   state = me.state(State)
   setattr(state, e.key, e.value)
 
 
+@state_payload.handler
 def on_update_selection(e: me.SelectSelectionChangeEvent):
   """Generic event to update input values."""
   state = me.state(State)
   setattr(state, e.key, e.value)
+
+
+@state_payload.handler
+def on_toggle_setting(e: me.SlideToggleChangeEvent):
+  """Generic event to toggle boolean values."""
+  state = me.state(State)
+  setattr(state, e.key, not getattr(state, e.key))
@@ -0,0 +1,257 @@
+"""Hedged requests across two models.
+
+The primary model is called first. If it has not answered within a delay based on its recent
+latencies, the same request is sent to a backup model. The first valid response wins and the
+other request is cancelled.
+
+A request that is cancelled is recorded with the time it ran for, which is a lower bound on its
+latency. Leaving these out would drop exactly the slow requests, so the hedge delay would keep
+getting shorter and more requests would be hedged.
+
+A losing stream is cancelled as soon as the winner is picked if it has a `cancel` method, which
+must be safe to call from another thread. Otherwise it is dropped when its next chunk arrives.
+Each hedged request needs up to two workers, so the pool is sized separately from other pools,
+with `MESOP_APP_MAKER_HEDGE_WORKERS`.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any
+
+DEFAULT_PERCENTILE = 0.9
+DEFAULT_DELAY_SECONDS = 30.0
+MIN_SAMPLES = 10
+MAX_SAMPLES = 100
+# Enough for 16 hedged requests at once.
+DEFAULT_MAX_WORKERS = 32
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeCancelledError(Exception):
+  """Raised inside a request that lost the race."""
+
+
+def read_stream(chunks: Iterator[str], cancelled: threading.Event) -> str:
+  """Reads a stream of text chunks, stopping early if cancelled.
+
+  Raises HedgeCancelledError if cancelled before the stream finishes.
+  """
+  parts = []
+  try:
+    for chunk in chunks:
+      if cancelled.is_set():
+        raise HedgeCancelledError()
+      parts.append(chunk)
+  except HedgeCancelledError:
+    raise
+  except Exception as e:
+    # Cancelling the stream from another thread makes reading it fail.
+    if cancelled.is_set():
+      raise HedgeCancelledError() from e
+    raise
+  finally:
+    # Closing the iterator drops the underlying stream so the request gets cancelled.
+    close = getattr(chunks, "close", None)
+    if close:
+      close()
+  # A cancelled stream may also just end early.
+  if cancelled.is_set():
+    raise HedgeCancelledError()
+  return "".join(parts)
+
+
+@dataclass
+class _Attempt:
+  model_name: str
+  cancelled: threading.Event = field(default_factory=threading.Event)
+  # Stream being read, once the request has started.
+  stream: Iterator[str] | None = None
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def start(self, stream: Iterator[str]):
+    with self._lock:
+      self.stream = stream
+      cancelled = self.cancelled.is_set()
+    if cancelled:
+      _cancel_stream(stream)
+
+  def cancel(self):
+    with self._lock:
+      self.cancelled.set()
+      stream = self.stream
+    if stream is not None:
+      _cancel_stream(stream)
+
+
+def _cancel_stream(stream: Iterator[str]):
+  cancel = getattr(stream, "cancel", None)
+  if cancel:
+    try:
+      cancel()
+    except Exception:
+      logger.warning("Failed to cancel the losing stream", exc_info=True)
+
+
+@dataclass
+class ModelHedgeStats:
+  requests: int = 0
+  wins: int = 0
+  # Estimated time saved when this model won as the backup.
+  seconds_saved: float = 0.0
+  latencies: deque = field(default_factory=lambda: deque(maxlen=MAX_SAMPLES))
+
+  @property
+  def win_rate(self) -> float:
+    return self.wins / self.requests if self.requests else 0.0
+
+
+class Hedger:
+  def __init__(
+    self,
+    percentile: float = DEFAULT_PERCENTILE,
+    default_delay_seconds: float = DEFAULT_DELAY_SECONDS,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+  ):
+    self.percentile = percentile
+    self.default_delay_seconds = default_delay_seconds
+    self.stats: dict[str, ModelHedgeStats] = {}
+    self.hedges = 0
+    # Hedges that were not sent since the backup request could not be admitted.
+    self.skipped_hedges = 0
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+    self._lock = threading.Lock()
+
+  def delay_seconds(self, model_name: str) -> float:
+    """How long to wait for the given model before firing the backup request."""
+    with self._lock:
+      latencies = sorted(self._get_stats(model_name).latencies)
+    if len(latencies) < MIN_SAMPLES:
+      return self.default_delay_seconds
+    return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+
+  def run(
+    self,
+    call: Callable[[str], Iterator[str]],
+    primary: str,
+    backup: str,
+    validate: Callable[[str], bool] = lambda text: bool(text.strip()),
+    admit_backup: Callable[[], Any] | None = None,
+  ) -> tuple[str, str]:
+    """Runs the call against the primary model, hedging with the backup model if needed.
+
+    Args:
+      call: Takes a model name and returns an iterator of text chunks
+      primary: Model to try first
+      backup: Model to try if the primary is slow
+      validate: Whether a response is good enough to win
+      admit_backup: Returns a ticket with a `release` method if the backup request may be sent,
+        or None if it may not, such as when it would go over the rate limit
+
+    Returns:
+      The winning text and the name of the model that produced it.
+    """
+    start = time.monotonic()
+    attempts: dict[Future, _Attempt] = {}
+
+    def submit(model_name: str, ticket: Any = None) -> Future:
+      attempt = _Attempt(model_name)
+      future = self._executor.submit(self._consume, call, attempt, ticket)
+      attempts[future] = attempt
+      with self._lock:
+        self._get_stats(model_name).requests += 1
+      return future
+
+    pending = {submit(primary)}
+    hedge_at = start + self.delay_seconds(primary)
+    hedged = False
+    first_error = None
+    fallback = None
+    while True:
+      timeout = None if hedged else max(0.0, hedge_at - time.monotonic())
+      done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+      for future in done:
+        model_name = attempts[future].model_name
+        try:
+          text = future.result()
+        except Exception as e:
+          # The other model may still succeed. The first error is raised if neither does.
+          logger.warning("Hedged request to %s failed", model_name, exc_info=True)
+          first_error = first_error or e
+          continue
+        if validate(text):
+          for other, attempt in attempts.items():
+            if other is not future:
+              attempt.cancel()
+          self._record_win(model_name, primary, start)
+          return text, model_name
+        fallback = fallback or (text, model_name)
+
+      # Hedge if the primary is slow, or if it already failed.
+      if not hedged and (not done or not pending):
+        hedged = True
+        ticket = admit_backup() if admit_backup else None
+        if admit_backup and ticket is None:
+          # Keep waiting for the primary rather than going over the limits.
+          with self._lock:
+            self.skipped_hedges += 1
+          if not pending:
+            break
+          continue
+        with self._lock:
+          self.hedges += 1
+        pending.add(submit(backup, ticket))
+      elif not pending:
+        break
+
+    # Neither response was valid, so return whatever we got and let the caller deal with it.
+    if fallback:
+      return fallback
+    raise first_error
+
+  def _consume(
+    self, call: Callable[[str], Iterator[str]], attempt: _Attempt, ticket: Any = None
+  ) -> str:
+    start = time.monotonic()
+    try:
+      stream = call(attempt.model_name)
+      attempt.start(stream)
+      text = read_stream(stream, attempt.cancelled)
+    except HedgeCancelledError:
+      # The request lost, so its latency is at least as long as it ran.
+      self._record_latency(attempt.model_name, time.monotonic() - start)
+      raise
+    finally:
+      if ticket:
+        ticket.release()
+    self._record_latency(attempt.model_name, time.monotonic() - start)
+    return text
+
+  def _record_latency(self, model_name: str, seconds: float):
+    with self._lock:
+      self._get_stats(model_name).latencies.append(seconds)
+
+  def _record_win(self, model_name: str, primary: str, start: float):
+    elapsed = time.monotonic() - start
+    with self._lock:
+      stats = self._get_stats(model_name)
+      stats.wins += 1
+      if model_name == primary:
+        return
+      # The primary would have taken at least `elapsed`. Estimate its latency as the average of
+      # its past latencies that were at least that long.
+      slow_latencies = [
+        latency for latency in self._get_stats(primary).latencies if latency >= elapsed
+      ]
+      if slow_latencies:
+        stats.seconds_saved += sum(slow_latencies) / len(slow_latencies) - elapsed
+
+  def _get_stats(self, model_name: str) -> ModelHedgeStats:
+    if model_name not in self.stats:
+      self.stats[model_name] = ModelHedgeStats()
+    return self.stats[model_name]
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from hedging import HedgeCancelledError, Hedger, read_stream
+
+
+class FakeStream:
+  """Stream that sends its chunks once released, like a slow model, and can be cancelled."""
+
+  def __init__(self, chunks: list[str], released: bool = True):
+    self.chunks = iter(chunks)
+    self.released = threading.Event()
+    if released:
+      self.released.set()
+    self.cancelled = False
+    self.finished = threading.Event()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self) -> str:
+    # Waits for the next chunk from the network.
+    self.released.wait(timeout=5)
+    if self.cancelled:
+      raise ConnectionError("Stream was cancelled")
+    return next(self.chunks)
+
+  def cancel(self):
+    self.cancelled = True
+    self.released.set()
+
+  def close(self):
+    self.finished.set()
+
+
+class FakeTicket:
+  def __init__(self):
+    self.released = threading.Event()
+
+  def release(self):
+    self.released.set()
+
+
+def test_fast_backup_wins_and_slow_primary_is_cancelled():
+  hedger = Hedger(default_delay_seconds=0.01)
+  streams = {"primary": FakeStream(["slow"], released=False), "backup": FakeStream(["fast"])}
+  ticket = FakeTicket()
+
+  text, model_name = hedger.run(
+    lambda name: streams[name], "primary", "backup", admit_backup=lambda: ticket
+  )
+
+  assert (text, model_name) == ("fast", "backup")
+  # The primary was waiting for a chunk, and is cancelled without waiting for it.
+  assert streams["primary"].cancelled
+  assert streams["primary"].finished.wait(timeout=1)
+  assert ticket.released.wait(timeout=1)
+  assert hedger.stats["backup"].wins == 1
+  assert hedger.hedges == 1
+
+
+def test_primary_wins_and_backup_ticket_is_released():
+  hedger = Hedger(default_delay_seconds=0.01)
+  primary = FakeStream(["primary"], released=False)
+  backup = FakeStream(["backup"], released=False)
+  ticket = FakeTicket()
+
+  def admit_backup():
+    # Lets the primary answer once the backup has been sent.
+    threading.Timer(0.05, primary.released.set).start()
+    return ticket
+
+  text, model_name = hedger.run(
+    lambda name: primary if name == "primary" else backup,
+    "primary",
+    "backup",
+    admit_backup=admit_backup,
+  )
+
+  assert (text, model_name) == ("primary", "primary")
+  assert backup.cancelled
+  assert ticket.released.wait(timeout=1)
+
+
+def test_read_stream_raises_once_cancelled():
+  cancelled = threading.Event()
+  stream = FakeStream(["a", "b"])
+  cancelled.set()
+
+  with pytest.raises(HedgeCancelledError):
+    read_stream(stream, cancelled)
+  assert stream.finished.is_set()
@@ -0,0 +1,303 @@
+"""Server-side store for the code and prompts in the prompt history.
+
+Keeping these in `State` means every event round trip sends every version of the code, so the
+history only keeps IDs and short previews, and the full text is looked up here when an entry is
+selected. `state_payload` also stores large state fields here.
+
+Texts are content-addressed, so identical versions are stored once. Each version is stored as a
+line delta against its parent, which is usually the version it was revised from, with a full
+snapshot every `SNAPSHOT_INTERVAL` versions to bound how many deltas a read has to apply.
+
+Versions are stored as one JSON file each, written through a temporary file and an atomic
+rename, so the same directory can be shared by multiple gunicorn worker processes.
+
+Deleting a version breaks the delta chains built on it, so the directory should not be one that
+is cleaned up file by file, such as the system temp directory. Versions that have not been
+stored or read for `max_age_seconds` are pruned instead, keeping every version that a kept
+version's delta chain depends on.
+"""
+
+import difflib
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 10
+# Reconstructed texts kept in memory, since the latest versions are read the most.
+MAX_CACHED_TEXTS = 64
+DEFAULT_MAX_AGE_DAYS = 30
+PRUNE_INTERVAL_SECONDS = 60 * 60
+# IDs come back from the client, so anything else must not be turned into a path.
+_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+@dataclass
+class HistoryStoreStats:
+  versions: int = 0
+  # Versions that were already stored.
+  duplicates: int = 0
+  snapshots: int = 0
+  # Size of the texts that were stored, and of what was written for them.
+  text_bytes: int = 0
+  stored_bytes: int = 0
+  pruned: int = 0
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, text: str, stored_bytes: int | None, snapshot: bool):
+    with self._lock:
+      self.versions += 1
+      if stored_bytes is None:
+        self.duplicates += 1
+        return
+      self.snapshots += snapshot
+      self.text_bytes += len(text.encode("utf-8"))
+      self.stored_bytes += stored_bytes
+
+
+def text_id(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+def is_valid_id(version_id: str) -> bool:
+  return isinstance(version_id, str) and _ID_PATTERN.fullmatch(version_id) is not None
+
+
+class HistoryStore:
+  def __init__(self, directory: str, max_age_seconds: float | None = None):
+    """Creates a store in the given directory.
+
+    Args:
+      directory: Persistent directory to store versions in
+      max_age_seconds: If set, versions that were not stored or read for this long are pruned
+        in the background
+    """
+    self.directory = directory
+    self.max_age_seconds = max_age_seconds
+    self.stats = HistoryStoreStats()
+    self._cache = OrderedDict()
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    os.makedirs(directory, exist_ok=True)
+    if max_age_seconds:
+      threading.Thread(target=self._prune_periodically, name="history-prune", daemon=True).start()
+
+  def put(self, text: str, parent_id: str | None = None) -> str:
+    """Stores the text and returns its ID.
+
+    Args:
+      text: Text to store
+      parent_id: ID of a similar text, usually the previous version, to store a delta against
+    """
+    version_id = text_id(text)
+    if _touch(self._path(version_id)):
+      self.stats.record(text, None, snapshot=False)
+      self._remember(version_id, text)
+      return version_id
+
+    entry = self._delta_entry(text, parent_id) if parent_id and is_valid_id(parent_id) else None
+    if entry is None:
+      entry = {"text": text, "depth": 0}
+    stored = json.dumps(entry)
+    fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "w") as f:
+        f.write(stored)
+      os.replace(temp_path, self._path(version_id))
+    except BaseException:
+      os.remove(temp_path)
+      raise
+    self.stats.record(text, len(stored), snapshot="text" in entry)
+    self._remember(version_id, text)
+    return version_id
+
+  def get(self, version_id: str) -> str | None:
+    """Returns the text with the given ID, or None if it is not stored or not a valid ID."""
+    if not is_valid_id(version_id):
+      return None
+    with self._lock:
+      if version_id in self._cache:
+        self._cache.move_to_end(version_id)
+        return self._cache[version_id]
+
+    # Follow the deltas back to a snapshot, then apply them in order.
+    entries = []
+    current_id = version_id
+    while True:
+      entry = self._read(current_id)
+      if entry is None:
+        return None
+      entries.append(entry)
+      if "text" in entry:
+        break
+      current_id = entry["parent"]
+
+    lines = entries.pop()["text"].splitlines(keepends=True)
+    for entry in reversed(entries):
+      lines = _apply_delta(lines, entry["delta"])
+    text = "".join(lines)
+    _touch(self._path(version_id))
+    self._remember(version_id, text)
+    return text
+
+  def prune(self, max_age_seconds: float) -> int:
+    """Deletes versions that were not stored or read recently, and returns how many.
+
+    Versions that a kept version's delta chain depends on are kept, whatever their age.
+    """
+    cutoff = time.time() - max_age_seconds
+    old = set()
+    keep = []
+    for name in os.listdir(self.directory):
+      path = os.path.join(self.directory, name)
+      try:
+        modified_at = os.stat(path).st_mtime
+      except FileNotFoundError:
+        continue
+      if name.endswith(".tmp"):
+        # Left behind by a writer that was killed mid-write.
+        if modified_at < cutoff:
+          _remove(path)
+        continue
+      version_id = name.removesuffix(".json")
+      if not is_valid_id(version_id):
+        continue
+      if modified_at < cutoff:
+        old.add(version_id)
+      else:
+        keep.append(version_id)
+
+    for version_id in keep:
+      entry = self._read(version_id)
+      while entry and "parent" in entry and entry["parent"] in old:
+        old.discard(entry["parent"])
+        entry = self._read(entry["parent"])
+
+    pruned = 0
+    for version_id in old:
+      path = self._path(version_id)
+      try:
+        # Skip versions that were used or built on since the scan.
+        if os.stat(path).st_mtime >= cutoff:
+          continue
+      except FileNotFoundError:
+        continue
+      pruned += _remove(path)
+      with self._lock:
+        self._cache.pop(version_id, None)
+    with self.stats._lock:
+      self.stats.pruned += pruned
+    return pruned
+
+  def stop(self):
+    self._stopped.set()
+
+  def _prune_periodically(self):
+    while True:
+      try:
+        self.prune(self.max_age_seconds)
+      except OSError:
+        logger.warning("Could not prune the history store", exc_info=True)
+      if self._stopped.wait(PRUNE_INTERVAL_SECONDS):
+        return
+
+  def _delta_entry(self, text: str, parent_id: str) -> dict | None:
+    parent = self._read(parent_id)
+    parent_text = self.get(parent_id)
+    if parent is None or parent_text is None or parent["depth"] + 1 >= SNAPSHOT_INTERVAL:
+      return None
+    # Mark the chain as used, so that it is not pruned from under the new version.
+    current_id, current = parent_id, parent
+    while current:
+      _touch(self._path(current_id))
+      current_id = current.get("parent")
+      current = self._read(current_id) if current_id else None
+    delta = _make_delta(parent_text.splitlines(keepends=True), text.splitlines(keepends=True))
+    entry = {"parent": parent_id, "depth": parent["depth"] + 1, "delta": delta}
+    # Small or heavily rewritten texts are cheaper to store whole.
+    if len(json.dumps(delta)) >= len(text) // 2:
+      return None
+    return entry
+
+  def _read(self, version_id: str) -> dict | None:
+    try:
+      with open(self._path(version_id)) as f:
+        return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      return None
+
+  def _remember(self, version_id: str, text: str):
+    with self._lock:
+      self._cache[version_id] = text
+      self._cache.move_to_end(version_id)
+      while len(self._cache) > MAX_CACHED_TEXTS:
+        self._cache.popitem(last=False)
+
+  def _path(self, version_id: str) -> str:
+    if not is_valid_id(version_id):
+      raise ValueError(f"Invalid history ID: {version_id!r}")
+    return os.path.join(self.directory, version_id + ".json")
+
+
+def _touch(path: str) -> bool:
+  """Marks the file as recently used. Returns False if it does not exist."""
+  try:
+    os.utime(path)
+  except FileNotFoundError:
+    return False
+  return True
+
+
+def _remove(path: str) -> bool:
+  try:
+    os.remove(path)
+  except FileNotFoundError:
+    return False
+  return True
+
+
+def _make_delta(parent_lines: list[str], lines: list[str]) -> list:
+  """Returns the ops that turn the parent lines into the given lines.
+
+  Ops are either `[start, end]` to copy a range of parent lines, or `{"lines": [...]}` to insert
+  new lines.
+  """
+  delta = []
+  matcher = difflib.SequenceMatcher(None, parent_lines, lines, autojunk=False)
+  for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    if tag == "equal":
+      delta.append([i1, i2])
+    elif j1 != j2:
+      delta.append({"lines": lines[j1:j2]})
+  return delta
+
+
+def _apply_delta(parent_lines: list[str], delta: list) -> list[str]:
+  lines = []
+  for op in delta:
+    if isinstance(op, dict):
+      lines.extend(op["lines"])
+    else:
+      lines.extend(parent_lines[op[0] : op[1]])
+  return lines
+
+
+# Set to 0 to keep everything.
+_max_age_days = float(os.getenv("MESOP_APP_MAKER_HISTORY_MAX_AGE_DAYS", str(DEFAULT_MAX_AGE_DAYS)))
+store = HistoryStore(
+  os.getenv("MESOP_APP_MAKER_HISTORY_DIR")
+  or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "mesop-app-maker",
+    "history",
+  ),
+  max_age_seconds=_max_age_days * 24 * 60 * 60,
+)
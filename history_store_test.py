@@ -0,0 +1,77 @@
+import os
+import time
+
+from history_store import SNAPSHOT_INTERVAL, HistoryStore
+
+CODE = "".join(f"line {i}\n" for i in range(100))
+
+
+def make_old(store: HistoryStore, version_id: str, days: int = 60):
+  old = time.time() - days * 24 * 60 * 60
+  os.utime(store._path(version_id), (old, old))
+
+
+def test_versions_round_trip_through_deltas(tmp_path):
+  store = HistoryStore(str(tmp_path))
+  parent_id = store.put(CODE)
+  child_id = store.put(CODE + "extra\n", parent_id)
+  store._cache.clear()
+
+  assert store.get(child_id) == CODE + "extra\n"
+  assert "parent" in store._read(child_id)
+
+
+def test_invalid_ids_are_not_read(tmp_path):
+  store = HistoryStore(str(tmp_path / "history"))
+  (tmp_path / "secret.json").write_text('{"text": "secret", "depth": 0}')
+
+  assert store.get("../secret") is None
+  assert store.get("") is None
+
+
+def test_invalid_parent_id_stores_a_snapshot(tmp_path):
+  store = HistoryStore(str(tmp_path))
+  version_id = store.put(CODE, "../../etc/passwd")
+
+  assert "text" in store._read(version_id)
+
+
+def test_prune_deletes_old_versions(tmp_path):
+  store = HistoryStore(str(tmp_path))
+  old_id = store.put("old")
+  new_id = store.put("new")
+  make_old(store, old_id)
+
+  assert store.prune(30 * 24 * 60 * 60) == 1
+
+  store._cache.clear()
+  assert store.get(old_id) is None
+  assert store.get(new_id) == "new"
+
+
+def test_prune_keeps_chains_of_recent_versions(tmp_path):
+  store = HistoryStore(str(tmp_path))
+  ids = [store.put(CODE)]
+  for i in range(3):
+    ids.append(store.put(CODE + f"version {i}\n", ids[-1]))
+  for version_id in ids[:-1]:
+    make_old(store, version_id)
+
+  assert store.prune(30 * 24 * 60 * 60) == 0
+
+  store._cache.clear()
+  assert store.get(ids[-1]) == CODE + "version 2\n"
+
+
+def test_new_delta_marks_its_chain_as_used(tmp_path):
+  store = HistoryStore(str(tmp_path))
+  ids = [store.put(CODE)]
+  for i in range(SNAPSHOT_INTERVAL - 2):
+    ids.append(store.put(CODE + f"version {i}\n", ids[-1]))
+  for version_id in ids:
+    make_old(store, version_id)
+
+  child_id = store.put(CODE + "latest\n", ids[-1])
+
+  assert "parent" in store._read(child_id)
+  assert store.prune(30 * 24 * 60 * 60) == 0
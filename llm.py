@@ -1,7 +1,24 @@
-from typing import Tuple
+import ast
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 
 import google.generativeai as genai
-
+from google.api_core import exceptions as api_exceptions
+from google.generativeai import client as genai_client
+
+import candidates
+import code_repair
+import edit_script
+import hedging
+import response_cache as rc
+import scheduler
+from context_cache import CachedPrefix, ContextCache, GeminiContextCacheProvider
+from doc_index import DEFAULT_TOKEN_BUDGET, DocIndex
 
 with open("prompt/base_system_instructions.txt") as f:
   SYSTEM_INSTRUCTION = f.read()
@@ -111,11 +128,167 @@ Here is a description of the changes I want:
 """.strip()
 
 
+EDIT_SCRIPT_INSTRUCTIONS = """
+Do not output the whole program. Only output the changes as search/replace blocks in this format:
+
+<<<<<<< SEARCH
+exact lines from the current code
+=======
+new lines to replace them with
+>>>>>>> REPLACE
+
+Each SEARCH section must match the current code exactly, including indentation, and must be
+unique within the code. Include a few surrounding lines if needed to make it unique. Use multiple
+blocks for multiple changes. Blocks are applied in order.
+""".strip()
+
+REVISE_APP_EDITS_BASE_PROMPT = """
+Your task is to modify a Mesop app given the code and a description.
+
+Make sure to remember these rules when making modifications:
+1. For the @me.page decorator, leave it empty like this `@me.page()`
+2. Event handler functions cannot use lambdas. You must use functions.
+3. Event handler functions only pass in the event type. They do not accept extra parameters.
+4. For padding, make sure to use the the `me.Padding` object rather than a string or int.
+5. For margin, make sure to use the the `me.Margin` object rather than a string or int.
+6. For border, make sure to use the the `me.Border` and `me.BorderSide` objects rather than a string.
+7. For buttons, prefer using type="flat", especially if it is the primary button.
+
+<EDIT_SCRIPT_INSTRUCTIONS>
+
+Here is is the code for the app:
+
+```
+<APP_CODE>
+```
+
+Here is a description of the changes I want:
+
+<APP_CHANGES>
+
+""".strip().replace("<EDIT_SCRIPT_INSTRUCTIONS>", EDIT_SCRIPT_INSTRUCTIONS)
+
+REVISE_CHAT_APP_EDITS_BASE_PROMPT = """
+Your task is to modify a Mesop chat app given the code and a description.
+
+Make sure to remember these rules when making modifications:
+1. For the @me.page decorator, leave it empty like this `@me.page()`
+2. Event handler functions cannot use lambdas. You must use functions.
+3. Event handler functions only pass in the event type. They do not accept extra parameters.
+4. For padding, make sure to use the the `me.Padding` object rather than a string or int.
+5. For margin, make sure to use the the `me.Margin` object rather than a string or int.
+6. For border, make sure to use the the `me.Border` and `me.BorderSide` objects rather than a string.
+7. For buttons, prefer using type="flat", especially if it is the primary button.
+8. Remember that me.box is a like a div. So you can use similar CSS styles for layout.
+
+<EDIT_SCRIPT_INSTRUCTIONS>
+
+Here is is the code for the chat app:
+
+```
+<APP_CODE>
+```
+
+Here is a description of the changes I want:
+
+<APP_CHANGES>
+
+""".strip().replace("<EDIT_SCRIPT_INSTRUCTIONS>", EDIT_SCRIPT_INSTRUCTIONS)
+
+
+# Max number of (api_key, model_name, app_type) models to keep around per worker.
+MODEL_CACHE_SIZE = 16
+
+# Errors that indicate a cached prefix can no longer be used, in which case we retry with the
+# full system instruction.
+CACHED_PREFIX_ERRORS = (
+  api_exceptions.NotFound,
+  api_exceptions.PermissionDenied,
+  api_exceptions.FailedPrecondition,
+)
+
+
+class ModelRegistry:
+  """Thread-safe LRU cache of Gemini models.
+
+  Each model gets its own client bound to its API key, so sessions using different keys in
+  the same worker do not interfere with each other through `genai.configure`.
+  """
+
+  def __init__(
+    self,
+    max_size: int = MODEL_CACHE_SIZE,
+    context_cache: ContextCache | None = None,
+    doc_index: DocIndex | None = None,
+    doc_token_budget: int = DEFAULT_TOKEN_BUDGET,
+  ):
+    self.max_size = max_size
+    self.context_cache = context_cache
+    self.doc_index = doc_index
+    self.doc_token_budget = doc_token_budget
+    self._models: OrderedDict[tuple[str, str, str, str], genai.GenerativeModel] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(
+    self,
+    api_key: str,
+    model_name: str,
+    app_type: str,
+    use_context_cache: bool = True,
+    doc_query: str = "",
+  ) -> genai.GenerativeModel:
+    """Gets a model for the given settings.
+
+    If a doc index is configured and a `doc_query` is given, the system instructions only
+    include the documentation sections relevant to the query. Context caching is skipped in
+    that case since the instructions differ between requests.
+    """
+    cached_prefix = None
+    system_instruction = SYSTEM_INSTRUCTION
+    if self.doc_index and doc_query:
+      sections = self.doc_index.select_sections(doc_query, self.doc_token_budget)
+      system_instruction = self.doc_index.build_system_instruction(sections)
+      variant = "docs:" + ",".join(str(section.index) for section in sections)
+    elif self.context_cache and use_context_cache:
+      cached_prefix = self.context_cache.get(
+        api_key, model_name, app_type, SYSTEM_INSTRUCTION + get_prompt_examples(app_type)
+      )
+      variant = cached_prefix.name if cached_prefix else ""
+    else:
+      variant = ""
+
+    key = (api_key, model_name, app_type, variant)
+    with self._lock:
+      model = self._models.get(key)
+      if model is not None:
+        self._models.move_to_end(key)
+        return model
+
+    # Build outside the lock so a slow client setup does not block other sessions. If two
+    # threads race on the same key, the first one stored wins.
+    model = make_model(
+      api_key, model_name, get_prompt_examples(app_type), cached_prefix, system_instruction
+    )
+
+    with self._lock:
+      model = self._models.setdefault(key, model)
+      self._models.move_to_end(key)
+      while len(self._models) > self.max_size:
+        self._models.popitem(last=False)
+      return model
+
+  def clear(self):
+    with self._lock:
+      self._models.clear()
+
+
 def make_model(
-  api_key: str, model_name: str, additional_instructions: str
+  api_key: str,
+  model_name: str,
+  additional_instructions: str,
+  cached_prefix: CachedPrefix | None = None,
+  system_instruction: str = SYSTEM_INSTRUCTION,
 ) -> genai.GenerativeModel:
-  genai.configure(api_key=api_key)
-
   generation_config = {
     "temperature": 1,
     "top_p": 0.95,
@@ -142,12 +315,121 @@ def make_model(
     },
   ]
 
-  return genai.GenerativeModel(
-    model_name=model_name,
-    system_instruction=SYSTEM_INSTRUCTION + additional_instructions,
-    safety_settings=safety_settings,
-    generation_config=generation_config,
+  if cached_prefix:
+    # The system instruction and examples already live in the cached prefix.
+    model = genai.GenerativeModel.from_cached_content(
+      cached_prefix,
+      safety_settings=safety_settings,
+      generation_config=generation_config,
+    )
+  else:
+    model = genai.GenerativeModel(
+      model_name=model_name,
+      system_instruction=system_instruction + additional_instructions,
+      safety_settings=safety_settings,
+      generation_config=generation_config,
+    )
+  if hasattr(model, "_client") and hasattr(genai_client, "_ClientManager"):
+    model._client = make_client(api_key)
+  else:
+    # The SDK no longer has the private client hooks, so fall back to configuring the API key
+    # process-wide. Sessions with different keys in the same worker can then interfere.
+    genai.configure(**_client_settings(api_key))
+  return model
+
+
+# Overrides the Gemini API endpoint, such as to use a proxy or the fake in `fake_services`.
+GEMINI_ENDPOINT = os.getenv("MESOP_APP_MAKER_GEMINI_ENDPOINT", "")
+
+
+@functools.lru_cache(maxsize=MODEL_CACHE_SIZE)
+def make_client(api_key: str, name: str = "generative"):
+  """Creates a Gemini service client scoped to the given API key.
+
+  `genai.configure` sets process-wide state, so we configure a private client manager
+  instead. The client manager is private to the SDK, so if it is missing we fall back to
+  `genai.configure` and the default client.
+  """
+  if not hasattr(genai_client, "_ClientManager"):
+    genai.configure(**_client_settings(api_key))
+    return getattr(genai_client, f"get_default_{name}_client")()
+  client_manager = genai_client._ClientManager()
+  client_manager.configure(**_client_settings(api_key))
+  return client_manager.get_default_client(name)
+
+
+def _client_settings(api_key: str) -> dict:
+  if GEMINI_ENDPOINT:
+    return {
+      "api_key": api_key,
+      "transport": "rest",
+      "client_options": {"api_endpoint": GEMINI_ENDPOINT},
+    }
+  return {"api_key": api_key}
+
+
+context_cache = (
+  ContextCache(GeminiContextCacheProvider(make_client))
+  if bool(int(os.getenv("MESOP_APP_MAKER_CONTEXT_CACHE", "0")))
+  else None
+)
+doc_token_budget = int(os.getenv("MESOP_APP_MAKER_DOC_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+model_registry = ModelRegistry(
+  context_cache=context_cache,
+  doc_index=DocIndex(SYSTEM_INSTRUCTION)
+  if bool(int(os.getenv("MESOP_APP_MAKER_DOC_RETRIEVAL", "0")))
+  else None,
+  doc_token_budget=doc_token_budget,
+)
+
+response_cache = (
+  rc.ResponseCache(
+    os.getenv("MESOP_APP_MAKER_RESPONSE_CACHE_DIR"),
+    max_bytes=int(os.getenv("MESOP_APP_MAKER_RESPONSE_CACHE_MAX_MB", "100")) * 1024 * 1024,
+    ttl_seconds=int(os.getenv("MESOP_APP_MAKER_RESPONSE_CACHE_TTL", str(rc.DEFAULT_TTL_SECONDS))),
   )
+  if os.getenv("MESOP_APP_MAKER_RESPONSE_CACHE_DIR")
+  else None
+)
+
+# Changes whenever the prompt files change, so stale cached responses are not reused.
+PROMPT_ASSETS_VERSION = rc.make_key(
+  SYSTEM_INSTRUCTION,
+  DEFAULT_EXAMPLES,
+  CHAT_ELEMENTS_EXAMPLES,
+  CHAT_EXAMPLES,
+  f"doc_retrieval={bool(model_registry.doc_index)},budget={doc_token_budget}",
+)
+
+
+request_scheduler = scheduler.Scheduler(
+  rate_per_minute=float(os.getenv("MESOP_APP_MAKER_LLM_RATE_PER_MINUTE", "15")),
+  burst=int(os.getenv("MESOP_APP_MAKER_LLM_BURST", "3")),
+  max_concurrent=int(os.getenv("MESOP_APP_MAKER_LLM_MAX_CONCURRENT", "4")),
+  max_queue=int(os.getenv("MESOP_APP_MAKER_LLM_MAX_QUEUE", "20")),
+  max_wait_seconds=float(os.getenv("MESOP_APP_MAKER_LLM_MAX_WAIT", "60")),
+)
+
+
+# Model to send a backup request to when the selected model is slow.
+HEDGE_BACKUP_MODELS = {
+  "gemini-1.5-flash": "gemini-1.5-pro",
+  "gemini-1.5-pro": "gemini-1.5-flash",
+}
+
+hedger = hedging.Hedger(
+  percentile=float(os.getenv("MESOP_APP_MAKER_HEDGE_PERCENTILE", str(hedging.DEFAULT_PERCENTILE))),
+  default_delay_seconds=float(
+    os.getenv("MESOP_APP_MAKER_HEDGE_DELAY", str(hedging.DEFAULT_DELAY_SECONDS))
+  ),
+  max_workers=int(os.getenv("MESOP_APP_MAKER_HEDGE_WORKERS", str(hedging.DEFAULT_MAX_WORKERS))),
+)
+
+
+num_candidates = int(
+  os.getenv("MESOP_APP_MAKER_NUM_CANDIDATES", str(candidates.DEFAULT_NUM_CANDIDATES))
+)
+candidate_generator = candidates.CandidateGenerator()
 
 
 def get_prompt_examples(app_type: str) -> str:
@@ -168,19 +450,331 @@ def get_revise_prompt_base(app_type: str) -> str:
   return REVISE_APP_BASE_PROMPT
 
 
-def generate_mesop_app(msg: str, model_name: str, api_key: str, app_type: str) -> str:
-  model = make_model(api_key, model_name, get_prompt_examples(app_type))
-  response = model.generate_content(
+def get_revise_edits_prompt_base(app_type: str) -> str:
+  if app_type == "chat":
+    return REVISE_CHAT_APP_EDITS_BASE_PROMPT
+  return REVISE_APP_EDITS_BASE_PROMPT
+
+
+def generate_mesop_app(
+  msg: str,
+  model_name: str,
+  api_key: str,
+  app_type: str,
+  stream: bool = False,
+  candidate: int = 0,
+) -> str | Iterator[str]:
+  """Generates a Mesop app from a description.
+
+  If `stream` is True, an iterator of text chunks is returned instead of the full text.
+  `candidate` distinguishes parallel candidates for the same prompt in the response cache.
+  """
+  return _generate_text(
     get_generate_prompt_base(app_type).replace("<APP_DESCRIPTION>", msg),
-    request_options={"timeout": 120},
+    mode="generate",
+    model_name=model_name,
+    api_key=api_key,
+    app_type=app_type,
+    stream=stream,
+    doc_query=msg,
+    candidate=candidate,
   )
-  return response.text
 
 
-def adjust_mesop_app(code: str, msg: str, model_name: str, api_key: str, app_type: str) -> str:
-  model = make_model(api_key, model_name, get_prompt_examples(app_type))
-  response = model.generate_content(
+def adjust_mesop_app(
+  code: str,
+  msg: str,
+  model_name: str,
+  api_key: str,
+  app_type: str,
+  stream: bool = False,
+  candidate: int = 0,
+) -> str | Iterator[str]:
+  """Revises a Mesop app given its code and a description of the changes.
+
+  If `stream` is True, an iterator of text chunks is returned instead of the full text.
+  `candidate` distinguishes parallel candidates for the same prompt in the response cache.
+  """
+  return _generate_text(
     get_revise_prompt_base(app_type).replace("<APP_CODE>", code).replace("<APP_CHANGES>", msg),
-    request_options={"timeout": 120},
+    mode="revise",
+    model_name=model_name,
+    api_key=api_key,
+    app_type=app_type,
+    stream=stream,
+    doc_query=msg + "\n" + code,
+    candidate=candidate,
   )
+
+
+def hedge_mesop_app(
+  msg: str, model_name: str, api_key: str, app_type: str, code: str | None = None
+) -> tuple[str, str]:
+  """Generates a Mesop app, or revises it if code is given, hedging with a backup model.
+
+  Returns the generated text and the name of the model that produced it.
+  """
+
+  def call(name: str) -> Iterator[str]:
+    if code is None:
+      return generate_mesop_app(msg, name, api_key, app_type, stream=True)
+    return adjust_mesop_app(code, msg, name, api_key, app_type, stream=True)
+
+  return hedger.run(
+    call,
+    model_name,
+    HEDGE_BACKUP_MODELS[model_name],
+    _parses_as_python,
+    # The caller's ticket only covers the primary request.
+    admit_backup=lambda: request_scheduler.try_admit(api_key),
+  )
+
+
+def generate_mesop_app_candidates(
+  msg: str, model_name: str, api_key: str, app_type: str, code: str | None = None
+) -> candidates.CandidateResult:
+  """Generates a Mesop app, or revises it if code is given, using several parallel candidates.
+
+  Returns the first candidate that passes the local rule checks.
+  """
+
+  def call(index: int) -> Iterator[str]:
+    if code is None:
+      return generate_mesop_app(msg, model_name, api_key, app_type, stream=True, candidate=index)
+    return adjust_mesop_app(code, msg, model_name, api_key, app_type, stream=True, candidate=index)
+
+  return candidate_generator.run(
+    call,
+    num_candidates,
+    # Check candidates after repair, since violations that can be repaired do not matter.
+    lambda text: code_repair.process(text).code,
+    # The caller's ticket only covers the first candidate.
+    admit=lambda: request_scheduler.try_admit(api_key),
+  )
+
+
+code_repair_stats = code_repair.RepairStats()
+
+
+def postprocess_code(text: str) -> code_repair.RepairResult:
+  """Extracts the code from the LLM response and repairs prompt rule violations."""
+  result = code_repair.process(text)
+  code_repair_stats.record(result)
+  return result
+
+
+def _parses_as_python(text: str) -> bool:
+  code, _ = code_repair.extract_code(text)
+  try:
+    ast.parse(code)
+  except SyntaxError:
+    return False
+  return True
+
+
+@dataclass
+class EditRevision:
+  """Metrics for a single edit script revision.
+
+  The full rewrite estimates assume output tokens per character and generation time per
+  output token would have been the same had the model output the whole program.
+  """
+
+  applied: bool
+  output_tokens: int
+  seconds: float
+  estimated_full_output_tokens: int = 0
+  estimated_seconds_saved: float = 0.0
+  # Served from the response cache, so nothing was generated to measure.
+  cached: bool = False
+
+  @property
+  def estimated_tokens_saved(self) -> int:
+    return self.estimated_full_output_tokens - self.output_tokens
+
+
+@dataclass
+class EditRevisionStats:
+  """Aggregate metrics for edit script revisions in this worker."""
+
+  revisions: int = 0
+  fallbacks: int = 0
+  output_tokens: int = 0
+  estimated_tokens_saved: int = 0
+  estimated_seconds_saved: float = 0.0
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, revision: EditRevision):
+    with self._lock:
+      self.revisions += 1
+      self.output_tokens += revision.output_tokens
+      if revision.applied:
+        self.estimated_tokens_saved += revision.estimated_tokens_saved
+        self.estimated_seconds_saved += revision.estimated_seconds_saved
+      else:
+        self.fallbacks += 1
+
+
+edit_revision_stats = EditRevisionStats()
+
+
+def adjust_mesop_app_with_edits(
+  code: str, msg: str, model_name: str, api_key: str, app_type: str
+) -> tuple[str, EditRevision]:
+  """Revises a Mesop app by asking for search/replace edits instead of the whole program.
+
+  Falls back to a full regeneration with `adjust_mesop_app` if the edits cannot be applied.
+  """
+  prompt = (
+    get_revise_edits_prompt_base(app_type).replace("<APP_CODE>", code).replace("<APP_CHANGES>", msg)
+  )
+  cache_key = _response_cache_key(prompt, "revise_edits", model_name, app_type)
+  if response_cache:
+    new_code = response_cache.get(cache_key)
+    if new_code is not None:
+      return new_code, EditRevision(applied=True, output_tokens=0, seconds=0.0, cached=True)
+
+  start = time.monotonic()
+  response = _generate_content(
+    prompt,
+    model_name=model_name,
+    api_key=api_key,
+    app_type=app_type,
+    doc_query=msg + "\n" + code,
+  )
+  seconds = time.monotonic() - start
+  output_tokens = response.usage_metadata.candidates_token_count
+
+  try:
+    new_code = edit_script.apply_edits(code, response.text)
+  except edit_script.EditScriptError:
+    revision = EditRevision(applied=False, output_tokens=output_tokens, seconds=seconds)
+    edit_revision_stats.record(revision)
+    return adjust_mesop_app(code, msg, model_name, api_key, app_type), revision
+
+  tokens_per_char = output_tokens / max(len(response.text), 1)
+  estimated_full_output_tokens = round(len(new_code) * tokens_per_char)
+  seconds_per_token = seconds / max(output_tokens, 1)
+  revision = EditRevision(
+    applied=True,
+    output_tokens=output_tokens,
+    seconds=seconds,
+    estimated_full_output_tokens=estimated_full_output_tokens,
+    estimated_seconds_saved=(estimated_full_output_tokens - output_tokens) * seconds_per_token,
+  )
+  edit_revision_stats.record(revision)
+  if response_cache:
+    response_cache.set(cache_key, new_code, seconds)
+  return new_code, revision
+
+
+def _generate_text(
+  prompt: str,
+  mode: str,
+  model_name: str,
+  api_key: str,
+  app_type: str,
+  stream: bool = False,
+  doc_query: str = "",
+  candidate: int = 0,
+) -> str | Iterator[str]:
+  """Generates text, serving it from the response cache when possible."""
+  cache_key = _response_cache_key(prompt, mode, model_name, app_type, candidate)
+  if response_cache:
+    text = response_cache.get(cache_key)
+    if text is not None:
+      return iter([text]) if stream else text
+
+  start = time.monotonic()
+  response = _generate_content(
+    prompt,
+    model_name=model_name,
+    api_key=api_key,
+    app_type=app_type,
+    stream=stream,
+    doc_query=doc_query,
+  )
+  if stream:
+    return _TextStream(response, cache_key, start)
+  if response_cache:
+    response_cache.set(cache_key, response.text, time.monotonic() - start)
   return response.text
+
+
+def _response_cache_key(
+  prompt: str, mode: str, model_name: str, app_type: str, candidate: int = 0
+) -> str:
+  # The prompt already contains the description and input code. Parallel candidates for the same
+  # prompt are cached separately, otherwise they would all come back as the same response.
+  if candidate:
+    mode = f"{mode}:candidate-{candidate}"
+  return rc.make_key(PROMPT_ASSETS_VERSION, model_name, app_type, mode, prompt)
+
+
+def _generate_content(
+  prompt: str,
+  model_name: str,
+  api_key: str,
+  app_type: str,
+  stream: bool = False,
+  doc_query: str = "",
+):
+  """Generates content, falling back to the full system instruction if the cached prefix fails."""
+  model = model_registry.get(api_key, model_name, app_type, doc_query=doc_query)
+  try:
+    return model.generate_content(prompt, stream=stream, request_options={"timeout": 120})
+  except CACHED_PREFIX_ERRORS:
+    if not model.cached_content:
+      raise
+    context_cache.invalidate(api_key, model_name, app_type)
+    model = model_registry.get(api_key, model_name, app_type, use_context_cache=False)
+    return model.generate_content(prompt, stream=stream, request_options={"timeout": 120})
+
+
+class _TextStream:
+  """Iterates over the text chunks of a streamed response, caching the text once it finishes.
+
+  `cancel` may be called from another thread to drop the connection while the stream is being
+  read, such as when a hedged request loses.
+  """
+
+  def __init__(self, response, cache_key: str, start: float):
+    self._response = response
+    self._cache_key = cache_key
+    self._start = start
+    self._chunks = iter(response)
+    self._text_chunks = []
+    # Cleared once the text is cached, or when the stream is dropped before it finishes.
+    self._cacheable = True
+
+  def __iter__(self) -> Iterator[str]:
+    return self
+
+  def __next__(self) -> str:
+    # Chunks without any parts, such as the final chunk with only usage metadata, have no text.
+    while True:
+      try:
+        chunk = next(self._chunks)
+      except StopIteration:
+        # A cancelled stream may end early, so only cache streams that were read to the end.
+        if response_cache and self._cacheable:
+          response_cache.set(
+            self._cache_key, "".join(self._text_chunks), time.monotonic() - self._start
+          )
+        self._cacheable = False
+        raise
+      if chunk.parts:
+        self._text_chunks.append(chunk.text)
+        return chunk.text
+
+  def close(self):
+    self._chunks = iter(())
+    self._cacheable = False
+
+  def cancel(self):
+    self._cacheable = False
+    # The response reads from a gRPC or REST stream iterator, both of which can be cancelled
+    # from any thread. Reading the response then fails instead of waiting for the next chunk.
+    cancel = getattr(getattr(self._response, "_iterator", None), "cancel", None)
+    if cancel:
+      cancel()
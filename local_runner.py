@@ -0,0 +1,454 @@
+"""Local runner with a warm pool of Mesop processes, for development.
+
+This has the same `/exec` contract as the Mesop App Runner, so the editor uploads to it through
+`runner_client` as usual. Uploaded code is loaded into one of a pool of worker processes that
+have already imported Mesop and are serving a placeholder app, so running code costs a module
+reload instead of starting a new Mesop server.
+
+Each worker serves its app on its own port, and the URL path returned by `/exec` redirects there.
+Since the preview iframe loads that URL from the browser, this only works when the browser runs
+on the same machine as the editor.
+
+Generated code is untrusted, so the local runner is off unless the server opts in with
+`MESOP_APP_MAKER_LOCAL_RUNNER_ENABLED=1`. Never enable it on a shared deployment. Workers get a
+minimal environment and memory and CPU limits, but a worker running as the same user as the
+editor can still read the editor's files and its environment through `/proc`, which includes
+secrets such as the Gemini API key. Set `MESOP_APP_MAKER_LOCAL_RUNNER_USER` to run workers as a
+separate, unprivileged user, which requires the editor to be allowed to switch users. Each
+worker is replaced by a fresh process after a number of runs, since reloading code can leak
+memory.
+"""
+
+import argparse
+import base64
+import hashlib
+import logging
+import os
+import pwd
+import resource
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+import runner_client
+
+logger = logging.getLogger(__name__)
+
+# The local runner runs untrusted code on this machine, so the server has to opt in.
+ENABLED = bool(int(os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER_ENABLED", "0")))
+DEFAULT_NUM_WORKERS = 2
+DEFAULT_MAX_RUNS_PER_WORKER = 20
+DEFAULT_MEMORY_LIMIT_MB = 2048
+DEFAULT_CPU_LIMIT_SECONDS = 600
+WORKER_START_TIMEOUT_SECONDS = 60.0
+WORKER_LOAD_TIMEOUT_SECONDS = 30.0
+WORKER_TOKEN_HEADER = "X-Local-Runner-Token"
+
+PLACEHOLDER_APP = """import mesop as me
+
+
+@me.page()
+def page():
+  me.text("Waiting for code...")
+"""
+
+
+class _Worker:
+  """A Mesop process that loads uploaded code on request."""
+
+  def __init__(self, memory_limit_mb: int, cpu_limit_seconds: int, user: str = ""):
+    self.port = _free_port()
+    self.token = secrets.token_urlsafe(16)
+    self.runs = 0
+    self.last_used_at = 0.0
+    self.ready = threading.Event()
+    self.app_dir = tempfile.mkdtemp(prefix="mesop-local-runner-")
+    user_args = {}
+    if user:
+      account = pwd.getpwnam(user)
+      os.chown(self.app_dir, account.pw_uid, account.pw_gid)
+      user_args = {"user": account.pw_uid, "group": account.pw_gid, "extra_groups": []}
+    self.process = subprocess.Popen(
+      [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--worker",
+        "--port",
+        str(self.port),
+        # The worker sets its own limits before loading anything, since `preexec_fn` is not safe
+        # to use from a threaded server.
+        "--memory-limit-mb",
+        str(memory_limit_mb),
+        "--cpu-limit-seconds",
+        str(cpu_limit_seconds),
+      ],
+      cwd=self.app_dir,
+      # Keep secrets such as the Gemini API key out of the worker's environment.
+      env={"PATH": os.environ.get("PATH", ""), "HOME": self.app_dir},
+      # The token is passed on stdin, so that it does not show up in the worker's environment.
+      stdin=subprocess.PIPE,
+      stdout=subprocess.DEVNULL,
+      **user_args,
+    )
+    self.process.stdin.write(self.token.encode("utf-8") + b"\n")
+    self.process.stdin.close()
+    threading.Thread(target=self._wait_until_ready, daemon=True).start()
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.port}"
+
+  @property
+  def alive(self) -> bool:
+    return self.process.poll() is None
+
+  def load(self, code: str) -> requests.Response:
+    if not self.ready.wait(WORKER_START_TIMEOUT_SECONDS):
+      raise runner_client.RunnerError("Timed out starting a local runner process.")
+    self.runs += 1
+    self.last_used_at = time.monotonic()
+    return requests.post(
+      self.url + "/__local_runner__/load",
+      data=code.encode("utf-8"),
+      headers={WORKER_TOKEN_HEADER: self.token},
+      timeout=WORKER_LOAD_TIMEOUT_SECONDS,
+    )
+
+  def stop(self):
+    self.process.kill()
+    shutil.rmtree(self.app_dir, ignore_errors=True)
+
+  def _wait_until_ready(self):
+    deadline = time.monotonic() + WORKER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline and self.alive:
+      try:
+        requests.get(self.url + "/__local_runner__/ready", timeout=1).raise_for_status()
+        self.ready.set()
+        return
+      except requests.RequestException:
+        time.sleep(0.1)
+
+
+class _Slot:
+  """A position in the pool. Its worker is swapped out when it is recycled."""
+
+  def __init__(self, index: int):
+    self.index = index
+    # Bumped on every load, so that URLs of apps that were replaced stop working.
+    self.generation = 0
+    self.worker: _Worker | None = None
+    # Fresh worker that takes over once the current one has done enough runs.
+    self.replacement: _Worker | None = None
+    self.lock = threading.Lock()
+
+
+class LocalRunner:
+  def __init__(
+    self,
+    num_workers: int = DEFAULT_NUM_WORKERS,
+    max_runs_per_worker: int = DEFAULT_MAX_RUNS_PER_WORKER,
+    memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+    cpu_limit_seconds: int = DEFAULT_CPU_LIMIT_SECONDS,
+    port: int = 0,
+    user: str = "",
+  ):
+    self.max_runs_per_worker = max_runs_per_worker
+    self.memory_limit_mb = memory_limit_mb
+    self.cpu_limit_seconds = cpu_limit_seconds
+    self.user = user
+    self.token = secrets.token_urlsafe(16)
+    self.recycled = 0
+    self._slots = [_Slot(index) for index in range(num_workers)]
+    self._lock = threading.Lock()
+    for slot in self._slots:
+      slot.worker = self._start_worker()
+    self._server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(self))
+    self._server.daemon_threads = True
+    threading.Thread(target=self._server.serve_forever, name="local-runner", daemon=True).start()
+
+  @property
+  def url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def exec(self, code: str) -> tuple[int, str]:
+    """Loads code into a worker and returns the status and the URL path or error."""
+    slot = self._acquire_slot()
+    try:
+      worker = self._prepare_worker(slot)
+      try:
+        response = worker.load(code)
+      except requests.RequestException as e:
+        worker.stop()
+        return 500, f"Local runner process failed: {e}"
+      slot.generation += 1
+      if worker.runs >= self.max_runs_per_worker and slot.replacement is None:
+        # Warm up the next worker now so that it is ready by the next run.
+        slot.replacement = self._start_worker()
+      if response.status_code != 200:
+        return response.status_code, response.text
+      return 200, f"/~{slot.index}-{slot.generation}/"
+    finally:
+      slot.lock.release()
+
+  def app_url(self, path: str) -> str | None:
+    """Returns the worker URL for a path returned by `exec`, if it is still being served."""
+    try:
+      index, generation = path.strip("/").removeprefix("~").split("-")
+      slot = self._slots[int(index)]
+    except (ValueError, IndexError):
+      return None
+    worker = slot.worker
+    if str(slot.generation) != generation or worker is None or not worker.alive:
+      return None
+    return worker.url + "/"
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+    for slot in self._slots:
+      for worker in (slot.worker, slot.replacement):
+        if worker:
+          worker.stop()
+
+  def _acquire_slot(self) -> _Slot:
+    # Use the least recently used free worker, so that recent apps keep being served.
+    while True:
+      with self._lock:
+        slots = sorted(self._slots, key=lambda slot: slot.worker.last_used_at if slot.worker else 0)
+        for slot in slots:
+          if slot.lock.acquire(blocking=False):
+            return slot
+      time.sleep(0.05)
+
+  def _prepare_worker(self, slot: _Slot) -> _Worker:
+    replacement = slot.replacement
+    if replacement and replacement.ready.is_set():
+      slot.worker.stop()
+      slot.worker, slot.replacement = replacement, None
+      self.recycled += 1
+    elif not slot.worker.alive:
+      # The worker hit a resource limit or crashed.
+      slot.worker, slot.replacement = replacement or self._start_worker(), None
+    return slot.worker
+
+  def _start_worker(self) -> _Worker:
+    return _Worker(self.memory_limit_mb, self.cpu_limit_seconds, self.user)
+
+
+def _make_handler(runner: LocalRunner) -> type[BaseHTTPRequestHandler]:
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+      pass
+
+    def do_POST(self):
+      if self.path != "/exec":
+        self._send_text(404, "Not found")
+        return
+      body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+      try:
+        if self.headers.get("Content-Type") == "application/octet-stream":
+          token = self.headers.get(runner_client.TOKEN_HEADER, "")
+          code = runner_client.decode_compact_upload(body, self.headers)
+        else:
+          form = parse_qs(body.decode("utf-8"))
+          token = form.get("token", [""])[0]
+          code = base64.b64decode(form.get("code", [""])[0]).decode("utf-8")
+      except ValueError as e:
+        self._send_text(400, str(e))
+        return
+      if not secrets.compare_digest(token, runner.token):
+        self._send_text(403, "Invalid token")
+        return
+      try:
+        status, text = runner.exec(code)
+      except runner_client.RunnerError as e:
+        # Not 503, which `runner_client` retries: the worker already had a full start timeout to
+        # come up, so retrying would only chain more of those waits.
+        status, text = 500, str(e)
+      self._send_text(status, text)
+
+    def do_GET(self):
+      if self.path == "/":
+        formats = f"{runner_client.UPLOAD_FORMAT_COMPACT},{runner_client.UPLOAD_FORMAT_BASE64}"
+        self._send_text(
+          200, "Mesop local runner", headers={runner_client.UPLOAD_FORMATS_HEADER: formats}
+        )
+        return
+      app_url = runner.app_url(self.path)
+      if app_url is None:
+        self._send_text(404, "Not found")
+        return
+      self.send_response(302)
+      self.send_header("Location", app_url)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+
+    def _send_text(self, status: int, text: str, headers: dict[str, str] | None = None):
+      body = text.encode("utf-8")
+      self.send_response(status)
+      self.send_header("Content-Type", "text/plain")
+      for name, value in (headers or {}).items():
+        self.send_header(name, value)
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  return Handler
+
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+def _set_resource_limits(memory_limit_mb: int, cpu_limit_seconds: int):
+  if memory_limit_mb:
+    memory_limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+  if cpu_limit_seconds:
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit_seconds, cpu_limit_seconds))
+
+
+def _run_worker(port: int, memory_limit_mb: int, cpu_limit_seconds: int):
+  """Serves a Mesop app and reloads it with the code posted to `/__local_runner__/load`."""
+  _set_resource_limits(memory_limit_mb, cpu_limit_seconds)
+  token = sys.stdin.readline().strip()
+
+  # Importing Mesop is the slow part of starting up, which is why workers are started early.
+  import traceback
+
+  import flask
+  from absl import flags
+  from mesop.cli.execute_module import execute_module
+  from mesop.runtime import hot_reload_finished, reset_runtime
+  from mesop.server.wsgi_app import create_app
+
+  flags.FLAGS(sys.argv[:1])
+  module_path = os.path.join(os.getcwd(), "main.py")
+  with open(module_path, "w") as f:
+    f.write(PLACEHOLDER_APP)
+
+  def load_module():
+    execute_module(module_path=module_path, module_name="main")
+
+  # Editor mode shows errors in the app and allows it to be iframed by the editor.
+  app = create_app(prod_mode=False, run_block=load_module)
+  flask_app = app._flask_app
+  lock = threading.Lock()
+  # Hash of the code being served, which `runner_client` checks before reusing a cached URL.
+  served = {"hash": ""}
+
+  @flask_app.after_request
+  def add_content_hash(response):
+    if served["hash"]:
+      response.headers[runner_client.HASH_HEADER] = served["hash"]
+    return response
+
+  @flask_app.route("/__local_runner__/ready")
+  def ready():
+    return "ok"
+
+  @flask_app.route("/__local_runner__/load", methods=["POST"])
+  def load():
+    if not secrets.compare_digest(flask.request.headers.get(WORKER_TOKEN_HEADER, ""), token):
+      return "Invalid token", 403
+    code = flask.request.get_data().decode("utf-8")
+    with lock:
+      with open(module_path, "w") as f:
+        f.write(code)
+      served["hash"] = ""
+      reset_runtime()
+      try:
+        load_module()
+      except Exception:
+        # Errors in the uploaded code are shown to the user, so they are only logged for debugging.
+        logger.debug("Uploaded code failed to load", exc_info=True)
+        return traceback.format_exc(), 500
+      finally:
+        hot_reload_finished()
+      content_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+      served["hash"] = content_hash
+    return content_hash
+
+  logging.getLogger("werkzeug").setLevel(logging.WARNING)
+  flask_app.run(host="127.0.0.1", port=port, threaded=True, use_reloader=False)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> LocalRunner:
+  """Returns the local runner for this process, starting it on first use.
+
+  Raises RunnerError if the server has not enabled the local runner.
+  """
+  global _runner
+  if not ENABLED:
+    raise runner_client.RunnerError(
+      "The local runner is disabled. Set MESOP_APP_MAKER_LOCAL_RUNNER_ENABLED=1 to enable it."
+    )
+  with _runner_lock:
+    if _runner is None:
+      _runner = LocalRunner(
+        num_workers=int(
+          os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER_WORKERS", str(DEFAULT_NUM_WORKERS))
+        ),
+        max_runs_per_worker=int(
+          os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER_MAX_RUNS", str(DEFAULT_MAX_RUNS_PER_WORKER))
+        ),
+        memory_limit_mb=int(
+          os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER_MEMORY_MB", str(DEFAULT_MEMORY_LIMIT_MB))
+        ),
+        cpu_limit_seconds=int(
+          os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER_CPU_SECONDS", str(DEFAULT_CPU_LIMIT_SECONDS))
+        ),
+        user=os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER_USER", ""),
+      )
+    return _runner
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+  parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+  parser.add_argument("--port", type=int, default=0)
+  parser.add_argument("--workers", type=int, default=DEFAULT_NUM_WORKERS)
+  parser.add_argument("--user", default="", help="Run workers as this user")
+  parser.add_argument("--memory-limit-mb", type=int, default=DEFAULT_MEMORY_LIMIT_MB)
+  parser.add_argument("--cpu-limit-seconds", type=int, default=DEFAULT_CPU_LIMIT_SECONDS)
+  args = parser.parse_args()
+
+  if args.worker:
+    _run_worker(args.port, args.memory_limit_mb, args.cpu_limit_seconds)
+    return
+
+  runner = LocalRunner(
+    num_workers=args.workers,
+    memory_limit_mb=args.memory_limit_mb,
+    cpu_limit_seconds=args.cpu_limit_seconds,
+    port=args.port,
+    user=args.user,
+  )
+  print(f"Local runner: {runner.url}\nToken: {runner.token}")
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    runner.stop()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,55 @@
+import pytest
+import requests
+
+import local_runner
+from runner_client import RunnerClient, RunnerError
+
+CODE = """import mesop as me
+
+
+@me.page()
+def page():
+  me.text("Hello")
+"""
+
+
+@pytest.fixture(scope="module")
+def runner():
+  runner = local_runner.LocalRunner(num_workers=1)
+  yield runner
+  runner.stop()
+
+
+def test_upload_redirects_to_worker(runner):
+  client = RunnerClient()
+
+  response = client.exec(runner.url, runner.token, CODE)
+
+  assert response.status_code == 200
+  app = requests.get(runner.url + response.text, allow_redirects=False, timeout=5)
+  assert app.status_code == 302
+  worker_port = int(app.headers["Location"].removesuffix("/").rsplit(":", 1)[1])
+  assert worker_port != int(runner.url.rsplit(":", 1)[1])
+  assert requests.get(app.headers["Location"], timeout=5).status_code == 200
+
+
+def test_rejects_wrong_token(runner):
+  client = RunnerClient()
+
+  response = client.exec(runner.url, "wrong", CODE)
+
+  assert response.status_code == 403
+
+
+def test_worker_that_does_not_start_fails_without_retries(runner, monkeypatch):
+  def load(self, code):
+    raise RunnerError("Timed out starting a local runner process.")
+
+  monkeypatch.setattr(local_runner._Worker, "load", load)
+  client = RunnerClient(max_retries=2, backoff_seconds=0)
+
+  response = client.exec(runner.url, runner.token, CODE)
+
+  assert response.status_code == 500
+  assert "Timed out" in response.text
+  assert client.stats[runner.url].retries == 0
@@ -1,24 +1,73 @@
-import base64
+import logging
+import math
+import os
+import sqlite3
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
-import requests
 import mesop as me
 import mesop.labs as mel
 
 import components as mex
 import handlers
+import history_store
 import llm
+import local_runner
+import preflight
+import project_store
+import prompt_history
+import runner_client
+import runner_pool
+import state_payload
 from constants import (
   PROMPT_MODE_REVISE,
   PROMPT_MODE_GENERATE,
+  PROMPT_HISTORY_PAGE_SIZE,
   HELP_TEXT,
   TEMPLATES,
   EXAMPLE_CHAT_PROMPTS,
+  STREAM_REFRESH_INTERVAL_SECONDS,
 )
+from runner_client import RunnerError
+from scheduler import PRIORITY_GENERATE, PRIORITY_REVISE, SchedulerOverloadedError
 from state import State
 from web_components import code_mirror_editor_component
 from web_components import AsyncAction
 from web_components import async_action_component
+from web_components import preview_frame_component
+
+logger = logging.getLogger(__name__)
+
+# Uploads generated code in auto-run mode while the code is being shown.
+_upload_executor = ThreadPoolExecutor(thread_name_prefix="auto-run")
+
+
+# How the preview frame can load a new version of the app.
+PREVIEW_LOAD_MODES = ("swap", "navigate", "remount")
+
+
+@dataclass
+class PreviewStats:
+  # Load times in seconds by how the preview was loaded.
+  latencies: dict[str, deque] = field(
+    default_factory=lambda: {
+      mode: deque(maxlen=runner_client.MAX_SAMPLES) for mode in PREVIEW_LOAD_MODES
+    }
+  )
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, mode: str, seconds: float):
+    with self._lock:
+      self.latencies[mode].append(seconds)
+
+
+# Reported by the preview frame in the browser.
+preview_stats = PreviewStats()
+
+debug_pages_enabled = bool(int(os.getenv("MESOP_APP_MAKER_DEBUG_PAGES", "0")))
 
 
 @me.page(
@@ -42,6 +91,7 @@ from web_components import async_action_component
 )
 def main():
   state = me.state(State)
+  state_payload.restore(state)
 
   action = (
     AsyncAction(value=state.async_action_name, duration_seconds=state.async_action_duration)
@@ -56,143 +106,24 @@ def main():
     is_visible=state.show_status_snackbar,
   )
 
-  # Error dialog
-  with mex.dialog(state.show_error_dialog):
-    me.text("Failed to upload code", type="headline-6")
-    with me.box(
-      style=me.Style(max_width=500, max_height=300, overflow_x="scroll", overflow_y="scroll")
-    ):
-      me.code(
-        state.error.replace("\n", "  \n"),
-      )
-    with mex.dialog_actions():
-      me.button(
-        "Close",
-        key="show_error_dialog",
-        on_click=handlers.on_hide_component,
-      )
-
-  # New file dialog
-  with mex.dialog(state.show_new_dialog):
-    me.text("Select a template", type="headline-6")
-    me.select(
-      label="Template",
-      key="template-selector-" + str(state.select_index),
-      options=[
-        me.SelectOption(label="Default", value="default.txt"),
-        me.SelectOption(label="Basic Chat", value="basic_chat.txt"),
-        me.SelectOption(label="Advanced Chat", value="advanced_chat.txt"),
-      ],
-      on_selection_change=on_select_template,
-    )
-    with mex.dialog_actions():
-      me.button(
-        "Close",
-        key="show_new_dialog",
-        on_click=handlers.on_hide_component,
-      )
-
-  # Help dialog
-  with mex.dialog(state.show_help_dialog):
-    me.text("Usage Instructions", type="headline-6")
-    me.markdown(HELP_TEXT)
-    me.link(
-      text="See Github repository for full instructions.",
-      url="https://github.com/richard-to/mesop-app-runner",
-      open_in_new_tab=True,
-      style=me.Style(color=me.theme_var("primary")),
-    )
-    with mex.dialog_actions():
-      me.button(
-        "Close",
-        key="show_help_dialog",
-        on_click=handlers.on_hide_component,
-      )
+  mex.lazy_dialog(is_open=state.show_error_dialog, content=_error_dialog)
+  mex.lazy_dialog(is_open=state.show_new_dialog, content=_new_file_dialog)
+  mex.lazy_dialog(is_open=state.show_help_dialog, content=_help_dialog)
 
-  # Generate code panel
-  with mex.panel(
+  mex.lazy_panel(
     is_open=state.show_generate_panel,
     title="Generate Code",
+    content=_generate_panel,
     on_click_close=handlers.on_hide_component,
     key="generate_panel",
-  ):
-    mex.button_toggle(
-      [PROMPT_MODE_GENERATE, PROMPT_MODE_REVISE],
-      selected=state.prompt_mode,
-      on_click=on_click_prompt_mode,
-    )
-
-    me.select(
-      label="App type",
-      key="prompt_app_type",
-      value=state.prompt_app_type,
-      options=[
-        me.SelectOption(label="General", value="general"),
-        me.SelectOption(label="Chat", value="chat"),
-      ],
-      style=me.Style(width="100%", margin=me.Margin(top=30)),
-      on_selection_change=handlers.on_update_selection,
-    )
-
-    me.textarea(
-      value=state.prompt_placeholder,
-      rows=10,
-      label="What changes do you want to make?"
-      if state.prompt_mode == PROMPT_MODE_REVISE
-      else "What do you want to make?",
-      key="prompt",
-      on_blur=handlers.on_update_input,
-      disabled=state.loading,
-      style=me.Style(width="100%", margin=me.Margin(top=15)),
-    )
-
-    with me.tooltip(message="Generate app"):
-      with me.content_button(on_click=on_run_prompt, type="flat", disabled=state.loading):
-        me.icon("send")
-
-    if state.prompt_mode == "Generate" and state.prompt_app_type == "chat":
-      me.text("Example prompts", type="headline-6", style=me.Style(margin=me.Margin(top=15)))
-
-      for index, chat_prompt in enumerate(EXAMPLE_CHAT_PROMPTS):
-        with me.box(
-          key=f"example_prompt-{index}",
-          on_click=on_click_example_prompt,
-          style=me.Style(
-            background=me.theme_var("surface-container"),
-            border=me.Border.all(
-              me.BorderSide(width=1, color=me.theme_var("outline-variant"), style="solid")
-            ),
-            border_radius=5,
-            cursor="pointer",
-            margin=me.Margin.symmetric(vertical=10),
-            padding=me.Padding.all(10),
-            text_overflow="ellipsis",
-          ),
-        ):
-          me.text(_truncate_text(chat_prompt))
-
-  # Prompt history panel
-  with mex.panel(
+  )
+  mex.lazy_panel(
     is_open=state.show_prompt_history_panel,
     title="Prompt History",
+    content=_prompt_history_panel,
     on_click_close=handlers.on_hide_component,
     key="prompt_history_panel",
-  ):
-    for prompt_history in reversed(state.prompt_history):
-      with me.box(
-        on_click=on_click_history_prompt,
-        key=f"prompt-{prompt_history['index']}",
-        style=me.Style(
-          background=me.theme_var("surface-container"),
-          border_radius=5,
-          cursor="pointer",
-          margin=me.Margin.symmetric(vertical=10),
-          padding=me.Padding.all(10),
-          text_overflow="ellipsis",
-        ),
-      ):
-        me.text(prompt_history["mode"], style=me.Style(font_weight="bold", font_size=13))
-        me.text(_truncate_text(prompt_history["prompt"]))
+  )
 
   with me.box(
     style=me.Style(
@@ -201,15 +132,7 @@ def main():
       height="100vh",
     ),
   ):
-    with me.box(
-      style=me.Style(
-        background=me.theme_var("surface-container"),
-        padding=me.Padding.all(10),
-        border=me.Border(
-          right=me.BorderSide(width=1, color=me.theme_var("outline-variant"), style="solid"),
-        ),
-      )
-    ):
+    with me.box(style=_SIDEBAR_STYLE):
       mex.toolbar_button(
         icon="menu",
         tooltip="Close menu" if state.menu_open else "Open menu",
@@ -236,22 +159,8 @@ def main():
       )
 
     if state.menu_open and state.menu_open_type == "settings":
-      with me.box(
-        style=me.Style(
-          background=me.theme_var("surface-container-low"),
-          padding=me.Padding.all(15),
-          border=me.Border(
-            right=me.BorderSide(width=1, color=me.theme_var("outline-variant"), style="solid")
-          ),
-          display="flex",
-          flex_direction="column",
-          height="100vh",
-        )
-      ):
-        me.text(
-          "Settings",
-          style=me.Style(font_weight="bold", margin=me.Margin(bottom=10)),
-        )
+      with me.box(style=_SETTINGS_STYLE):
+        me.text("Settings", style=_SETTINGS_TITLE_STYLE)
         me.input(
           type="password",
           label="Gemini API Key",
@@ -262,16 +171,7 @@ def main():
         )
         me.select(
           label="Model",
-          options=[
-            me.SelectOption(
-              label="gemini-1.5-flash",
-              value="gemini-1.5-flash",
-            ),
-            me.SelectOption(
-              label="gemini-1.5-pro",
-              value="gemini-1.5-pro",
-            ),
-          ],
+          options=_MODEL_OPTIONS,
           key="model",
           value=state.model,
           on_selection_change=handlers.on_update_selection,
@@ -283,9 +183,37 @@ def main():
             label="Runner URL",
             key="runner_url",
             on_blur=handlers.on_update_input,
-            style=me.Style(width="100%"),
+            style=_FULL_WIDTH_STYLE,
             disabled=state.loading,
           )
+        me.slide_toggle(
+          label="Stream generated code",
+          key="stream_code",
+          checked=state.stream_code,
+          on_change=handlers.on_toggle_setting,
+          disabled=state.loading,
+        )
+        me.slide_toggle(
+          label="Generate multiple candidates",
+          key="multi_candidate",
+          checked=state.multi_candidate,
+          on_change=handlers.on_toggle_setting,
+          disabled=state.loading,
+        )
+        me.slide_toggle(
+          label="Hedge with backup model",
+          key="hedge_generation",
+          checked=state.hedge_generation,
+          on_change=handlers.on_toggle_setting,
+          disabled=state.loading,
+        )
+        me.slide_toggle(
+          label="Revise with edits",
+          key="revise_with_edits",
+          checked=state.revise_with_edits,
+          on_change=handlers.on_toggle_setting,
+          disabled=state.loading,
+        )
         with me.box():
           me.input(
             type="password",
@@ -293,48 +221,32 @@ def main():
             label="Runner Token",
             key="runner_token",
             on_blur=handlers.on_update_input,
-            style=me.Style(width="100%"),
+            style=_FULL_WIDTH_STYLE,
+            disabled=state.loading,
+          )
+        me.slide_toggle(
+          label="Run after generating",
+          key="auto_run",
+          checked=state.auto_run,
+          on_change=handlers.on_toggle_setting,
+          disabled=state.loading,
+        )
+        if local_runner.ENABLED:
+          me.slide_toggle(
+            label="Use local runner",
+            key="use_local_runner",
+            checked=state.use_local_runner,
+            on_change=handlers.on_toggle_setting,
             disabled=state.loading,
           )
 
     # Main content
-    with me.box(
-      style=me.Style(
-        background=me.theme_var("surface-container-lowest"),
-        display="flex",
-        flex_direction="column",
-        flex_grow=1,
-        height="100%",
-      )
-    ):
+    with me.box(style=_MAIN_STYLE):
       # Toolbar
-      with me.box(
-        style=me.Style(
-          display="grid",
-          grid_template_columns="1fr 1fr",
-          grid_template_rows="1fr 20fr",
-          height="calc(100vh - 5px)",
-        )
-      ):
-        with me.box(
-          style=me.Style(
-            grid_column_start=1,
-            grid_column_end=3,
-            background=me.theme_var("surface-container"),
-            padding=me.Padding.all(5),
-            border=me.Border(
-              bottom=me.BorderSide(width=1, color=me.theme_var("outline-variant"), style="solid"),
-            ),
-          )
-        ):
-          with me.box(style=me.Style(display="flex", flex_direction="row")):
-            with me.box(
-              style=me.Style(
-                flex_grow=1,
-                display="flex",
-                flex_direction="row",
-              )
-            ):
+      with me.box(style=_EDITOR_GRID_STYLE):
+        with me.box(style=_TOOLBAR_STYLE):
+          with me.box(style=_TOOLBAR_ROW_STYLE):
+            with me.box(style=_TOOLBAR_START_STYLE):
               mex.toolbar_button(
                 icon="add",
                 tooltip="New file",
@@ -349,7 +261,7 @@ def main():
                 on_click=on_show_generate_panel,
               )
 
-              if state.prompt_history:
+              if state.prompt_history or project_store.store:
                 mex.toolbar_button(
                   icon="history",
                   tooltip="Prompt history",
@@ -357,11 +269,7 @@ def main():
                   on_click=on_show_prompt_history_panel,
                 )
 
-            with me.box(
-              style=me.Style(
-                flex_grow=1, display="flex", flex_direction="row", justify_content="end"
-              )
-            ):
+            with me.box(style=_TOOLBAR_END_STYLE):
               mex.toolbar_button(
                 icon="refresh",
                 tooltip="Load URL",
@@ -374,13 +282,7 @@ def main():
               )
 
         # Code editor pane
-        with me.box(
-          style=me.Style(
-            background=me.theme_var("surface-container-lowest"),
-            overflow_x="scroll",
-            overflow_y="scroll",
-          )
-        ):
+        with me.box(style=_CODE_PANE_STYLE):
           code_mirror_editor_component(
             code=state.code_placeholder,
             theme="default" if me.theme_brightness() == "light" else "tomorrow-night-eighties",
@@ -389,24 +291,252 @@ def main():
 
         # App preview pane
         with me.box():
-          me.embed(
-            key=str(state.iframe_index),
+          preview_frame_component(
             src=state.loaded_url,
-            style=me.Style(
-              background=me.theme_var("surface-container-lowest"),
-              width="100%",
-              height="100%",
-              border=me.Border.all(me.BorderSide(width=0)),
-            ),
+            version=state.preview_version,
+            remount_key=state.iframe_index,
+            on_loaded=on_preview_loaded,
+            key="preview",
           )
 
+  # Everything has been rendered, so the large fields can be moved out of the state.
+  state_payload.offload(state)
+
+
+def _error_dialog():
+  state = me.state(State)
+  me.text("Failed to run code", type="headline-6")
+  with me.box(style=_ERROR_STYLE):
+    me.code(
+      state.error.replace("\n", "  \n"),
+    )
+  with mex.dialog_actions():
+    me.button(
+      "Close",
+      key="show_error_dialog",
+      on_click=handlers.on_hide_component,
+    )
+
+
+def _new_file_dialog():
+  state = me.state(State)
+  me.text("Select a template", type="headline-6")
+  me.select(
+    label="Template",
+    key="template-selector-" + str(state.select_index),
+    options=_TEMPLATE_OPTIONS,
+    on_selection_change=on_select_template,
+  )
+  with mex.dialog_actions():
+    me.button(
+      "Close",
+      key="show_new_dialog",
+      on_click=handlers.on_hide_component,
+    )
+
+
+def _help_dialog():
+  me.text("Usage Instructions", type="headline-6")
+  me.markdown(HELP_TEXT)
+  me.link(
+    text="See Github repository for full instructions.",
+    url="https://github.com/richard-to/mesop-app-runner",
+    open_in_new_tab=True,
+    style=_LINK_STYLE,
+  )
+  with mex.dialog_actions():
+    me.button(
+      "Close",
+      key="show_help_dialog",
+      on_click=handlers.on_hide_component,
+    )
+
+
+def _generate_panel():
+  state = me.state(State)
+  mex.button_toggle(
+    [PROMPT_MODE_GENERATE, PROMPT_MODE_REVISE],
+    selected=state.prompt_mode,
+    on_click=on_click_prompt_mode,
+  )
+
+  me.select(
+    label="App type",
+    key="prompt_app_type",
+    value=state.prompt_app_type,
+    options=_APP_TYPE_OPTIONS,
+    style=_APP_TYPE_STYLE,
+    on_selection_change=handlers.on_update_selection,
+  )
+
+  me.textarea(
+    value=state.prompt_placeholder,
+    rows=10,
+    label="What changes do you want to make?"
+    if state.prompt_mode == PROMPT_MODE_REVISE
+    else "What do you want to make?",
+    key="prompt",
+    on_blur=handlers.on_update_input,
+    disabled=state.loading,
+    style=_PROMPT_STYLE,
+  )
+
+  with me.tooltip(message="Generate app"):
+    with me.content_button(on_click=on_run_prompt, type="flat", disabled=state.loading):
+      me.icon("send")
+
+  if state.prompt_mode == "Generate" and state.prompt_app_type == "chat":
+    me.text("Example prompts", type="headline-6", style=_SECTION_TITLE_STYLE)
+
+    for index, chat_prompt in enumerate(EXAMPLE_CHAT_PROMPTS):
+      with me.box(
+        key=f"example_prompt-{index}",
+        on_click=on_click_example_prompt,
+        style=_EXAMPLE_PROMPT_STYLE,
+      ):
+        me.text(_truncate_text(chat_prompt))
+
+
+def _prompt_history_panel():
+  state = me.state(State)
+  # Only the entries shown so far are read, so long histories do not slow down rendering.
+  for entry in prompt_history.latest(state, state.prompt_history_shown):
+    with me.box(
+      on_click=on_click_history_prompt,
+      key=f"prompt-{entry['index']}",
+      style=_HISTORY_ITEM_STYLE,
+    ):
+      me.text(entry["mode"], style=_HISTORY_ITEM_TITLE_STYLE)
+      me.text(entry["prompt_preview"])
+  if state.prompt_history_count > state.prompt_history_shown:
+    me.button("Load more", on_click=on_click_load_more_history)
+
+  if project_store.store:
+    me.text("Past generations", type="subtitle-1", style=_PAST_GENERATIONS_STYLE)
+    me.input(
+      value=state.project_search,
+      label="Search prompts and code",
+      key="project_search",
+      on_blur=on_search_projects,
+      on_enter=on_search_projects,
+      style=_FULL_WIDTH_STYLE,
+    )
+    for result in state.project_search_results:
+      with me.box(
+        on_click=on_click_project_version,
+        key=f"version-{result['id']}",
+        style=_HISTORY_ITEM_STYLE,
+      ):
+        me.text(result["project_name"], style=_HISTORY_ITEM_TITLE_STYLE)
+        me.text(result["prompt_preview"])
+
+
+if debug_pages_enabled or state_payload.profile_enabled:
+
+  @me.page(path="/debug/state", title="State size")
+  def debug_state():
+    """Shows the serialized state size by event handler and field."""
+    with me.box(style=me.Style(padding=me.Padding.all(20))):
+      me.markdown(state_payload.format_profile())
+
+
+if debug_pages_enabled:
+
+  @me.page(path="/debug/stats", title="Stats")
+  def debug_stats():
+    """Shows the cache, repair, runner and preview stats of this worker process."""
+    with me.box(style=me.Style(padding=me.Padding.all(20))):
+      me.markdown(_format_stats())
+
 
+def _format_stats() -> str:
+  """Returns the stats of this worker process as Markdown tables."""
+  sections = []
+  if llm.response_cache:
+    stats = llm.response_cache.stats
+    sections.append(
+      _format_stats_table(
+        "Response cache",
+        {
+          "Hits": stats.hits,
+          "Misses": stats.misses,
+          "Hit rate": f"{stats.hit_rate:.0%}",
+          "Seconds saved": f"{stats.seconds_saved:.1f}",
+          "Evictions": stats.evictions,
+          "Directory scans": stats.scans,
+        },
+      )
+    )
+  repair_stats = llm.code_repair_stats
+  sections.append(
+    _format_stats_table(
+      "Code repair",
+      {
+        "Responses": repair_stats.responses,
+        "With violations": repair_stats.responses_with_violations,
+        "Repair rate": f"{repair_stats.repair_rate:.0%}",
+        "Warnings": sum(repair_stats.warnings.values()),
+      },
+    )
+  )
+  edit_stats = llm.edit_revision_stats
+  sections.append(
+    _format_stats_table(
+      "Edit revisions",
+      {
+        "Revisions": edit_stats.revisions,
+        "Fallbacks": edit_stats.fallbacks,
+        "Estimated seconds saved": f"{edit_stats.estimated_seconds_saved:.1f}",
+      },
+    )
+  )
+  for runner_url, stats in list(runner_client.client.stats.items()):
+    sections.append(
+      _format_stats_table(
+        f"Runner {runner_url}",
+        {
+          "Requests": stats.requests,
+          "Failures": stats.failures,
+          "Retries": stats.retries,
+          "p50 seconds": f"{stats.percentile(0.5):.2f}",
+          "p95 seconds": f"{stats.percentile(0.95):.2f}",
+        },
+      )
+    )
+  if runner_client.client.upload_cache:
+    stats = runner_client.client.upload_cache.stats
+    sections.append(
+      _format_stats_table(
+        "Upload cache",
+        {
+          "Hits": stats.hits,
+          "Misses": stats.misses,
+          "Hit rate": f"{stats.hit_rate:.0%}",
+          "Invalidations": stats.invalidations,
+        },
+      )
+    )
+  with preview_stats._lock:
+    loads = {mode: len(latencies) for mode, latencies in preview_stats.latencies.items()}
+  if any(loads.values()):
+    sections.append(_format_stats_table("Preview loads", loads))
+  return "\n\n".join(sections)
+
+
+def _format_stats_table(title: str, rows: dict[str, object]) -> str:
+  return f"## {title}\n\n| Stat | Value |\n| --- | --- |\n" + "\n".join(
+    f"| {name} | {value} |" for name, value in rows.items()
+  )
+
+
+@state_payload.handler
 def on_toggle_sidebar_menu(e: me.ClickEvent):
   """Toggles sidebar menu expansion."""
   state = me.state(State)
   state.menu_open = not state.menu_open
 
 
+@state_payload.handler
 def on_click_theme_brightness(e: me.ClickEvent):
   """Toggles dark mode."""
   if me.theme_brightness() == "light":
@@ -415,6 +545,7 @@ def on_click_theme_brightness(e: me.ClickEvent):
     me.set_theme_mode("light")
 
 
+@state_payload.handler
 def on_open_settings(e: me.ClickEvent):
   """Shows settings menu."""
   state = me.state(State)
@@ -422,6 +553,7 @@ def on_open_settings(e: me.ClickEvent):
   state.menu_open_type = "settings"
 
 
+@state_payload.handler
 def on_click_prompt_mode(e: me.ClickEvent):
   """Toggles prompt modes - generate / revision."""
   state = me.state(State)
@@ -430,6 +562,7 @@ def on_click_prompt_mode(e: me.ClickEvent):
   )
 
 
+@state_payload.handler
 def on_click_example_prompt(e: me.ClickEvent):
   """Populates chat box with example prompt."""
   state = me.state(State)
@@ -438,6 +571,7 @@ def on_click_example_prompt(e: me.ClickEvent):
   state.prompt_placeholder = state.prompt
 
 
+@state_payload.handler
 def on_code_input(e: mel.WebEvent):
   """Captures code input into state on blur."""
   state = me.state(State)
@@ -445,34 +579,127 @@ def on_code_input(e: mel.WebEvent):
   state.code_placeholder = e.value["code"]
 
 
+@state_payload.handler
 def on_load_url(e: me.ClickEvent):
-  """Loads the Mesop app page into the iframe."""
+  """Reloads the Mesop app page in a new iframe."""
   state = me.state(State)
   state.code_placeholder = state.code
   yield
-  state.loaded_url = state.runner_url.removesuffix("/") + state.runner_url_path
+  state.loaded_url = _preview_url(state)
   state.iframe_index += 1
   yield
 
 
+@state_payload.handler
+def on_preview_loaded(e: mel.WebEvent):
+  # The event comes from the browser, so ignore anything that is not a load time.
+  value = e.value if isinstance(e.value, dict) else {}
+  mode = value.get("mode")
+  seconds = value.get("seconds")
+  if (
+    mode in PREVIEW_LOAD_MODES
+    and isinstance(seconds, (int, float))
+    and not isinstance(seconds, bool)
+    and math.isfinite(seconds)
+    and seconds >= 0
+  ):
+    preview_stats.record(mode, seconds)
+
+
+def _preview_url(state: State) -> str:
+  runner_url = local_runner.get_runner().url if _uses_local_runner(state) else state.runner_url
+  return runner_url.removesuffix("/") + state.runner_url_path
+
+
+@state_payload.handler
 def on_run_code(e: me.ClickEvent):
   """Tries to upload code to the Mesop app Runner."""
   state = me.state(State)
   state.code_placeholder = state.code
   yield
-  result = requests.post(
-    state.runner_url.removesuffix("/") + "/exec",
-    data={"token": state.runner_token, "code": base64.b64encode(state.code.encode("utf-8"))},
-  )
+  errors = preflight.check(state.code)
+  if errors:
+    # The runner would fail to load this code, so skip the round trip.
+    state.show_error_dialog = True
+    state.error = preflight.format_errors(errors)
+    yield
+    return
+
+  runner_url, runner_token = _select_runner(state)
+  yield from _show_upload(e, _upload_code(runner_url, runner_token, state.code))
+
+
+@dataclass
+class _Upload:
+  code: str
+  runner_url: str
+  # Path of the app on the runner, or None if the upload failed.
+  path: str | None = None
+  error: str = ""
+
+
+def _select_runner(state: State) -> tuple[str, str]:
+  """Returns the URL and token of the runner to upload to."""
+  if _uses_local_runner(state):
+    runner = local_runner.get_runner()
+    return runner.url, runner.token
+  if runner_pool.pool:
+    # Sticks to the runner this session used last while it is healthy.
+    backend = runner_pool.pool.select(state.runner_url)
+    return backend.url, backend.token
+  return state.runner_url, state.runner_token
+
+
+def _uses_local_runner(state: State) -> bool:
+  # The state comes from the client, so the setting only counts if the server allows it.
+  return local_runner.ENABLED and state.use_local_runner
+
+
+def _upload_code(runner_url: str, runner_token: str, code: str) -> _Upload:
+  """Uploads code to the runner.
+
+  This does not touch the Mesop state, so it can run in a background thread.
+  """
+  cached_path = runner_client.client.cached_path(runner_url, runner_token, code)
+  if cached_path is not None:
+    # The runner already has this code, so skip the upload and runner restart.
+    return _Upload(code, runner_url, path=cached_path)
+
+  try:
+    if runner_pool.pool and runner_url in runner_pool.pool.backends:
+      backend, result = runner_pool.pool.exec(runner_url, code)
+      runner_url = backend.url
+    else:
+      result = runner_client.client.exec(runner_url, runner_token, code)
+  except RunnerError as error:
+    return _Upload(code, runner_url, error=str(error))
+
   if result.status_code == 200:
-    state.runner_url_path = result.content.decode("utf-8")
-    yield from on_load_url(e)
-  else:
+    return _Upload(code, runner_url, path=result.content.decode("utf-8"))
+  return _Upload(code, runner_url, error=result.content.decode("utf-8"))
+
+
+def _show_upload(e: me.ClickEvent, upload: _Upload):
+  """Loads the uploaded app into the preview, or shows why the upload failed."""
+  state = me.state(State)
+  if upload.path is None:
     state.show_error_dialog = True
-    state.error = result.content.decode("utf-8")
+    state.error = upload.error
     yield
+    return
+
+  if not _uses_local_runner(state):
+    state.runner_url = upload.runner_url
+  state.runner_url_path = upload.path
+  state.code_placeholder = state.code
+  yield
+  # Swaps the new version into the loaded preview rather than rebuilding the iframe.
+  state.loaded_url = _preview_url(state)
+  state.preview_version += 1
+  yield
 
 
+@state_payload.handler
 def on_run_prompt(e: me.ClickEvent):
   """Generate code from prompt."""
   state = me.state(State)
@@ -488,45 +715,87 @@ def on_run_prompt(e: me.ClickEvent):
   state.loading = True
   yield
 
-  if state.prompt_mode == PROMPT_MODE_REVISE:
-    state.code = llm.adjust_mesop_app(
-      state.code,
-      state.prompt,
-      model_name=state.model,
-      api_key=state.api_key,
-      app_type=state.prompt_app_type,
-    )
-  else:
-    state.code = llm.generate_mesop_app(
-      state.prompt, model_name=state.model, api_key=state.api_key, app_type=state.prompt_app_type
+  ticket = None
+  try:
+    ticket = llm.request_scheduler.enqueue(
+      state.api_key,
+      PRIORITY_REVISE if state.prompt_mode == PROMPT_MODE_REVISE else PRIORITY_GENERATE,
     )
+    while not ticket.wait(timeout=1):
+      state.info = (
+        f"Waiting in queue (position {ticket.position}, "
+        f"about {ticket.estimated_wait_seconds:.0f}s)..."
+      )
+      state.show_status_snackbar = True
+      yield
 
-  state.code = state.code.strip().removeprefix("```python").removesuffix("```")
+    state.show_status_snackbar = False
+    start = time.monotonic()
+    result, info = yield from _generate_code(state)
+  except SchedulerOverloadedError as error:
+    state.info = str(error)
+    state.loading = False
+    state.show_status_snackbar = True
+    state.async_action_name = "hide_status_snackbar"
+    yield
+    return
+  finally:
+    # This also runs if the handler is dropped while it waits, such as when the tab is closed,
+    # so an abandoned ticket does not block the queue.
+    if ticket:
+      ticket.release()
+  generation_seconds = time.monotonic() - start
+
+  repair = llm.postprocess_code(result)
+  if repair.fixed:
+    info += f" Fixed {len(repair.fixed)} rule violations."
+  if repair.remaining:
+    info += f" {len(repair.remaining)} rule violations remain."
+  if repair.warnings:
+    info += f" {len(repair.warnings)} style warnings."
+  state.code = repair.code
   state.code_placeholder = state.code
-  state.info = (
-    "Your code adjustment has been applied!"
-    if state.prompt_mode == PROMPT_MODE_REVISE
-    else "Your Mesop app has been generated!"
-  )
-  state.prompt_history.append(
-    dict(
-      prompt=state.prompt,
-      code=state.code,
-      index=len(state.prompt_history),
-      mode=state.prompt_mode,
-      app_type=state.prompt_app_type,
-    )
+
+  upload = None
+  if state.auto_run:
+    if preflight.check(state.code):
+      info += " Not run since the code has errors."
+    else:
+      # Start the upload now so that it overlaps with showing the code.
+      upload = _upload_executor.submit(_upload_code, *_select_runner(state), state.code)
+
+  state.info = info
+  # Only IDs and a preview are kept in the state, since it is sent on every event. The preview
+  # is truncated here once rather than on every render of the history panel.
+  parent_id = state.prompt_history[-1]["code_id"] if state.prompt_history else None
+  prompt_history.add(
+    state,
+    prompt_id=history_store.store.put(state.prompt),
+    prompt_preview=_truncate_text(state.prompt),
+    code_id=history_store.store.put(state.code, parent_id),
+    mode=state.prompt_mode,
+    app_type=state.prompt_app_type,
   )
+  if project_store.store:
+    try:
+      _save_version(state, generation_seconds)
+    except sqlite3.Error:
+      logger.exception("Could not save the generated app")
+      info += " Could not save the project."
 
   state.prompt_mode = PROMPT_MODE_REVISE
   state.loading = False
   yield
 
+  if upload:
+    yield from _show_upload(e, upload.result())
+
   state.show_status_snackbar = True
   state.async_action_name = "hide_status_snackbar"
   yield
 
 
+@state_payload.handler
 def on_select_template(e: me.SelectSelectionChangeEvent):
   """Update editor with selected template"""
   state = me.state(State)
@@ -534,15 +803,37 @@ def on_select_template(e: me.SelectSelectionChangeEvent):
   state.code = TEMPLATES[e.value]
   state.show_new_dialog = False
   state.select_index += 1
+  # The next generation starts a new project.
+  state.project_id = 0
 
 
+@state_payload.handler
 def on_show_prompt_history_panel(e: me.ClickEvent):
   """Show prompt history panel"""
   state = me.state(State)
   state.show_prompt_history_panel = True
   state.show_generate_panel = False
+  state.prompt_history_shown = PROMPT_HISTORY_PAGE_SIZE
+  _search_projects(state)
+
+
+@state_payload.handler
+def on_search_projects(e: me.InputBlurEvent | me.InputEnterEvent):
+  """Searches past generations"""
+  state = me.state(State)
+  if e.value != state.project_search or not state.project_search_results:
+    state.project_search = e.value
+    _search_projects(state)
 
 
+@state_payload.handler
+def on_click_load_more_history(e: me.ClickEvent):
+  """Shows the next page of the prompt history"""
+  state = me.state(State)
+  state.prompt_history_shown += PROMPT_HISTORY_PAGE_SIZE
+
+
+@state_payload.handler
 def on_show_generate_panel(e: me.ClickEvent):
   """Show generate panel and focus on prompt text area"""
   state = me.state(State)
@@ -553,17 +844,25 @@ def on_show_generate_panel(e: me.ClickEvent):
   yield
 
 
+@state_payload.handler
 def on_click_history_prompt(e: me.ClickEvent):
   """Set previous prompt/code"""
   state = me.state(State)
-  index = int(e.key.replace("prompt-", ""))
-  prompt_history = state.prompt_history[index]
-  state.prompt_placeholder = prompt_history["prompt"]
+  entry = prompt_history.get(state, int(e.key.replace("prompt-", "")))
+  prompt = history_store.store.get(entry["prompt_id"]) if entry else None
+  code = history_store.store.get(entry["code_id"]) if entry else None
+  if prompt is None or code is None:
+    state.info = "This version is no longer available."
+    state.show_status_snackbar = True
+    state.async_action_name = "hide_status_snackbar"
+    yield
+    return
+  state.prompt_placeholder = prompt
   state.prompt = state.prompt_placeholder
-  state.code_placeholder = prompt_history["code"]
+  state.code_placeholder = code
   state.code = state.code_placeholder
-  state.prompt_app_type = prompt_history["app_type"]
-  state.prompt_mode = prompt_history["mode"]
+  state.prompt_app_type = entry["app_type"]
+  state.prompt_mode = entry["mode"]
   state.show_prompt_history_panel = False
   state.show_generate_panel = True
   yield
@@ -571,6 +870,35 @@ def on_click_history_prompt(e: me.ClickEvent):
   yield
 
 
+@state_payload.handler
+def on_click_project_version(e: me.ClickEvent):
+  """Opens a past generation from the project store"""
+  state = me.state(State)
+  version = project_store.store.get_version(
+    int(e.key.replace("version-", "")), project_store.owner_id(state.api_key)
+  )
+  if version is None:
+    state.info = "This version is no longer available."
+    state.show_status_snackbar = True
+    state.async_action_name = "hide_status_snackbar"
+    yield
+    return
+  state.prompt_placeholder = version.prompt
+  state.prompt = state.prompt_placeholder
+  state.code_placeholder = version.code
+  state.code = state.code_placeholder
+  state.prompt_app_type = version.app_type
+  state.prompt_mode = PROMPT_MODE_REVISE
+  # Revisions from here on are added to the opened project.
+  state.project_id = version.project_id
+  state.show_prompt_history_panel = False
+  state.show_generate_panel = True
+  yield
+  me.focus_component(key="prompt")
+  yield
+
+
+@state_payload.handler
 def on_async_action_finished(e: mel.WebEvent):
   state = me.state(State)
   state.async_action_name = ""
@@ -578,9 +906,249 @@ def on_async_action_finished(e: mel.WebEvent):
   state.show_status_snackbar = False
 
 
+def _save_version(state: State, generation_seconds: float):
+  """Saves the generated code as a new version of the session's project.
+
+  Generating a new app starts a new project, and so does revising an app whose project belongs
+  to another API key.
+  """
+  owner = project_store.owner_id(state.api_key)
+
+  def add_version():
+    project_store.store.add_version(
+      state.project_id,
+      owner=owner,
+      prompt=state.prompt,
+      mode=state.prompt_mode,
+      app_type=state.prompt_app_type,
+      model=state.model,
+      code=state.code,
+      generation_seconds=generation_seconds,
+    )
+
+  if state.project_id and state.prompt_mode != PROMPT_MODE_GENERATE:
+    try:
+      add_version()
+      return
+    except project_store.ProjectNotFoundError:
+      pass
+  state.project_id = project_store.store.create_project(
+    _truncate_text(state.prompt, project_store.PROJECT_NAME_CHARS), owner
+  )
+  add_version()
+
+
+def _search_projects(state: State):
+  """Updates the cached results of the project search."""
+  if not project_store.store:
+    return
+  try:
+    versions = project_store.store.search(
+      state.project_search, project_store.owner_id(state.api_key)
+    )
+  except sqlite3.Error:
+    logger.exception("Could not search past generations")
+    versions = []
+  state.project_search_results = [
+    {
+      "id": version.id,
+      "project_name": version.project_name,
+      "prompt_preview": _truncate_text(version.prompt),
+    }
+    for version in versions
+  ]
+
+
 def _truncate_text(text, char_limit=100):
   """Truncates text that is too long."""
   if len(text) <= char_limit:
     return text
   truncated_text = text[:char_limit].rsplit(" ", 1)[0]
   return truncated_text.rstrip(".,!?;:") + "..."
+
+
+def _generate_code(state: State):
+  """Calls the LLM for the current prompt, streaming partial code into the editor if enabled.
+
+  Returns the raw LLM output and the status message to show.
+  """
+  stream = state.stream_code
+  info = (
+    "Your code adjustment has been applied!"
+    if state.prompt_mode == PROMPT_MODE_REVISE
+    else "Your Mesop app has been generated!"
+  )
+  if state.prompt_mode == PROMPT_MODE_REVISE and state.revise_with_edits:
+    # Edit scripts are not useful to show in the editor, so no need to stream them.
+    stream = False
+    result, revision = llm.adjust_mesop_app_with_edits(
+      state.code,
+      state.prompt,
+      model_name=state.model,
+      api_key=state.api_key,
+      app_type=state.prompt_app_type,
+    )
+    if revision.applied and not revision.cached:
+      info += f" Saved ~{revision.estimated_tokens_saved} output tokens."
+  elif state.multi_candidate:
+    # Candidates are checked once complete, so there is nothing to stream.
+    stream = False
+    result = llm.generate_mesop_app_candidates(
+      state.prompt,
+      model_name=state.model,
+      api_key=state.api_key,
+      app_type=state.prompt_app_type,
+      code=state.code if state.prompt_mode == PROMPT_MODE_REVISE else None,
+    ).text
+  elif state.hedge_generation:
+    # The hedged requests race in the background, so there is nothing to stream.
+    stream = False
+    result, model_name = llm.hedge_mesop_app(
+      state.prompt,
+      model_name=state.model,
+      api_key=state.api_key,
+      app_type=state.prompt_app_type,
+      code=state.code if state.prompt_mode == PROMPT_MODE_REVISE else None,
+    )
+    info += f" ({model_name})"
+  elif state.prompt_mode == PROMPT_MODE_REVISE:
+    result = llm.adjust_mesop_app(
+      state.code,
+      state.prompt,
+      model_name=state.model,
+      api_key=state.api_key,
+      app_type=state.prompt_app_type,
+      stream=stream,
+    )
+  else:
+    result = llm.generate_mesop_app(
+      state.prompt,
+      model_name=state.model,
+      api_key=state.api_key,
+      app_type=state.prompt_app_type,
+      stream=stream,
+    )
+
+  if stream:
+    chunks = []
+    last_refresh = time.monotonic()
+    for chunk in result:
+      chunks.append(chunk)
+      if time.monotonic() - last_refresh >= STREAM_REFRESH_INTERVAL_SECONDS:
+        state.code_placeholder = "".join(chunks).lstrip().removeprefix("```python")
+        last_refresh = time.monotonic()
+        yield
+    result = "".join(chunks)
+  return result, info
+
+
+# Styles and options that do not depend on the state are built once rather than on every render.
+
+_OUTLINE_VARIANT_BORDER = me.BorderSide(
+  width=1, color=me.theme_var("outline-variant"), style="solid"
+)
+
+_FULL_WIDTH_STYLE = me.Style(width="100%")
+
+_LINK_STYLE = me.Style(color=me.theme_var("primary"))
+
+_ERROR_STYLE = me.Style(max_width=500, max_height=300, overflow_x="scroll", overflow_y="scroll")
+
+_TEMPLATE_OPTIONS = [
+  me.SelectOption(label="Default", value="default.txt"),
+  me.SelectOption(label="Basic Chat", value="basic_chat.txt"),
+  me.SelectOption(label="Advanced Chat", value="advanced_chat.txt"),
+]
+
+_APP_TYPE_OPTIONS = [
+  me.SelectOption(label="General", value="general"),
+  me.SelectOption(label="Chat", value="chat"),
+]
+
+_MODEL_OPTIONS = [
+  me.SelectOption(label="gemini-1.5-flash", value="gemini-1.5-flash"),
+  me.SelectOption(label="gemini-1.5-pro", value="gemini-1.5-pro"),
+]
+
+_APP_TYPE_STYLE = me.Style(width="100%", margin=me.Margin(top=30))
+
+_PROMPT_STYLE = me.Style(width="100%", margin=me.Margin(top=15))
+
+_SECTION_TITLE_STYLE = me.Style(margin=me.Margin(top=15))
+
+_HISTORY_ITEM_STYLE = me.Style(
+  background=me.theme_var("surface-container"),
+  border_radius=5,
+  cursor="pointer",
+  margin=me.Margin.symmetric(vertical=10),
+  padding=me.Padding.all(10),
+  text_overflow="ellipsis",
+)
+
+_EXAMPLE_PROMPT_STYLE = me.Style(
+  background=me.theme_var("surface-container"),
+  border=me.Border.all(_OUTLINE_VARIANT_BORDER),
+  border_radius=5,
+  cursor="pointer",
+  margin=me.Margin.symmetric(vertical=10),
+  padding=me.Padding.all(10),
+  text_overflow="ellipsis",
+)
+
+_HISTORY_ITEM_TITLE_STYLE = me.Style(font_weight="bold", font_size=13)
+
+_PAST_GENERATIONS_STYLE = me.Style(margin=me.Margin(top=20))
+
+_SIDEBAR_STYLE = me.Style(
+  background=me.theme_var("surface-container"),
+  padding=me.Padding.all(10),
+  border=me.Border(right=_OUTLINE_VARIANT_BORDER),
+)
+
+_SETTINGS_STYLE = me.Style(
+  background=me.theme_var("surface-container-low"),
+  padding=me.Padding.all(15),
+  border=me.Border(right=_OUTLINE_VARIANT_BORDER),
+  display="flex",
+  flex_direction="column",
+  height="100vh",
+)
+
+_SETTINGS_TITLE_STYLE = me.Style(font_weight="bold", margin=me.Margin(bottom=10))
+
+_MAIN_STYLE = me.Style(
+  background=me.theme_var("surface-container-lowest"),
+  display="flex",
+  flex_direction="column",
+  flex_grow=1,
+  height="100%",
+)
+
+_EDITOR_GRID_STYLE = me.Style(
+  display="grid",
+  grid_template_columns="1fr 1fr",
+  grid_template_rows="1fr 20fr",
+  height="calc(100vh - 5px)",
+)
+
+_TOOLBAR_STYLE = me.Style(
+  grid_column_start=1,
+  grid_column_end=3,
+  background=me.theme_var("surface-container"),
+  padding=me.Padding.all(5),
+  border=me.Border(bottom=_OUTLINE_VARIANT_BORDER),
+)
+
+_TOOLBAR_ROW_STYLE = me.Style(display="flex", flex_direction="row")
+
+_TOOLBAR_START_STYLE = me.Style(flex_grow=1, display="flex", flex_direction="row")
+
+_TOOLBAR_END_STYLE = me.Style(
+  flex_grow=1, display="flex", flex_direction="row", justify_content="end"
+)
+
+_CODE_PANE_STYLE = me.Style(
+  background=me.theme_var("surface-container-lowest"),
+  overflow_x="scroll",
+  overflow_y="scroll",
+)
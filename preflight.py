@@ -0,0 +1,150 @@
+"""Checks that code can run before it is uploaded to the runner.
+
+The runner only reports these problems after an upload and a runner restart, so catching them
+locally saves a round trip. Unlike the checks in `code_checks`, which are prompt rules that can
+be repaired, these are errors that would stop the app from loading at all.
+"""
+
+import ast
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import mesop
+import mesop.labs
+
+from code_checks import RULE_PAGE_DECORATOR, RULE_SYNTAX, Violation, is_me_attribute
+
+RULE_UNKNOWN_ATTRIBUTE = "unknown_attribute"
+RULE_MISSING_PAGE = "missing_page"
+
+MAX_SAMPLES = 1000
+
+# Modules whose attributes generated code is checked against, by import name.
+PUBLIC_MODULES = {"mesop": mesop, "mesop.labs": mesop.labs}
+
+
+@dataclass
+class PreflightStats:
+  checks: int = 0
+  # Checks that stopped an upload.
+  failures: int = 0
+  latencies: deque = field(default_factory=lambda: deque(maxlen=MAX_SAMPLES))
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, errors: list[Violation], seconds: float):
+    with self._lock:
+      self.checks += 1
+      self.failures += bool(errors)
+      self.latencies.append(seconds)
+
+  def percentile(self, percentile: float) -> float:
+    latencies = sorted(self.latencies)
+    if not latencies:
+      return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+
+stats = PreflightStats()
+
+
+def check(code: str) -> list[Violation]:
+  """Returns the errors that would stop the code from running on the runner."""
+  start = time.monotonic()
+  errors = find_errors(code)
+  stats.record(errors, time.monotonic() - start)
+  return errors
+
+
+def find_errors(code: str) -> list[Violation]:
+  """Returns the errors that would stop the code from running on the runner.
+
+  A syntax error is returned as the only error since nothing else can be checked.
+  """
+  try:
+    tree = compile(code, "main.py", "exec", flags=ast.PyCF_ONLY_AST)
+    # Compiling the tree also catches errors that parsing does not, such as `return` outside
+    # of a function.
+    compile(tree, "main.py", "exec")
+  except SyntaxError as e:
+    return [Violation(RULE_SYNTAX, e.lineno or 0, f"Syntax error: {e.msg}")]
+
+  errors = _check_attributes(tree) + _check_pages(tree)
+  return sorted(errors, key=lambda error: error.line)
+
+
+def format_errors(errors: list[Violation]) -> str:
+  return "\n".join(f"Line {error.line}: {error.message}" for error in errors)
+
+
+def _check_attributes(tree: ast.Module) -> list[Violation]:
+  """Checks `me.<name>` style references against the public Mesop modules.
+
+  Only the modules in `PUBLIC_MODULES` are checked. Other `mesop.*` imports are left alone rather
+  than imported, since importing a module runs its code.
+  """
+  modules = {}
+  errors = []
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Import):
+      for alias in node.names:
+        if alias.asname:
+          modules[alias.asname] = alias.name
+        else:
+          # `import mesop.labs` binds `mesop`.
+          root = alias.name.partition(".")[0]
+          modules[root] = root
+    elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module in PUBLIC_MODULES:
+      module = PUBLIC_MODULES[node.module]
+      for alias in node.names:
+        if alias.name == "*":
+          continue
+        if not hasattr(module, alias.name):
+          errors.append(
+            Violation(
+              RULE_UNKNOWN_ATTRIBUTE,
+              node.lineno,
+              f"{node.module} has no attribute {alias.name}",
+              node,
+            )
+          )
+        # `from mesop import labs as mel` binds a public module.
+        modules[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+
+  for node in ast.walk(tree):
+    if not (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)):
+      continue
+    module_name = modules.get(node.value.id)
+    module = PUBLIC_MODULES.get(module_name)
+    if module is not None and not hasattr(module, node.attr):
+      errors.append(
+        Violation(
+          RULE_UNKNOWN_ATTRIBUTE,
+          node.lineno,
+          f"{node.value.id}.{node.attr} does not exist in {module_name}",
+          node,
+        )
+      )
+  return errors
+
+
+def _check_pages(tree: ast.Module) -> list[Violation]:
+  errors = []
+  has_page = False
+  for node in tree.body:
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+      continue
+    for decorator in node.decorator_list:
+      if is_me_attribute(decorator, "page"):
+        errors.append(
+          Violation(RULE_PAGE_DECORATOR, decorator.lineno, "Use @me.page() rather than @me.page")
+        )
+      elif isinstance(decorator, ast.Call) and is_me_attribute(decorator.func, "page"):
+        # Arguments such as `path` are valid. Leaving them out is only a prompt rule.
+        has_page = True
+  if not has_page and not errors:
+    errors.append(
+      Violation(RULE_MISSING_PAGE, 1, "Add a top-level function decorated with @me.page()")
+    )
+  return errors
@@ -0,0 +1,76 @@
+import sys
+
+import preflight
+from preflight import RULE_MISSING_PAGE, RULE_UNKNOWN_ATTRIBUTE, find_errors
+
+APP = """import mesop as me
+import mesop.labs as mel
+
+
+@me.page()
+def page():
+  me.text("Hello", style=me.Style(padding=me.Padding.all(8)))
+  mel.chat(transform, title="Chat")
+
+
+def transform(input: str, history: list[mel.ChatMessage]):
+  yield input
+"""
+
+
+def rules(code: str) -> list[str]:
+  return [error.rule for error in find_errors(code)]
+
+
+def test_valid_app_passes():
+  assert find_errors(APP) == []
+
+
+def test_page_with_arguments_passes():
+  assert find_errors(APP.replace("@me.page()", '@me.page(path="/chat", title="Chat")')) == []
+
+
+def test_syntax_error():
+  errors = find_errors(APP.replace("def page():", "def page("))
+
+  assert [error.rule for error in errors] == [preflight.RULE_SYNTAX]
+
+
+def test_compile_error():
+  assert rules(APP + "return 1\n") == [preflight.RULE_SYNTAX]
+
+
+def test_unknown_me_attribute():
+  errors = find_errors(APP.replace("me.text(", "me.label("))
+
+  assert [error.rule for error in errors] == [RULE_UNKNOWN_ATTRIBUTE]
+  assert errors[0].message == "me.label does not exist in mesop"
+
+
+def test_unknown_labs_attribute():
+  assert rules(APP.replace("mel.ChatMessage", "mel.Message")) == [RULE_UNKNOWN_ATTRIBUTE]
+
+
+def test_unknown_name_imported_from_mesop():
+  assert rules("from mesop import Labelz\n" + APP) == [RULE_UNKNOWN_ATTRIBUTE]
+
+
+def test_module_imported_from_mesop_is_checked():
+  code = APP.replace("import mesop.labs as mel", "from mesop import labs as mel")
+
+  assert rules(code.replace("mel.chat(", "mel.chatbot(")) == [RULE_UNKNOWN_ATTRIBUTE]
+
+
+def test_other_mesop_modules_are_not_imported(monkeypatch):
+  monkeypatch.delitem(sys.modules, "mesop.examples", raising=False)
+
+  assert find_errors("import mesop.examples as ex\n" + APP + "ex.anything\n") == []
+  assert "mesop.examples" not in sys.modules
+
+
+def test_page_decorator_must_be_called():
+  assert rules(APP.replace("@me.page()", "@me.page")) == [preflight.RULE_PAGE_DECORATOR]
+
+
+def test_missing_page():
+  assert rules(APP.replace("@me.page()\n", "")) == [RULE_MISSING_PAGE]
@@ -0,0 +1,238 @@
+"""SQLite store of generated apps, so that past generations can be found and reopened.
+
+Each session's generations are saved as versions of a project, along with the prompt, app type,
+model and how long the generation took. Prompts and code are indexed with FTS5, so past
+generations can be searched without going through Gemini again.
+
+Projects belong to the user who created them, identified by a hash of their Gemini API key
+(see `owner_id`). Searches and lookups only see the owner's projects, so that users of a shared
+editor cannot see or change each other's apps. Everyone who uses the same key, such as one the
+server provides, shares its projects.
+
+The database uses WAL mode, so one database file can be shared by multiple gunicorn worker
+processes. Each thread gets its own connection.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+# How long to wait for another worker's write to finish.
+BUSY_TIMEOUT_SECONDS = 5.0
+DEFAULT_SEARCH_LIMIT = 20
+PROJECT_NAME_CHARS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+  id INTEGER PRIMARY KEY,
+  owner TEXT NOT NULL DEFAULT '',
+  name TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS versions (
+  id INTEGER PRIMARY KEY,
+  project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+  prompt TEXT NOT NULL,
+  mode TEXT NOT NULL,
+  app_type TEXT NOT NULL,
+  model TEXT NOT NULL,
+  code TEXT NOT NULL,
+  generation_seconds REAL NOT NULL,
+  created_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS versions_project_id ON versions(project_id, id);
+
+CREATE INDEX IF NOT EXISTS projects_owner ON projects(owner, id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS versions_fts USING fts5(
+  prompt,
+  code,
+  content='versions',
+  content_rowid='id',
+  tokenize="unicode61 tokenchars '_'"
+);
+
+CREATE TRIGGER IF NOT EXISTS versions_insert AFTER INSERT ON versions BEGIN
+  INSERT INTO versions_fts(rowid, prompt, code) VALUES (new.id, new.prompt, new.code);
+END;
+
+CREATE TRIGGER IF NOT EXISTS versions_delete AFTER DELETE ON versions BEGIN
+  INSERT INTO versions_fts(versions_fts, rowid, prompt, code)
+  VALUES ('delete', old.id, old.prompt, old.code);
+END;
+"""
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class ProjectNotFoundError(Exception):
+  """Raised when a project does not exist or belongs to someone else."""
+
+
+def owner_id(api_key: str) -> str:
+  """Returns the owner ID of the user with the given API key, or "" if there is no key.
+
+  Only a hash is stored, so the database does not reveal the keys.
+  """
+  if not api_key:
+    return ""
+  return hashlib.sha256(f"mesop-app-maker-project-owner\0{api_key}".encode()).hexdigest()
+
+
+@dataclass
+class Version:
+  id: int
+  project_id: int
+  project_name: str
+  prompt: str
+  mode: str
+  app_type: str
+  model: str
+  code: str
+  generation_seconds: float
+  created_at: float
+
+
+class ProjectStore:
+  def __init__(self, path: str):
+    self.path = path
+    self._local = threading.local()
+    with self._connect() as connection:
+      # Databases created before projects had owners. Their projects are not visible to anyone.
+      tables = {row["name"] for row in connection.execute("SELECT name FROM sqlite_master")}
+      columns = {row["name"] for row in connection.execute("PRAGMA table_info(projects)")}
+      if "projects" in tables and "owner" not in columns:
+        connection.execute("ALTER TABLE projects ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+      connection.executescript(_SCHEMA)
+
+  def create_project(self, name: str, owner: str) -> int:
+    now = time.time()
+    with self._connect() as connection:
+      cursor = connection.execute(
+        "INSERT INTO projects (owner, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (owner, name[:PROJECT_NAME_CHARS], now, now),
+      )
+      return cursor.lastrowid
+
+  def add_version(
+    self,
+    project_id: int,
+    *,
+    owner: str,
+    prompt: str,
+    mode: str,
+    app_type: str,
+    model: str,
+    code: str,
+    generation_seconds: float,
+  ) -> int:
+    """Adds a version to the project and returns its ID.
+
+    Raises ProjectNotFoundError if the project does not belong to the owner.
+    """
+    now = time.time()
+    with self._connect() as connection:
+      cursor = connection.execute(
+        "UPDATE projects SET updated_at = ? WHERE id = ? AND owner = ?", (now, project_id, owner)
+      )
+      if not cursor.rowcount:
+        raise ProjectNotFoundError(f"Project {project_id} not found")
+      cursor = connection.execute(
+        """
+        INSERT INTO versions
+          (project_id, prompt, mode, app_type, model, code, generation_seconds, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (project_id, prompt, mode, app_type, model, code, generation_seconds, now),
+      )
+      return cursor.lastrowid
+
+  def get_version(self, version_id: int, owner: str) -> Version | None:
+    """Returns the version, or None if it does not exist or belongs to someone else."""
+    row = (
+      self._connect()
+      .execute(
+        """
+        SELECT v.*, p.name AS project_name
+        FROM versions v JOIN projects p ON p.id = v.project_id
+        WHERE v.id = ? AND p.owner = ?
+        """,
+        (version_id, owner),
+      )
+      .fetchone()
+    )
+    return _version(row) if row else None
+
+  def search(self, query: str, owner: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[Version]:
+    """Returns the owner's versions whose prompt or code match the query, best matches first.
+
+    Each word of the query matches words that start with it. An empty query returns the most
+    recent versions.
+    """
+    words = _WORD_RE.findall(query)
+    connection = self._connect()
+    if not words:
+      rows = connection.execute(
+        """
+        SELECT v.*, p.name AS project_name
+        FROM projects p JOIN versions v ON v.project_id = p.id
+        WHERE p.owner = ?
+        ORDER BY v.id DESC LIMIT ?
+        """,
+        (owner, limit),
+      )
+    else:
+      # Quote each word so that FTS5 syntax in the query is matched literally.
+      match = " ".join(f'"{word}"*' for word in words)
+      # Rank in the full-text index first, so that only the top matches are joined. Prompt
+      # matches are weighted above code matches. The owner is checked before the limit, so that
+      # other users' matches do not crowd out the owner's.
+      rows = connection.execute(
+        """
+        WITH matches AS (
+          SELECT f.rowid, bm25(versions_fts, 10.0, 1.0) AS score
+          FROM versions_fts f
+          JOIN versions v ON v.id = f.rowid
+          JOIN projects p ON p.id = v.project_id
+          WHERE versions_fts MATCH ? AND p.owner = ?
+          ORDER BY score, f.rowid DESC
+          LIMIT ?
+        )
+        SELECT v.*, p.name AS project_name
+        FROM matches m
+        JOIN versions v ON v.id = m.rowid
+        JOIN projects p ON p.id = v.project_id
+        ORDER BY m.score, v.id DESC
+        """,
+        (match, owner, limit),
+      )
+    return [_version(row) for row in rows]
+
+  def _connect(self) -> sqlite3.Connection:
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS)
+      connection.row_factory = sqlite3.Row
+      connection.execute("PRAGMA journal_mode=WAL")
+      connection.execute("PRAGMA synchronous=NORMAL")
+      connection.execute("PRAGMA foreign_keys=ON")
+      self._local.connection = connection
+    return connection
+
+
+def _version(row: sqlite3.Row) -> Version:
+  return Version(**dict(zip(row.keys(), row, strict=True)))
+
+
+store = (
+  ProjectStore(os.environ["MESOP_APP_MAKER_PROJECT_DB"])
+  if os.getenv("MESOP_APP_MAKER_PROJECT_DB")
+  else None
+)
@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+from project_store import ProjectNotFoundError, ProjectStore, owner_id
+
+ALICE = owner_id("alice-key")
+BOB = owner_id("bob-key")
+
+
+def add_version(store: ProjectStore, project_id: int, owner: str, prompt: str, code: str = ""):
+  return store.add_version(
+    project_id,
+    owner=owner,
+    prompt=prompt,
+    mode="Generate",
+    app_type="general",
+    model="gemini-1.5-flash",
+    code=code,
+    generation_seconds=1.0,
+  )
+
+
+@pytest.fixture
+def store(tmp_path) -> ProjectStore:
+  return ProjectStore(str(tmp_path / "projects.db"))
+
+
+def test_search_matches_prompt_and_code_prefixes(store):
+  project_id = store.create_project("Counter", ALICE)
+  add_version(store, project_id, ALICE, "Create a counter app", "me.button('Increment')")
+  add_version(store, project_id, ALICE, "Create a todo list", "me.checkbox()")
+
+  assert [v.prompt for v in store.search("count", ALICE)] == ["Create a counter app"]
+  assert [v.prompt for v in store.search("checkbox", ALICE)] == ["Create a todo list"]
+  assert [v.prompt for v in store.search("", ALICE)] == [
+    "Create a todo list",
+    "Create a counter app",
+  ]
+
+
+def test_search_treats_query_syntax_literally(store):
+  project_id = store.create_project("Counter", ALICE)
+  add_version(store, project_id, ALICE, "Create a counter app")
+
+  assert store.search('"counter*" (', ALICE)[0].prompt == "Create a counter app"
+
+
+def test_search_only_returns_the_owners_versions(store):
+  alice_project = store.create_project("Alice", ALICE)
+  add_version(store, alice_project, ALICE, "Create a counter app")
+  bob_project = store.create_project("Bob", BOB)
+  add_version(store, bob_project, BOB, "Create a counter for Bob")
+
+  assert [v.project_name for v in store.search("counter", ALICE)] == ["Alice"]
+  assert [v.project_name for v in store.search("", BOB)] == ["Bob"]
+
+
+def test_other_owners_matches_do_not_crowd_out_results(store):
+  bob_project = store.create_project("Bob", BOB)
+  for _ in range(5):
+    add_version(store, bob_project, BOB, "Create a counter app")
+  alice_project = store.create_project("Alice", ALICE)
+  add_version(store, alice_project, ALICE, "Create a counter app")
+
+  assert len(store.search("counter", ALICE, limit=2)) == 1
+
+
+def test_versions_of_other_owners_cannot_be_read_or_added_to(store):
+  project_id = store.create_project("Alice", ALICE)
+  version_id = add_version(store, project_id, ALICE, "Create a counter app")
+
+  assert store.get_version(version_id, ALICE).prompt == "Create a counter app"
+  assert store.get_version(version_id, BOB) is None
+  with pytest.raises(ProjectNotFoundError):
+    add_version(store, project_id, BOB, "Delete everything")
+
+
+def test_owner_is_added_to_old_databases(tmp_path):
+  path = str(tmp_path / "projects.db")
+  connection = sqlite3.connect(path)
+  connection.execute(
+    "CREATE TABLE projects (id INTEGER PRIMARY KEY, name TEXT NOT NULL, created_at REAL NOT NULL,"
+    " updated_at REAL NOT NULL)"
+  )
+  connection.execute("INSERT INTO projects (name, created_at, updated_at) VALUES ('Old', 0, 0)")
+  connection.commit()
+  connection.close()
+
+  store = ProjectStore(path)
+
+  assert store.search("", ALICE) == []
+  assert store.create_project("New", ALICE) == 2
+
+
+def test_owner_id_hides_the_key():
+  assert owner_id("") == ""
+  assert "alice-key" not in ALICE
+  assert ALICE != BOB
@@ -0,0 +1,68 @@
+"""Prompt history entries, with a bounded number kept in the Mesop state.
+
+The state is sent with every event, so only the latest entries are kept in
+`State.prompt_history`. Once it holds two pages of entries, the oldest page is moved into
+`history_store` as a JSON page that links to the page before it, and the state keeps the ID of
+the newest stored page. The state therefore stays the same size however long the session is,
+and the history panel only reads the pages it shows.
+"""
+
+import json
+import logging
+
+import history_store
+from constants import PROMPT_HISTORY_PAGE_SIZE
+from state import State
+
+logger = logging.getLogger(__name__)
+
+
+def add(state: State, **entry):
+  """Adds an entry to the history of the session."""
+  entry["index"] = state.prompt_history_count
+  state.prompt_history.append(entry)
+  state.prompt_history_count += 1
+  if len(state.prompt_history) >= 2 * PROMPT_HISTORY_PAGE_SIZE:
+    page = {
+      "entries": state.prompt_history[:PROMPT_HISTORY_PAGE_SIZE],
+      "previous": state.prompt_history_page_id,
+    }
+    state.prompt_history_page_id = history_store.store.put(json.dumps(page))
+    state.prompt_history = state.prompt_history[PROMPT_HISTORY_PAGE_SIZE:]
+
+
+def latest(state: State, limit: int) -> list[dict]:
+  """Returns up to `limit` of the latest entries, newest first."""
+  entries = list(reversed(state.prompt_history[-limit:]))
+  for page in _pages(state):
+    if len(entries) >= limit:
+      break
+    entries.extend(reversed(page["entries"][-(limit - len(entries)) :]))
+  return entries
+
+
+def get(state: State, index: int) -> dict | None:
+  """Returns the entry with the given index, or None if it is no longer stored."""
+  entries = state.prompt_history
+  pages = _pages(state)
+  while True:
+    if entries and entries[0]["index"] <= index:
+      position = index - entries[0]["index"]
+      return entries[position] if position < len(entries) else None
+    page = next(pages, None)
+    if page is None:
+      return None
+    entries = page["entries"]
+
+
+def _pages(state: State):
+  """Yields the stored pages of older entries, newest first."""
+  page_id = state.prompt_history_page_id
+  while page_id:
+    text = history_store.store.get(page_id)
+    if text is None:
+      logger.warning("Prompt history page %s is no longer stored", page_id)
+      return
+    page = json.loads(text)
+    yield page
+    page_id = page["previous"]
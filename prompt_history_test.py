@@ -0,0 +1,56 @@
+import flask
+import mesop as me
+import pytest
+
+import history_store
+import prompt_history
+from constants import PROMPT_HISTORY_PAGE_SIZE
+from state import State
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+  monkeypatch.setattr(history_store, "store", history_store.HistoryStore(str(tmp_path)))
+  with flask.Flask(__name__).app_context():
+    yield me.state(State)
+
+
+def add_entries(state: State, count: int):
+  for i in range(count):
+    prompt_history.add(state, prompt_id="", prompt_preview=f"Prompt {i}", code_id="")
+
+
+def test_state_keeps_at_most_two_pages(state):
+  add_entries(state, 5 * PROMPT_HISTORY_PAGE_SIZE + 3)
+
+  assert len(state.prompt_history) < 2 * PROMPT_HISTORY_PAGE_SIZE
+  assert state.prompt_history_page_id
+  assert state.prompt_history_count == 5 * PROMPT_HISTORY_PAGE_SIZE + 3
+
+
+def test_latest_reads_across_pages(state):
+  count = 5 * PROMPT_HISTORY_PAGE_SIZE + 3
+  add_entries(state, count)
+
+  for limit in (1, PROMPT_HISTORY_PAGE_SIZE, 3 * PROMPT_HISTORY_PAGE_SIZE, 2 * count):
+    indexes = [entry["index"] for entry in prompt_history.latest(state, limit)]
+    assert indexes == list(range(count - 1, max(count - 1 - limit, -1), -1))
+
+
+def test_get_finds_entries_in_stored_pages(state):
+  count = 3 * PROMPT_HISTORY_PAGE_SIZE + 1
+  add_entries(state, count)
+
+  for index in range(count):
+    assert prompt_history.get(state, index)["prompt_preview"] == f"Prompt {index}"
+  assert prompt_history.get(state, count) is None
+
+
+def test_missing_page_ends_the_history(state):
+  add_entries(state, 4 * PROMPT_HISTORY_PAGE_SIZE)
+  state.prompt_history_page_id = "0" * 32
+
+  assert len(prompt_history.latest(state, 10 * PROMPT_HISTORY_PAGE_SIZE)) == len(
+    state.prompt_history
+  )
+  assert prompt_history.get(state, 0) is None
@@ -0,0 +1,187 @@
+"""Content-addressed on-disk cache for LLM responses.
+
+Entries are stored as one JSON file per key. Writes go through a temporary file and an atomic
+rename, so the same directory can be shared by multiple gunicorn worker processes.
+
+Listing the directory gets slow as it fills up, so each process keeps a running estimate of the
+cache size and only scans the directory when the estimate passes the limit, or when the last
+scan was long enough ago that entries may have expired. A scan brings the size below the limit
+by a margin, so that the next one is not needed straight away. Sizes written by other processes
+are picked up by the next scan.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+# How often expired entries that were not read again are removed.
+SWEEP_INTERVAL_SECONDS = 60 * 60
+# Eviction removes entries until the cache is this fraction of the maximum size.
+EVICTION_TARGET = 0.9
+
+
+@dataclass
+class ResponseCacheStats:
+  """Hit/miss counters for this worker process."""
+
+  hits: int = 0
+  misses: int = 0
+  # Sum of the original generation times of the responses served from the cache.
+  seconds_saved: float = 0.0
+  # Entries removed because they expired or the cache was full.
+  evictions: int = 0
+  # Directory scans to find entries to remove.
+  scans: int = 0
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record_hit(self, seconds: float):
+    with self._lock:
+      self.hits += 1
+      self.seconds_saved += seconds
+
+  def record_miss(self):
+    with self._lock:
+      self.misses += 1
+
+  def record_scan(self, evictions: int):
+    with self._lock:
+      self.scans += 1
+      self.evictions += evictions
+
+  @property
+  def hit_rate(self) -> float:
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+
+def make_key(*parts: str) -> str:
+  """Hashes the given parts into a cache key."""
+  digest = hashlib.sha256()
+  for part in parts:
+    encoded = part.encode("utf-8")
+    # Length prefix each part so ("ab", "c") and ("a", "bc") do not collide.
+    digest.update(len(encoded).to_bytes(8, "big"))
+    digest.update(encoded)
+  return digest.hexdigest()
+
+
+class ResponseCache:
+  """Stores response text by key with TTL and total size based eviction.
+
+  Reads refresh the file modification time, so size based eviction removes the least recently
+  used entries first.
+  """
+
+  def __init__(
+    self,
+    directory: str,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    ttl_seconds: int = DEFAULT_TTL_SECONDS,
+    clock: Callable[[], float] = time.time,
+  ):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.ttl_seconds = ttl_seconds
+    self.clock = clock
+    self.stats = ResponseCacheStats()
+    self._lock = threading.Lock()
+    os.makedirs(directory, exist_ok=True)
+    self._evict()
+
+  def get(self, key: str) -> str | None:
+    path = self._path(key)
+    try:
+      with open(path) as f:
+        entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      self.stats.record_miss()
+      return None
+
+    now = self.clock()
+    if now - entry["created"] > self.ttl_seconds:
+      self._remove(path)
+      self.stats.record_miss()
+      return None
+
+    try:
+      os.utime(path, (now, now))
+    except FileNotFoundError:
+      pass
+    self.stats.record_hit(entry["seconds"])
+    return entry["text"]
+
+  def set(self, key: str, text: str, seconds: float):
+    """Stores the response text along with how long it took to generate."""
+    now = self.clock()
+    entry = {"text": text, "seconds": seconds, "created": now}
+    fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "w") as f:
+        json.dump(entry, f)
+        size = f.tell()
+      os.utime(temp_path, (now, now))
+      os.replace(temp_path, self._path(key))
+    except BaseException:
+      self._remove(temp_path)
+      raise
+
+    with self._lock:
+      # Overwriting an entry counts it twice, which only makes the next scan a little early.
+      self._estimated_bytes += size
+      due = (
+        self._estimated_bytes > self.max_bytes or now - self._last_scan_at > SWEEP_INTERVAL_SECONDS
+      )
+    if due:
+      self._evict()
+
+  def _evict(self):
+    """Removes expired entries, then the least recently used ones until under the target size."""
+    entries = []
+    total_bytes = 0
+    evictions = 0
+    now = self.clock()
+    with os.scandir(self.directory) as it:
+      for dir_entry in it:
+        if not dir_entry.name.endswith(".json"):
+          continue
+        try:
+          stat = dir_entry.stat()
+        except FileNotFoundError:
+          continue
+        # Entries past their TTL have not been read for at least that long either.
+        if now - stat.st_mtime > self.ttl_seconds:
+          self._remove(dir_entry.path)
+          evictions += 1
+          continue
+        entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+        total_bytes += stat.st_size
+
+    if total_bytes > self.max_bytes:
+      for _, size, path in sorted(entries):
+        if total_bytes <= self.max_bytes * EVICTION_TARGET:
+          break
+        self._remove(path)
+        evictions += 1
+        total_bytes -= size
+
+    with self._lock:
+      self._estimated_bytes = total_bytes
+      self._last_scan_at = now
+    self.stats.record_scan(evictions)
+
+  def _path(self, key: str) -> str:
+    return os.path.join(self.directory, key + ".json")
+
+  def _remove(self, path: str):
+    # Another worker may have removed it already.
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_key
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1_000_000.0
+
+  def __call__(self) -> float:
+    return self.now
+
+
+def entry_bytes(text: str) -> int:
+  return len(json.dumps({"text": text, "seconds": 1.0, "created": 1_000_000.0}))
+
+
+def test_round_trip(tmp_path):
+  cache = ResponseCache(str(tmp_path), clock=FakeClock())
+  cache.set("key", "text", 2.5)
+
+  assert cache.get("key") == "text"
+  assert cache.get("other") is None
+  assert (cache.stats.hits, cache.stats.misses, cache.stats.seconds_saved) == (1, 1, 2.5)
+
+
+def test_keys_do_not_collide():
+  assert make_key("ab", "c") != make_key("a", "bc")
+
+
+def test_expired_entry_is_a_miss(tmp_path):
+  clock = FakeClock()
+  cache = ResponseCache(str(tmp_path), ttl_seconds=60, clock=clock)
+  cache.set("key", "text", 1.0)
+  clock.now += 61
+
+  assert cache.get("key") is None
+  assert not os.path.exists(cache._path("key"))
+
+
+def test_expired_entries_are_swept(tmp_path):
+  clock = FakeClock()
+  cache = ResponseCache(str(tmp_path), ttl_seconds=60, clock=clock)
+  cache.set("old", "text", 1.0)
+  clock.now += response_cache.SWEEP_INTERVAL_SECONDS + 1
+  cache.set("new", "text", 1.0)
+
+  assert not os.path.exists(cache._path("old"))
+  assert cache.stats.evictions == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+  clock = FakeClock()
+  cache = ResponseCache(str(tmp_path), max_bytes=int(entry_bytes("a" * 100) * 2.5), clock=clock)
+  cache.set("a", "a" * 100, 1.0)
+  clock.now += 1
+  cache.set("b", "b" * 100, 1.0)
+  clock.now += 1
+  assert cache.get("a")
+  clock.now += 1
+  cache.set("c", "c" * 100, 1.0)
+
+  assert cache.get("b") is None
+  assert cache.get("a") and cache.get("c")
+  assert cache.stats.evictions == 1
+
+
+def test_directory_is_not_scanned_below_the_limit(tmp_path, monkeypatch):
+  cache = ResponseCache(str(tmp_path), clock=FakeClock())
+  scans = cache.stats.scans
+
+  def scandir(path):
+    raise AssertionError("The cache directory was scanned.")
+
+  monkeypatch.setattr(response_cache.os, "scandir", scandir)
+  for i in range(10):
+    cache.set(f"key-{i}", "text", 1.0)
+
+  assert cache.stats.scans == scans
+
+
+def test_failed_write_keeps_the_old_entry(tmp_path, monkeypatch):
+  cache = ResponseCache(str(tmp_path), clock=FakeClock())
+  cache.set("key", "old", 1.0)
+
+  def dump(obj, f):
+    f.write('{"text": "new", "sec')
+    raise OSError("Disk full")
+
+  monkeypatch.setattr(response_cache.json, "dump", dump)
+  with pytest.raises(OSError):
+    cache.set("key", "new", 1.0)
+  monkeypatch.undo()
+
+  assert cache.get("key") == "old"
+  assert os.listdir(tmp_path) == ["key.json"]
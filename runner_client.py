@@ -0,0 +1,423 @@
+"""HTTP client for the Mesop App Runner.
+
+Keeps a pooled keep-alive session per runner URL, so that repeated uploads skip the TCP/TLS
+handshake, which is slow for remote runners such as Hugging Face spaces. Requests have connect
+and read timeouts so that a dead runner cannot tie up a worker, and are retried with backoff
+when the runner could not be reached or is temporarily unavailable.
+
+Code is uploaded in a compact format: the compressed UTF-8 bytes as the request body, with the
+token and a SHA-256 hash of the code in headers. Runners that support it list it in a header on
+their root page, which is fetched before the first upload to each runner URL. Other runners get
+the original base64 form post, since they answer a compact upload with whatever error a missing
+form field causes, which cannot be told apart from the code failing to run.
+
+The URL path returned for each upload is cached by content hash, so that running code the
+runner already has skips the upload. Cached paths are checked with a quick GET before use, which
+must echo the content hash, since the runner may serve other code at the same path after an
+upload from another editor. Paths are not cached for runners that do not echo the hash, and are
+dropped when the runner looks like it restarted.
+"""
+
+import base64
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5.0
+DEFAULT_READ_TIMEOUT_SECONDS = 60.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_SECONDS = 0.5
+# Statuses returned by proxies such as Hugging Face while the runner is starting or restarting.
+RETRY_STATUSES = (502, 503, 504)
+# Uploads are not idempotent, since the runner starts the app. A 502 or 504 may be returned after
+# the runner already received the upload, but a 503 means it was not up to receive it.
+POST_RETRY_STATUSES = (503,)
+MAX_SESSIONS = 16
+MAX_SAMPLES = 100
+MAX_CACHED_UPLOADS = 256
+# Probing a cached path should be much faster than an upload, so use a short timeout.
+PROBE_TIMEOUT_SECONDS = 2.0
+
+UPLOAD_FORMAT_COMPACT = "compact"
+UPLOAD_FORMAT_BASE64 = "base64"
+TOKEN_HEADER = "X-Mesop-Runner-Token"
+# Sent with uploads, and echoed by runners with the app page of the code they serve.
+HASH_HEADER = "X-Content-SHA256"
+# Comma separated upload formats the runner accepts, sent with its root page.
+UPLOAD_FORMATS_HEADER = "X-Mesop-Runner-Upload-Formats"
+
+
+class RunnerError(Exception):
+  """Raised when the runner could not be reached or did not respond in time."""
+
+
+class RunnerRetry(Retry):
+  """Retry policy that only retries POST requests on statuses where the runner did not run them."""
+
+  def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+    if method.upper() == "POST" and status_code not in POST_RETRY_STATUSES:
+      return False
+    return super().is_retry(method, status_code, has_retry_after)
+
+
+@dataclass
+class RunnerStats:
+  requests: int = 0
+  failures: int = 0
+  retries: int = 0
+  bytes_sent: int = 0
+  latencies: deque = field(default_factory=lambda: deque(maxlen=MAX_SAMPLES))
+
+  def percentile(self, percentile: float) -> float:
+    latencies = sorted(self.latencies)
+    if not latencies:
+      return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+
+def encode_compact_upload(code: str, token: str) -> tuple[bytes, dict[str, str]]:
+  """Encodes code in the compact upload format.
+
+  Returns the request body and headers.
+  """
+  data = code.encode("utf-8")
+  if zstandard:
+    body = zstandard.ZstdCompressor().compress(data)
+    encoding = "zstd"
+  else:
+    body = gzip.compress(data)
+    encoding = "gzip"
+  headers = {
+    "Content-Type": "application/octet-stream",
+    "Content-Encoding": encoding,
+    TOKEN_HEADER: token,
+    HASH_HEADER: hashlib.sha256(data).hexdigest(),
+  }
+  return body, headers
+
+
+def decode_compact_upload(body: bytes, headers) -> str:
+  """Decodes a compact upload, as a runner would.
+
+  Raises ValueError if the encoding is not supported or the hash does not match.
+  """
+  encoding = headers.get("Content-Encoding", "identity")
+  if encoding == "gzip":
+    data = gzip.decompress(body)
+  elif encoding == "zstd" and zstandard:
+    data = zstandard.ZstdDecompressor().decompress(body)
+  elif encoding == "identity":
+    data = body
+  else:
+    raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+  if hashlib.sha256(data).hexdigest() != headers.get(HASH_HEADER):
+    raise ValueError("Code does not match the content hash.")
+  return data.decode("utf-8")
+
+
+@dataclass
+class UploadCacheStats:
+  hits: int = 0
+  misses: int = 0
+  # Cached paths that turned out to be stale.
+  invalidations: int = 0
+
+  @property
+  def hit_rate(self) -> float:
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups else 0.0
+
+
+class UploadCache:
+  """Maps the hash of uploaded code to the URL path the runner returned, per runner URL."""
+
+  def __init__(self, max_size: int = MAX_CACHED_UPLOADS):
+    self.max_size = max_size
+    self.stats = UploadCacheStats()
+    self._paths: dict[str, OrderedDict[str, str]] = {}
+    self._lock = threading.Lock()
+
+  def get(self, runner_url: str, key: str) -> str | None:
+    with self._lock:
+      paths = self._paths.get(runner_url, {})
+      path = paths.get(key)
+      if path is None:
+        self.stats.misses += 1
+        return None
+      self.stats.hits += 1
+      paths.move_to_end(key)
+      return path
+
+  def set(self, runner_url: str, key: str, path: str):
+    with self._lock:
+      paths = self._paths.setdefault(runner_url, OrderedDict())
+      # Runners that serve one app at a time reuse the same path, so the new code replaces
+      # whatever was there before.
+      for stale_key in [other for other, other_path in paths.items() if other_path == path]:
+        del paths[stale_key]
+      paths[key] = path
+      if len(paths) > self.max_size:
+        paths.popitem(last=False)
+
+  def invalidate(self, runner_url: str, key: str | None = None):
+    """Drops one cached path, or all cached paths for the runner if no key is given."""
+    with self._lock:
+      paths = self._paths.get(runner_url, {})
+      if key is None:
+        self.stats.invalidations += len(paths)
+        paths.clear()
+      elif paths.pop(key, None) is not None:
+        self.stats.invalidations += 1
+
+
+def upload_cache_key(token: str, code: str) -> str:
+  # The token is included so that a wrong token is not hidden by a cache hit.
+  return hashlib.sha256(f"{token}\0{code}".encode()).hexdigest()
+
+
+class RunnerClient:
+  def __init__(
+    self,
+    connect_timeout_seconds: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+    read_timeout_seconds: float = DEFAULT_READ_TIMEOUT_SECONDS,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+    max_sessions: int = MAX_SESSIONS,
+    compact_uploads: bool = True,
+    upload_cache: UploadCache | None = None,
+  ):
+    self.timeout = (connect_timeout_seconds, read_timeout_seconds)
+    self.max_retries = max_retries
+    self.backoff_seconds = backoff_seconds
+    self.max_sessions = max_sessions
+    self.compact_uploads = compact_uploads
+    self.upload_cache = upload_cache
+    self.stats: dict[str, RunnerStats] = {}
+    # Upload format that is known to work for each runner URL.
+    self.upload_formats: dict[str, str] = {}
+    # Runners whose app pages do not echo the content hash, so their paths cannot be cached.
+    self.unverifiable_runners: set[str] = set()
+    self._sessions: OrderedDict[str, requests.Session] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def cached_path(self, runner_url: str, token: str, code: str) -> str | None:
+    """Returns the URL path of code that was already uploaded to the runner, if still served."""
+    if not self.upload_cache:
+      return None
+    runner_url = runner_url.removesuffix("/")
+    key = upload_cache_key(token, code)
+    path = self.upload_cache.get(runner_url, key)
+    if path is None:
+      return None
+    try:
+      response = self.get(runner_url, path)
+    except RunnerError:
+      response = None
+    if response is None or response.status_code != 200:
+      # The runner most likely restarted, so none of its cached paths can be trusted.
+      self.upload_cache.invalidate(runner_url)
+      return None
+    served_hash = response.headers.get(HASH_HEADER)
+    if served_hash is None:
+      self.unverifiable_runners.add(runner_url)
+      self.upload_cache.invalidate(runner_url)
+      return None
+    if served_hash != hashlib.sha256(code.encode("utf-8")).hexdigest():
+      # Other code was uploaded to the same path since.
+      self.upload_cache.invalidate(runner_url, key)
+      return None
+    return path
+
+  def is_healthy(self, runner_url: str) -> bool:
+    """Whether the runner is up, based on a quick GET of its root page."""
+    try:
+      return self.get(runner_url, "/").status_code < 500
+    except RunnerError:
+      return False
+
+  def exec(
+    self, runner_url: str, token: str, code: str, upload_format: str | None = None
+  ) -> requests.Response:
+    """Uploads code to the runner.
+
+    Returns the runner's response, which has the URL path of the app on success.
+
+    Raises RunnerError if the runner could not be reached.
+
+    Args:
+      runner_url: Base URL of the runner
+      token: Runner token
+      code: Code to run
+      upload_format: Forces an upload format rather than asking the runner
+    """
+    runner_url = runner_url.removesuffix("/")
+    response = self._exec(runner_url, token, code, upload_format)
+    if (
+      self.upload_cache
+      and response.status_code == 200
+      and runner_url not in self.unverifiable_runners
+    ):
+      self.upload_cache.set(
+        runner_url, upload_cache_key(token, code), response.content.decode("utf-8")
+      )
+    return response
+
+  def _exec(
+    self, runner_url: str, token: str, code: str, upload_format: str | None
+  ) -> requests.Response:
+    if upload_format is None:
+      upload_format = (
+        self._upload_format(runner_url) if self.compact_uploads else UPLOAD_FORMAT_BASE64
+      )
+    if upload_format == UPLOAD_FORMAT_BASE64:
+      return self._exec_base64(runner_url, token, code)
+    body, headers = encode_compact_upload(code, token)
+    return self.post(runner_url, "/exec", data=body, headers=headers)
+
+  def _upload_format(self, runner_url: str) -> str:
+    """Returns the upload format to use for the runner, asking it on first use."""
+    upload_format = self.upload_formats.get(runner_url)
+    if upload_format is not None:
+      return upload_format
+    try:
+      response = self.get(runner_url, "/")
+    except RunnerError:
+      # Nothing is remembered, so that the runner is asked again once it is up.
+      return UPLOAD_FORMAT_BASE64
+    formats = {f.strip() for f in response.headers.get(UPLOAD_FORMATS_HEADER, "").split(",")}
+    upload_format = (
+      UPLOAD_FORMAT_COMPACT if UPLOAD_FORMAT_COMPACT in formats else UPLOAD_FORMAT_BASE64
+    )
+    if response.status_code < 500:
+      self.upload_formats[runner_url] = upload_format
+    return upload_format
+
+  def get(self, runner_url: str, path: str) -> requests.Response:
+    """Fetches a page from the runner with a short timeout.
+
+    Raises RunnerError if the runner could not be reached.
+    """
+    runner_url = runner_url.removesuffix("/")
+    try:
+      return self._get_session(runner_url).get(runner_url + path, timeout=PROBE_TIMEOUT_SECONDS)
+    except requests.RequestException as e:
+      raise RunnerError(f"Could not connect to the runner at {runner_url}: {e}") from e
+
+  def post(self, runner_url: str, path: str, **kwargs) -> requests.Response:
+    runner_url = runner_url.removesuffix("/")
+    session = self._get_session(runner_url)
+    start = time.monotonic()
+    try:
+      response = session.post(runner_url + path, timeout=self.timeout, **kwargs)
+    except requests.Timeout as e:
+      self._record(runner_url, start, failed=True)
+      raise RunnerError(f"Timed out waiting for the runner at {runner_url}.") from e
+    except requests.RequestException as e:
+      self._record(runner_url, start, failed=True)
+      self._forget(runner_url)
+      raise RunnerError(f"Could not connect to the runner at {runner_url}: {e}") from e
+
+    if response.status_code in RETRY_STATUSES:
+      self._forget(runner_url)
+
+    retries = response.raw.retries
+    self._record(
+      runner_url,
+      start,
+      failed=response.status_code >= 500,
+      retries=len(retries.history) if retries else 0,
+      bytes_sent=len(response.request.body or b""),
+    )
+    return response
+
+  def _forget(self, runner_url: str):
+    """Drops what is known about a runner that looks like it is restarting.
+
+    It may come back as a different version, so its upload format is asked for again.
+    """
+    self.upload_formats.pop(runner_url, None)
+    if self.upload_cache:
+      self.upload_cache.invalidate(runner_url)
+
+  def close(self):
+    with self._lock:
+      for session in self._sessions.values():
+        session.close()
+      self._sessions.clear()
+
+  def _get_session(self, runner_url: str) -> requests.Session:
+    with self._lock:
+      session = self._sessions.get(runner_url)
+      if session is not None:
+        self._sessions.move_to_end(runner_url)
+        return session
+
+      session = requests.Session()
+      # Only retry failures where the upload did not start, or the proxy in front of the runner
+      # rejected it. Read timeouts are not retried, since the runner may still be running the
+      # code.
+      retry = RunnerRetry(
+        total=self.max_retries,
+        connect=self.max_retries,
+        read=False,
+        status=self.max_retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "POST"]),
+        backoff_factor=self.backoff_seconds,
+        raise_on_status=False,
+      )
+      adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=8)
+      session.mount("http://", adapter)
+      session.mount("https://", adapter)
+      self._sessions[runner_url] = session
+      if len(self._sessions) > self.max_sessions:
+        _, evicted = self._sessions.popitem(last=False)
+        evicted.close()
+      return session
+
+  def _exec_base64(self, runner_url: str, token: str, code: str) -> requests.Response:
+    return self.post(
+      runner_url,
+      "/exec",
+      data={"token": token, "code": base64.b64encode(code.encode("utf-8"))},
+    )
+
+  def _record(
+    self, runner_url: str, start: float, failed: bool, retries: int = 0, bytes_sent: int = 0
+  ):
+    with self._lock:
+      stats = self.stats.setdefault(runner_url, RunnerStats())
+      stats.requests += 1
+      stats.failures += failed
+      stats.retries += retries
+      stats.bytes_sent += bytes_sent
+      stats.latencies.append(time.monotonic() - start)
+
+
+client = RunnerClient(
+  connect_timeout_seconds=float(
+    os.getenv("MESOP_APP_MAKER_RUNNER_CONNECT_TIMEOUT", str(DEFAULT_CONNECT_TIMEOUT_SECONDS))
+  ),
+  read_timeout_seconds=float(
+    os.getenv("MESOP_APP_MAKER_RUNNER_READ_TIMEOUT", str(DEFAULT_READ_TIMEOUT_SECONDS))
+  ),
+  max_retries=int(os.getenv("MESOP_APP_MAKER_RUNNER_RETRIES", str(DEFAULT_MAX_RETRIES))),
+  compact_uploads=bool(int(os.getenv("MESOP_APP_MAKER_RUNNER_COMPACT_UPLOADS", "1"))),
+  upload_cache=UploadCache()
+  if bool(int(os.getenv("MESOP_APP_MAKER_RUNNER_UPLOAD_CACHE", "1")))
+  else None,
+)
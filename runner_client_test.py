@@ -0,0 +1,195 @@
+import pytest
+
+import fake_services
+from runner_client import (
+  UPLOAD_FORMAT_BASE64,
+  UPLOAD_FORMAT_COMPACT,
+  UPLOAD_FORMATS_HEADER,
+  RunnerClient,
+  RunnerError,
+  RunnerRetry,
+  UploadCache,
+)
+
+CODE = "import mesop as me\n"
+
+
+def test_retry_get_on_gateway_errors():
+  retry = RunnerRetry(total=2, status_forcelist=(502, 503, 504), allowed_methods=["GET", "POST"])
+
+  assert retry.is_retry("GET", 502)
+  assert retry.is_retry("GET", 504)
+
+
+def test_retry_post_only_when_runner_was_unavailable():
+  retry = RunnerRetry(total=2, status_forcelist=(502, 503, 504), allowed_methods=["GET", "POST"])
+
+  assert retry.is_retry("POST", 503)
+  assert not retry.is_retry("POST", 502)
+  assert not retry.is_retry("POST", 504)
+
+
+def test_retry_policy_is_kept_after_a_retry():
+  retry = RunnerRetry(total=2, status_forcelist=(502, 503, 504), allowed_methods=["GET", "POST"])
+
+  assert not retry.new(total=1).is_retry("POST", 504)
+
+
+class FakeResponse:
+  def __init__(self, status_code: int, headers: dict[str, str] | None = None):
+    self.status_code = status_code
+    self.headers = headers or {}
+    self.content = b"/app"
+
+
+class FakeRunnerClient(RunnerClient):
+  """Runner client that answers requests with canned statuses instead of sending them."""
+
+  def __init__(self, formats: str | None, compact_status: int = 200, base64_status: int = 200):
+    super().__init__()
+    self.formats = formats
+    self.statuses = {True: compact_status, False: base64_status}
+    self.probes = 0
+    self.uploads = []
+
+  def get(self, runner_url: str, path: str) -> FakeResponse:
+    self.probes += 1
+    if self.formats is None:
+      raise RunnerError("Runner is down.")
+    return FakeResponse(200, {UPLOAD_FORMATS_HEADER: self.formats} if self.formats else {})
+
+  def post(self, runner_url: str, path: str, **kwargs) -> FakeResponse:
+    compact = "headers" in kwargs
+    self.uploads.append(UPLOAD_FORMAT_COMPACT if compact else UPLOAD_FORMAT_BASE64)
+    return FakeResponse(self.statuses[compact])
+
+
+def test_compact_format_is_used_when_advertised():
+  client = FakeRunnerClient(formats="base64, compact")
+
+  assert client.exec("http://runner", "token", "code").status_code == 200
+  client.exec("http://runner", "token", "code")
+
+  assert client.upload_formats["http://runner"] == UPLOAD_FORMAT_COMPACT
+  assert client.uploads == [UPLOAD_FORMAT_COMPACT, UPLOAD_FORMAT_COMPACT]
+  assert client.probes == 1
+
+
+@pytest.mark.parametrize("legacy_compact_status", [403, 500])
+def test_legacy_runner_gets_base64(legacy_compact_status: int):
+  # A runner that does not list its formats would fail a compact upload on the missing form.
+  client = FakeRunnerClient(formats="", compact_status=legacy_compact_status)
+
+  assert client.exec("http://runner", "token", "code").status_code == 200
+
+  assert client.upload_formats["http://runner"] == UPLOAD_FORMAT_BASE64
+  assert client.uploads == [UPLOAD_FORMAT_BASE64]
+
+
+def test_unreachable_runner_is_asked_again():
+  client = FakeRunnerClient(formats=None)
+
+  client.exec("http://runner", "token", "code")
+  client.formats = "compact"
+  client.exec("http://runner", "token", "code")
+
+  assert client.uploads == [UPLOAD_FORMAT_BASE64, UPLOAD_FORMAT_COMPACT]
+
+
+def test_server_error_is_not_sent_again():
+  client = FakeRunnerClient(formats="compact", compact_status=500)
+
+  assert client.exec("http://runner", "token", "code").status_code == 500
+
+  # The code may have failed while running, so it must not be run a second time.
+  assert client.uploads == [UPLOAD_FORMAT_COMPACT]
+
+
+def test_compact_uploads_can_be_turned_off():
+  client = FakeRunnerClient(formats="compact")
+  client.compact_uploads = False
+
+  client.exec("http://runner", "token", "code")
+
+  assert client.uploads == [UPLOAD_FORMAT_BASE64]
+  assert client.probes == 0
+
+
+@pytest.mark.parametrize("token", ["secret", ""])
+def test_upload_to_fake_legacy_runner(token: str):
+  config = fake_services.RunnerConfig(exec_seconds=0, token=token, compact_uploads=False)
+  runner = fake_services.fake_runner(config).start()
+  client = RunnerClient()
+  try:
+    response = client.exec(runner.url, token, CODE)
+
+    assert response.status_code == 200
+    assert client.upload_formats[runner.url] == UPLOAD_FORMAT_BASE64
+    # A compact upload is refused the way the real runner refuses it.
+    response = client.exec(runner.url, token, "x = 1\n", upload_format=UPLOAD_FORMAT_COMPACT)
+    assert response.status_code == (403 if token else 500)
+  finally:
+    client.close()
+    runner.stop()
+
+
+def test_upload_to_fake_compact_runner():
+  config = fake_services.RunnerConfig(exec_seconds=0, token="secret")
+  runner = fake_services.fake_runner(config).start()
+  client = RunnerClient()
+  try:
+    assert client.exec(runner.url, "secret", CODE).status_code == 200
+
+    assert client.upload_formats[runner.url] == UPLOAD_FORMAT_COMPACT
+  finally:
+    client.close()
+    runner.stop()
+
+
+def upload_cache_client() -> RunnerClient:
+  return RunnerClient(upload_cache=UploadCache())
+
+
+def test_cached_path_is_reused():
+  runner = fake_services.fake_runner(fake_services.RunnerConfig(exec_seconds=0)).start()
+  client = upload_cache_client()
+  try:
+    path = client.exec(runner.url, "", CODE).content.decode("utf-8")
+
+    assert client.cached_path(runner.url, "", CODE) == path
+  finally:
+    client.close()
+    runner.stop()
+
+
+def test_cached_path_is_dropped_after_another_upload_to_the_same_path():
+  config = fake_services.RunnerConfig(exec_seconds=0, single_app=True)
+  runner = fake_services.fake_runner(config).start()
+  # Two editor processes sharing a runner that serves one app at a time.
+  client, other_client = upload_cache_client(), upload_cache_client()
+  try:
+    client.exec(runner.url, "", CODE)
+    other_client.exec(runner.url, "", "x = 1\n")
+
+    assert client.cached_path(runner.url, "", CODE) is None
+    assert client.upload_cache.stats.invalidations == 1
+  finally:
+    client.close()
+    other_client.close()
+    runner.stop()
+
+
+def test_runner_that_does_not_echo_the_hash_is_not_cached():
+  config = fake_services.RunnerConfig(exec_seconds=0, echo_content_hash=False)
+  runner = fake_services.fake_runner(config).start()
+  client = upload_cache_client()
+  try:
+    client.exec(runner.url, "", CODE)
+
+    assert client.cached_path(runner.url, "", CODE) is None
+    client.exec(runner.url, "", CODE)
+    assert client.cached_path(runner.url, "", CODE) is None
+    assert client.upload_cache.stats.misses == 1
+  finally:
+    client.close()
+    runner.stop()
@@ -0,0 +1,157 @@
+"""Pool of Mesop App Runners.
+
+Spreads uploads across several runners so that one busy or sleeping runner does not hold
+everyone up. Each upload goes to the healthy runner with the fewest uploads in flight, except
+that a session sticks to the runner it used last, since that runner has its code and the
+preview iframe points at it. If a runner fails, the upload fails over to another one.
+
+Runners are probed in the background, so that runners marked unhealthy after a failure are put
+back into rotation once they recover.
+
+Configure the pool with a JSON list of runners:
+
+  MESOP_APP_MAKER_RUNNER_POOL='[{"url": "https://a.hf.space", "token": "..."}, ...]'
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+
+import runner_client
+from runner_client import RETRY_STATUSES, RunnerClient, RunnerError
+
+DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS = 30.0
+
+
+@dataclass
+class RunnerBackend:
+  url: str
+  token: str
+  healthy: bool = True
+  # Uploads in flight.
+  outstanding: int = 0
+  requests: int = 0
+  failures: int = 0
+  last_checked_at: float = 0.0
+
+
+class RunnerPool:
+  def __init__(
+    self,
+    backends: list[RunnerBackend],
+    client: RunnerClient,
+    health_check_interval_seconds: float = DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS,
+  ):
+    if not backends:
+      raise ValueError("A runner pool needs at least one runner.")
+    self.backends = {backend.url: backend for backend in backends}
+    self.client = client
+    self.health_check_interval_seconds = health_check_interval_seconds
+    self.failovers = 0
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._health_thread = threading.Thread(
+      target=self._check_health_periodically, name="runner-health", daemon=True
+    )
+    self._health_thread.start()
+
+  def select(self, preferred_url: str = "") -> RunnerBackend:
+    """Picks the runner for a session.
+
+    Args:
+      preferred_url: Runner the session used last, which is kept if it is still healthy
+    """
+    with self._lock:
+      return self._select(preferred_url.removesuffix("/"), exclude=set())
+
+  def exec(self, runner_url: str, code: str) -> tuple[RunnerBackend, requests.Response]:
+    """Uploads code to the given runner, failing over to other runners if it is down.
+
+    Returns the runner that was used and its response.
+
+    Raises RunnerError if no runner could be reached.
+    """
+    tried = set()
+    with self._lock:
+      backend = self.backends.get(runner_url.removesuffix("/")) or self._select("", tried)
+    while backend is not None:
+      tried.add(backend.url)
+      with self._lock:
+        backend.outstanding += 1
+        backend.requests += 1
+      try:
+        response = self.client.exec(backend.url, backend.token, code)
+        error = None if response.status_code not in RETRY_STATUSES else response
+      except RunnerError as e:
+        error = e
+      finally:
+        with self._lock:
+          backend.outstanding -= 1
+
+      if error is None:
+        return backend, response
+
+      failed = backend
+      with self._lock:
+        failed.failures += 1
+        failed.healthy = False
+        backend = self._select("", tried)
+        if backend is not None:
+          self.failovers += 1
+
+    if isinstance(error, RunnerError):
+      raise error
+    # The last runner answered with a retryable status, so return that.
+    return failed, response
+
+  def stop(self):
+    self._stopped.set()
+
+  def _select(self, preferred_url: str, exclude: set[str]) -> RunnerBackend | None:
+    candidates = [backend for backend in self.backends.values() if backend.url not in exclude]
+    preferred = self.backends.get(preferred_url)
+    if preferred and preferred.healthy and preferred.url not in exclude:
+      return preferred
+    # Fall back to unhealthy runners rather than giving up, since the probe may be stale.
+    healthy = [backend for backend in candidates if backend.healthy] or candidates
+    if not healthy:
+      return None
+    least_outstanding = min(backend.outstanding for backend in healthy)
+    return random.choice(
+      [backend for backend in healthy if backend.outstanding == least_outstanding]
+    )
+
+  def _check_health_periodically(self):
+    while not self._stopped.wait(self.health_check_interval_seconds):
+      for backend in list(self.backends.values()):
+        healthy = self.client.is_healthy(backend.url)
+        with self._lock:
+          backend.healthy = healthy
+          backend.last_checked_at = time.time()
+
+
+def parse_pool_config(config: str) -> list[RunnerBackend]:
+  return [
+    RunnerBackend(url=runner["url"].removesuffix("/"), token=runner.get("token", ""))
+    for runner in json.loads(config)
+  ]
+
+
+pool = (
+  RunnerPool(
+    parse_pool_config(os.environ["MESOP_APP_MAKER_RUNNER_POOL"]),
+    runner_client.client,
+    health_check_interval_seconds=float(
+      os.getenv(
+        "MESOP_APP_MAKER_RUNNER_HEALTH_INTERVAL", str(DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS)
+      )
+    ),
+  )
+  if os.getenv("MESOP_APP_MAKER_RUNNER_POOL")
+  else None
+)
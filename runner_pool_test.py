@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+import fake_services
+import main
+import runner_pool
+from runner_client import RunnerClient
+from runner_pool import RunnerBackend, RunnerPool
+from state import State
+
+CODE = "import mesop as me\n"
+
+
+@pytest.fixture
+def runners():
+  config = fake_services.RunnerConfig(exec_seconds=0, token="secret")
+  services = [fake_services.fake_runner(config).start() for _ in range(2)]
+  yield config, services
+  for service in services:
+    service.stop()
+
+
+def make_pool(services, health_check_interval_seconds: float = 60.0) -> RunnerPool:
+  client = RunnerClient(connect_timeout_seconds=1.0, max_retries=0)
+  return RunnerPool(
+    [RunnerBackend(url=service.url, token="secret") for service in services],
+    client,
+    health_check_interval_seconds=health_check_interval_seconds,
+  )
+
+
+def test_session_sticks_to_its_runner(runners, monkeypatch):
+  _, services = runners
+  pool = make_pool(services)
+  monkeypatch.setattr(runner_pool, "pool", pool)
+  state = State(runner_url=services[1].url + "/")
+  try:
+    for _ in range(5):
+      assert main._select_runner(state) == (services[1].url, "secret")
+  finally:
+    pool.stop()
+
+
+def test_unhealthy_runner_is_not_sticky(runners):
+  _, services = runners
+  pool = make_pool(services)
+  pool.backends[services[1].url].healthy = False
+  try:
+    assert pool.select(services[1].url).url == services[0].url
+  finally:
+    pool.stop()
+
+
+def test_selects_runner_with_fewest_uploads_in_flight(runners):
+  _, services = runners
+  pool = make_pool(services)
+  pool.backends[services[0].url].outstanding = 2
+  pool.backends[services[1].url].outstanding = 1
+  try:
+    for _ in range(5):
+      assert pool.select().url == services[1].url
+  finally:
+    pool.stop()
+
+
+def test_upload_fails_over_when_runner_is_down(runners):
+  _, services = runners
+  pool = make_pool(services)
+  services[0].stop()
+  try:
+    backend, response = pool.exec(services[0].url, CODE)
+
+    assert response.status_code == 200
+    assert backend.url == services[1].url
+    assert not pool.backends[services[0].url].healthy
+    assert pool.backends[services[0].url].failures == 1
+    assert pool.failovers == 1
+  finally:
+    pool.stop()
+
+
+def test_health_check_puts_recovered_runner_back(runners):
+  config, services = runners
+  pool = make_pool(services, health_check_interval_seconds=0.05)
+  port = int(services[0].url.rsplit(":", 1)[1])
+  services[0].stop()
+  try:
+    pool.exec(services[0].url, CODE)
+    assert not pool.backends[services[0].url].healthy
+
+    services[0] = fake_services.fake_runner(config, port).start()
+    deadline = time.monotonic() + 5
+    while not pool.backends[services[0].url].healthy and time.monotonic() < deadline:
+      time.sleep(0.05)
+
+    assert pool.backends[services[0].url].healthy
+    assert pool.select(services[0].url).url == services[0].url
+  finally:
+    pool.stop()
@@ -0,0 +1,309 @@
+"""Admission control for LLM requests.
+
+Requests are queued per API key, since that is what Gemini quotas apply to. Each key gets a
+token bucket rate limit, a cap on concurrent requests and a bounded priority queue. When the
+queue is full or the estimated wait is too long, requests are rejected right away rather than
+tying up a worker.
+
+Queued tickets whose owner has stopped calling `wait`, such as a handler whose browser tab was
+closed, are dropped after `abandon_seconds` so that they do not block the queue. Keys with
+nothing queued or running and a full bucket are forgotten, so that the state does not grow with
+every key that was ever used.
+
+Note that limits apply per worker process.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+PRIORITY_REVISE = 0
+PRIORITY_GENERATE = 1
+
+# Initial guess for how long a request takes before we have measurements.
+DEFAULT_SERVICE_SECONDS = 20.0
+# Weight of the latest measurement in the moving average of service times.
+SERVICE_SECONDS_SMOOTHING = 0.2
+# How long after its last `wait` call a queued ticket is considered abandoned.
+DEFAULT_ABANDON_SECONDS = 10.0
+# How often keys are checked for being idle.
+PRUNE_INTERVAL_SECONDS = 60.0
+
+
+class SchedulerOverloadedError(Exception):
+  """Raised when a request cannot be admitted in a reasonable time."""
+
+
+class TokenBucket:
+  def __init__(self, rate_per_second: float, capacity: float, now: float):
+    self.rate_per_second = rate_per_second
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated_at = now
+
+  def seconds_until_available(self, now: float) -> float:
+    self._refill(now)
+    if self.tokens >= 1:
+      return 0.0
+    return (1 - self.tokens) / self.rate_per_second
+
+  def available(self, now: float) -> float:
+    """Returns the number of tokens available now."""
+    self._refill(now)
+    return self.tokens
+
+  def take(self, now: float):
+    self._refill(now)
+    self.tokens -= 1
+
+  def _refill(self, now: float):
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+    self.updated_at = now
+
+
+@dataclass(order=True)
+class Ticket:
+  """A queued request. Call `wait` until admitted, then `release` once done."""
+
+  priority: int
+  sequence: int
+  scheduler: "Scheduler" = field(compare=False, repr=False)
+  api_key: str = field(compare=False, repr=False)
+  enqueued_at: float = field(compare=False)
+  admitted_at: float | None = field(default=None, compare=False)
+  released: bool = field(default=False, compare=False)
+  # The ticket is dropped if it is still queued at this time without another `wait` call.
+  expires_at: float = field(default=0.0, compare=False)
+
+  def wait(self, timeout: float) -> bool:
+    """Waits up to `timeout` seconds to be admitted.
+
+    Returns True once admitted. Raises SchedulerOverloadedError if the ticket has been waiting
+    longer than the scheduler's `max_wait_seconds`, or was dropped as abandoned.
+    """
+    return self.scheduler._wait(self, timeout)
+
+  def release(self):
+    self.scheduler._release(self)
+
+  @property
+  def position(self) -> int:
+    """Number of requests ahead of this one in the queue, starting at 1."""
+    return self.scheduler._position(self)
+
+  @property
+  def estimated_wait_seconds(self) -> float:
+    return self.scheduler._estimated_wait_seconds(self)
+
+
+@dataclass
+class _KeyState:
+  bucket: TokenBucket
+  waiting: list[Ticket] = field(default_factory=list)
+  active: int = 0
+  service_seconds: float = DEFAULT_SERVICE_SECONDS
+
+
+@dataclass
+class SchedulerStats:
+  admitted: int = 0
+  rejected: int = 0
+  timed_out: int = 0
+  abandoned: int = 0
+  total_wait_seconds: float = 0.0
+
+
+class Scheduler:
+  def __init__(
+    self,
+    rate_per_minute: float = 15,
+    burst: int = 3,
+    max_concurrent: int = 4,
+    max_queue: int = 20,
+    max_wait_seconds: float = 60,
+    abandon_seconds: float = DEFAULT_ABANDON_SECONDS,
+    clock: Callable[[], float] = time.monotonic,
+  ):
+    self.rate_per_minute = rate_per_minute
+    self.burst = burst
+    self.max_concurrent = max_concurrent
+    self.max_queue = max_queue
+    self.max_wait_seconds = max_wait_seconds
+    self.abandon_seconds = abandon_seconds
+    self.clock = clock
+    self.stats = SchedulerStats()
+    self._keys: dict[str, _KeyState] = {}
+    self._pruned_at = clock()
+    self._sequence = itertools.count()
+    self._condition = threading.Condition()
+
+  def enqueue(self, api_key: str, priority: int = PRIORITY_GENERATE) -> Ticket:
+    """Queues a request for the given API key.
+
+    Raises SchedulerOverloadedError if the queue is full or the estimated wait is longer than
+    `max_wait_seconds`.
+    """
+    with self._condition:
+      now = self.clock()
+      key_state = self._get_key_state(api_key, now)
+      self._drop_abandoned(key_state, now)
+      if len(key_state.waiting) >= self.max_queue:
+        self.stats.rejected += 1
+        raise SchedulerOverloadedError("Too many requests are queued. Please try again later.")
+
+      ticket = Ticket(
+        priority=priority,
+        sequence=next(self._sequence),
+        scheduler=self,
+        api_key=api_key,
+        enqueued_at=now,
+        expires_at=now + self.abandon_seconds,
+      )
+      heapq.heappush(key_state.waiting, ticket)
+      if self._estimated_wait_seconds(ticket) > self.max_wait_seconds:
+        self._remove_waiting(key_state, ticket)
+        self.stats.rejected += 1
+        raise SchedulerOverloadedError("The server is busy. Please try again later.")
+      return ticket
+
+  def try_admit(self, api_key: str) -> Ticket | None:
+    """Admits an extra request for the given API key if it can start right away.
+
+    This is for optional requests, such as hedged backups, that should neither wait in the queue
+    nor hold up the requests that are waiting. Returns None if the request would have to wait.
+    The returned ticket must be released once the request is done.
+    """
+    with self._condition:
+      now = self.clock()
+      key_state = self._get_key_state(api_key, now)
+      self._drop_abandoned(key_state, now)
+      if (
+        key_state.waiting
+        or key_state.active >= self.max_concurrent
+        or key_state.bucket.seconds_until_available(now) > 0
+      ):
+        return None
+      key_state.bucket.take(now)
+      key_state.active += 1
+      self.stats.admitted += 1
+      return Ticket(
+        priority=PRIORITY_REVISE,
+        sequence=next(self._sequence),
+        scheduler=self,
+        api_key=api_key,
+        enqueued_at=now,
+        admitted_at=now,
+      )
+
+  def _wait(self, ticket: Ticket, timeout: float) -> bool:
+    deadline = self.clock() + timeout
+    with self._condition:
+      # The owner is waiting until the deadline, so the ticket is not abandoned before then.
+      ticket.expires_at = max(ticket.expires_at, deadline + self.abandon_seconds)
+      while True:
+        if ticket.admitted_at is not None:
+          return True
+        if ticket.released:
+          raise SchedulerOverloadedError("Timed out waiting for the server. Please try again.")
+
+        # The ticket is still queued, so its key has not been pruned.
+        key_state = self._keys[ticket.api_key]
+        now = self.clock()
+        self._drop_abandoned(key_state, now)
+        if now - ticket.enqueued_at > self.max_wait_seconds:
+          ticket.released = True
+          self._remove_waiting(key_state, ticket)
+          self.stats.timed_out += 1
+          self._condition.notify_all()
+          raise SchedulerOverloadedError("Timed out waiting for the server. Please try again.")
+
+        sleep_seconds = deadline - now
+        if key_state.waiting[0] is ticket and key_state.active < self.max_concurrent:
+          bucket_seconds = key_state.bucket.seconds_until_available(now)
+          if bucket_seconds == 0:
+            key_state.bucket.take(now)
+            heapq.heappop(key_state.waiting)
+            key_state.active += 1
+            ticket.admitted_at = now
+            self.stats.admitted += 1
+            self.stats.total_wait_seconds += now - ticket.enqueued_at
+            # The next ticket in line may be admissible too.
+            self._condition.notify_all()
+            return True
+          sleep_seconds = min(sleep_seconds, bucket_seconds)
+
+        if sleep_seconds <= 0:
+          return False
+        self._condition.wait(sleep_seconds)
+
+  def _release(self, ticket: Ticket):
+    with self._condition:
+      if ticket.released:
+        return
+      ticket.released = True
+      key_state = self._keys[ticket.api_key]
+      if ticket.admitted_at is None:
+        self._remove_waiting(key_state, ticket)
+      else:
+        key_state.active -= 1
+        key_state.service_seconds += SERVICE_SECONDS_SMOOTHING * (
+          self.clock() - ticket.admitted_at - key_state.service_seconds
+        )
+      self._condition.notify_all()
+
+  def _position(self, ticket: Ticket) -> int:
+    with self._condition:
+      if ticket.admitted_at is not None:
+        return 0
+      return sorted(self._keys[ticket.api_key].waiting).index(ticket) + 1
+
+  def _estimated_wait_seconds(self, ticket: Ticket) -> float:
+    """Estimates the wait from the queue position, concurrency and rate limit."""
+    with self._condition:
+      if ticket.admitted_at is not None:
+        return 0.0
+      key_state = self._keys[ticket.api_key]
+      ahead = sorted(key_state.waiting).index(ticket)
+      # Requests ahead of us plus the active ones need to finish before we get a slot.
+      slots_needed = max(0, ahead + key_state.active - self.max_concurrent + 1)
+      concurrency_seconds = slots_needed * key_state.service_seconds / self.max_concurrent
+      tokens = key_state.bucket.available(self.clock())
+      rate_seconds = max(0, ahead + 1 - tokens) * 60 / self.rate_per_minute
+      return max(concurrency_seconds, rate_seconds)
+
+  def _get_key_state(self, api_key: str, now: float) -> _KeyState:
+    if now - self._pruned_at > PRUNE_INTERVAL_SECONDS:
+      self._prune_idle_keys(now)
+    key_state = self._keys.get(api_key)
+    if key_state is None:
+      key_state = _KeyState(bucket=TokenBucket(self.rate_per_minute / 60, self.burst, now))
+      self._keys[api_key] = key_state
+    return key_state
+
+  def _prune_idle_keys(self, now: float):
+    """Forgets keys that are in the same state as a key that was never used."""
+    for api_key, key_state in list(self._keys.items()):
+      self._drop_abandoned(key_state, now)
+      if (
+        not key_state.waiting
+        and not key_state.active
+        and key_state.bucket.available(now) >= key_state.bucket.capacity
+      ):
+        del self._keys[api_key]
+    self._pruned_at = now
+
+  def _drop_abandoned(self, key_state: _KeyState, now: float):
+    abandoned = [ticket for ticket in key_state.waiting if ticket.expires_at < now]
+    for ticket in abandoned:
+      ticket.released = True
+      self._remove_waiting(key_state, ticket)
+      self.stats.abandoned += 1
+    if abandoned:
+      self._condition.notify_all()
+
+  def _remove_waiting(self, key_state: _KeyState, ticket: Ticket):
+    key_state.waiting.remove(ticket)
+    heapq.heapify(key_state.waiting)
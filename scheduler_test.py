@@ -0,0 +1,248 @@
+import pytest
+
+from scheduler import PRIORITY_GENERATE, PRIORITY_REVISE, Scheduler, SchedulerOverloadedError
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self) -> float:
+    return self.now
+
+
+def make_scheduler(
+  clock: FakeClock,
+  rate_per_minute: float = 6000,
+  burst: int = 100,
+  max_concurrent: int = 1,
+  **kwargs,
+) -> Scheduler:
+  return Scheduler(
+    rate_per_minute=rate_per_minute,
+    burst=burst,
+    max_concurrent=max_concurrent,
+    abandon_seconds=10,
+    clock=clock,
+    **kwargs,
+  )
+
+
+def test_release_admits_next_ticket():
+  scheduler = make_scheduler(FakeClock())
+  first = scheduler.enqueue("key")
+  second = scheduler.enqueue("key")
+
+  assert first.wait(timeout=0)
+  assert not second.wait(timeout=0)
+  assert second.position == 1
+
+  first.release()
+
+  assert second.wait(timeout=0)
+  assert scheduler.stats.admitted == 2
+
+
+def test_release_is_idempotent():
+  scheduler = make_scheduler(FakeClock(), max_concurrent=2)
+  ticket = scheduler.enqueue("key")
+  assert ticket.wait(timeout=0)
+
+  ticket.release()
+  ticket.release()
+
+  assert scheduler._keys["key"].active == 0
+
+
+def test_release_while_queued_removes_ticket():
+  scheduler = make_scheduler(FakeClock())
+  first = scheduler.enqueue("key")
+  second = scheduler.enqueue("key")
+  third = scheduler.enqueue("key")
+  assert first.wait(timeout=0)
+
+  second.release()
+  first.release()
+
+  assert third.wait(timeout=0)
+
+
+def test_revise_is_admitted_before_generate():
+  scheduler = make_scheduler(FakeClock())
+  active = scheduler.enqueue("key")
+  assert active.wait(timeout=0)
+  generate = scheduler.enqueue("key", PRIORITY_GENERATE)
+  revise = scheduler.enqueue("key", PRIORITY_REVISE)
+
+  active.release()
+
+  assert not generate.wait(timeout=0)
+  assert revise.wait(timeout=0)
+
+
+def test_abandoned_head_ticket_is_dropped():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock)
+  # Nobody ever waits on this ticket, like a handler whose tab was closed.
+  abandoned = scheduler.enqueue("key")
+  waiting = scheduler.enqueue("key")
+  later = scheduler.enqueue("key")
+
+  clock.now += 5
+  assert not waiting.wait(timeout=0)
+  assert not later.wait(timeout=0)
+  # Past the abandoned ticket's deadline, but not the others'.
+  clock.now += 6
+
+  assert waiting.wait(timeout=0)
+  waiting.release()
+  assert later.wait(timeout=0)
+  assert scheduler.stats.abandoned == 1
+  with pytest.raises(SchedulerOverloadedError):
+    abandoned.wait(timeout=0)
+
+
+def test_polling_ticket_is_not_dropped():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock)
+  active = scheduler.enqueue("key")
+  assert active.wait(timeout=0)
+  waiting = scheduler.enqueue("key")
+
+  for _ in range(5):
+    clock.now += 5
+    assert not waiting.wait(timeout=0)
+
+  assert scheduler.stats.abandoned == 0
+  active.release()
+  assert waiting.wait(timeout=0)
+
+
+def test_wait_times_out_after_max_wait():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock, max_wait_seconds=30)
+  active = scheduler.enqueue("key")
+  assert active.wait(timeout=0)
+  # The estimate is based on the default service time, so start with a short one.
+  scheduler._keys["key"].service_seconds = 1
+  waiting = scheduler.enqueue("key")
+
+  clock.now += 31
+
+  with pytest.raises(SchedulerOverloadedError):
+    waiting.wait(timeout=0)
+  assert scheduler.stats.timed_out == 1
+
+
+def test_full_queue_is_rejected():
+  scheduler = make_scheduler(FakeClock(), max_queue=2)
+  scheduler.enqueue("key")
+  scheduler.enqueue("key")
+
+  with pytest.raises(SchedulerOverloadedError):
+    scheduler.enqueue("key")
+  assert scheduler.stats.rejected == 1
+
+
+def test_keys_are_independent():
+  scheduler = make_scheduler(FakeClock())
+  first = scheduler.enqueue("key-1")
+  assert first.wait(timeout=0)
+
+  assert scheduler.enqueue("key-2").wait(timeout=0)
+
+
+def test_rate_limit_delays_admission():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock, rate_per_minute=60, burst=1, max_concurrent=10)
+  assert scheduler.enqueue("key").wait(timeout=0)
+  ticket = scheduler.enqueue("key")
+
+  assert not ticket.wait(timeout=0)
+  clock.now += 1
+
+  assert ticket.wait(timeout=0)
+
+
+def test_try_admit_uses_spare_capacity():
+  scheduler = make_scheduler(FakeClock(), max_concurrent=2)
+  first = scheduler.enqueue("key")
+  assert first.wait(timeout=0)
+
+  extra = scheduler.try_admit("key")
+
+  assert extra is not None
+  assert scheduler.try_admit("key") is None
+  extra.release()
+  assert scheduler._keys["key"].active == 1
+
+
+def test_try_admit_does_not_jump_the_queue():
+  scheduler = make_scheduler(FakeClock(), max_concurrent=2)
+  scheduler.enqueue("key")
+
+  assert scheduler.try_admit("key") is None
+
+
+def test_try_admit_respects_rate_limit():
+  scheduler = make_scheduler(FakeClock(), rate_per_minute=60, burst=1, max_concurrent=10)
+  assert scheduler.try_admit("key") is not None
+
+  assert scheduler.try_admit("key") is None
+
+
+def test_timed_out_ticket_can_be_released():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock, max_wait_seconds=30)
+  active = scheduler.enqueue("key")
+  assert active.wait(timeout=0)
+  scheduler._keys["key"].service_seconds = 1
+  waiting = scheduler.enqueue("key")
+  clock.now += 31
+  with pytest.raises(SchedulerOverloadedError):
+    waiting.wait(timeout=0)
+
+  waiting.release()
+
+  assert scheduler._keys["key"].waiting == []
+
+
+def test_estimate_includes_refilled_tokens():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock, rate_per_minute=60, burst=2, max_concurrent=10)
+  for _ in range(2):
+    assert scheduler.enqueue("key").wait(timeout=0)
+  clock.now += 2
+
+  # Both tokens have been refilled, although nothing has touched the bucket since.
+  assert scheduler.enqueue("key").estimated_wait_seconds == 0
+
+
+def test_idle_keys_are_pruned():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock, rate_per_minute=60, burst=1, max_concurrent=10)
+  for api_key in ["idle", "busy", "queued"]:
+    scheduler.enqueue(api_key).wait(timeout=0)
+  scheduler._keys["idle"].active = 0
+  queued = scheduler.enqueue("queued")
+  clock.now += 61
+  # Keeps the queued ticket from being dropped as abandoned.
+  queued.expires_at = clock.now + 10
+
+  scheduler.enqueue("new")
+
+  assert sorted(scheduler._keys) == ["busy", "new", "queued"]
+
+
+def test_recently_used_key_is_not_pruned():
+  clock = FakeClock()
+  scheduler = make_scheduler(clock, rate_per_minute=0.5, burst=1, max_concurrent=10)
+  ticket = scheduler.enqueue("key")
+  assert ticket.wait(timeout=0)
+  ticket.release()
+  clock.now += 61
+
+  scheduler.enqueue("other")
+
+  # The bucket has not refilled yet, so forgetting the key would reset its rate limit.
+  assert "key" in scheduler._keys
@@ -17,6 +17,12 @@ class State:
   model: str = "gemini-1.5-flash"
   runner_url: str = os.getenv("MESOP_APP_MAKER_RUNNER_URL", c.DEFAULT_URL)
   runner_token: str = os.getenv("MESOP_APP_MAKER_RUNNER_TOKEN", "")
+  stream_code: bool = bool(int(os.getenv("MESOP_APP_MAKER_STREAM_CODE", "1")))
+  revise_with_edits: bool = bool(int(os.getenv("MESOP_APP_MAKER_REVISE_WITH_EDITS", "0")))
+  hedge_generation: bool = bool(int(os.getenv("MESOP_APP_MAKER_HEDGE_GENERATION", "0")))
+  multi_candidate: bool = bool(int(os.getenv("MESOP_APP_MAKER_MULTI_CANDIDATE", "0")))
+  auto_run: bool = bool(int(os.getenv("MESOP_APP_MAKER_AUTO_RUN", "0")))
+  use_local_runner: bool = bool(int(os.getenv("MESOP_APP_MAKER_LOCAL_RUNNER", "0")))
 
   # Generate prompt panel
   prompt_mode: str = "Generate"
@@ -28,7 +34,19 @@ class State:
   select_index: int
 
   # Prompt history panel
-  prompt_history: list[dict]  # Format: {"prompt", "code", "index", "mode", "app_type"}
+  # Format: {"prompt_id", "prompt_preview", "code_id", "index", "mode", "app_type"}
+  # The prompt and code are in `history_store`. Only the latest entries are kept here, and older
+  # entries are in pages in `history_store` (see `prompt_history`).
+  prompt_history: list[dict]
+  prompt_history_page_id: str
+  prompt_history_count: int
+  # Number of entries shown in the history panel.
+  prompt_history_shown: int = c.PROMPT_HISTORY_PAGE_SIZE
+  # Project in `project_store` that generations are saved to. Zero until the first generation.
+  project_id: int
+  project_search: str
+  # Results of `project_search`, updated when the search changes rather than on every render.
+  project_search_results: list[dict]
 
   # Code editor
   code_placeholder: str = c.EXAMPLE_PROGRAM
@@ -39,6 +57,7 @@ class State:
   runner_url_path: str = "/"
   loaded_url: str = os.getenv("MESOP_APP_MAKER_RUNNER_URL", c.DEFAULT_URL)
   iframe_index: int
+  preview_version: int
 
   # Sidebar
   menu_open: bool = True
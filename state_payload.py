@@ -0,0 +1,195 @@
+"""Keeps the Mesop state that is sent with every event small, and measures it.
+
+The whole `State` is serialized and sent to the browser after every render, and sent back with
+every event. Large string fields, such as the code and its placeholder copy, are moved into
+`history_store` at the end of each render and replaced with a short reference. Identical values
+share one stored copy. The references are resolved again at the start of each render and each
+step of an event handler, so handlers and components see the full values.
+
+Every event handler must be wrapped with `handler` so that it sees the full values. Otherwise
+it would work on the references, such as by sending one to Gemini. `offload` checks the handlers
+registered by each render and raises if one is not wrapped, so a missed handler fails on the
+first render instead of only when offloading is enabled. The page must call `restore` when it
+starts rendering and `offload` when it is done.
+
+The serialized size of each field after each handler step can also be recorded, to find out
+which fields make the state large.
+"""
+
+import dataclasses
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import flask
+import mesop as me
+from mesop.dataclass_utils.dataclass_utils import MesopJSONEncoder
+from mesop.runtime import runtime
+
+import history_store
+from state import State
+
+# Prefix of the references that replace offloaded fields. It cannot be typed into an input.
+REFERENCE_PREFIX = "\x00blob:"
+# Name recorded for renders that are not caused by an event handler, such as page loads.
+RENDER = "render"
+
+DEFAULT_OFFLOAD_THRESHOLD_BYTES = 4096
+
+# Fields larger than this many bytes are offloaded. Zero disables offloading.
+offload_threshold_bytes = int(
+  os.getenv("MESOP_APP_MAKER_STATE_OFFLOAD_BYTES", str(DEFAULT_OFFLOAD_THRESHOLD_BYTES))
+)
+profile_enabled = bool(int(os.getenv("MESOP_APP_MAKER_STATE_PROFILE", "0")))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FieldSizes:
+  samples: int = 0
+  total_bytes: int = 0
+  max_bytes: int = 0
+
+  @property
+  def mean_bytes(self) -> float:
+    return self.total_bytes / self.samples if self.samples else 0.0
+
+
+@dataclass
+class StateProfile:
+  """Serialized state sizes by handler and field, for this worker process."""
+
+  # Handler name -> field name -> sizes
+  handlers: dict[str, dict[str, FieldSizes]] = field(
+    default_factory=lambda: defaultdict(lambda: defaultdict(FieldSizes))
+  )
+  _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+  def record(self, handler_name: str, field_bytes: dict[str, int]):
+    with self._lock:
+      for name, size in field_bytes.items():
+        sizes = self.handlers[handler_name][name]
+        sizes.samples += 1
+        sizes.total_bytes += size
+        sizes.max_bytes = max(sizes.max_bytes, size)
+
+
+profile = StateProfile()
+
+
+def handler(fn):
+  """Wraps an event handler so that it sees the full values of offloaded fields."""
+
+  @functools.wraps(fn)
+  def wrapper(e):
+    flask.g.state_payload_handler = fn.__name__
+    state = me.state(State)
+    restore(state)
+    result = fn(e)
+    if not inspect.isgenerator(result):
+      # Mesop renders once after handlers that are not generators.
+      yield
+      return
+    try:
+      for _ in result:
+        yield
+        # The render at the yield offloaded the fields again.
+        restore(state)
+    finally:
+      # Runs the handler's cleanup right away if Mesop drops this generator, such as when the
+      # tab is closed.
+      result.close()
+    # The state is sent after the last step without another render, so offload it here.
+    _offload_fields(state)
+
+  wrapper.restores_state = True
+  return wrapper
+
+
+def check_handlers(handlers):
+  """Raises TypeError if one of the given Mesop event handlers is not wrapped with `handler`.
+
+  Mesop wraps registered handlers in a function with the same module and name, which is used to
+  look up the function that was registered.
+  """
+  for registered in handlers:
+    fn = getattr(sys.modules.get(registered.__module__), registered.__name__, None)
+    if not getattr(fn, "restores_state", False):
+      raise TypeError(
+        f"Event handler {registered.__module__}.{registered.__name__} must be wrapped with "
+        "@state_payload.handler, or it will see references to offloaded fields."
+      )
+
+
+def restore(state: State):
+  """Replaces references to offloaded fields with their values."""
+  for f in dataclasses.fields(state):
+    value = getattr(state, f.name)
+    if isinstance(value, str) and value.startswith(REFERENCE_PREFIX):
+      text = history_store.store.get(value.removeprefix(REFERENCE_PREFIX))
+      if text is None:
+        logger.warning("Offloaded value of %s is no longer stored", f.name)
+        text = ""
+      setattr(state, f.name, text)
+
+
+def offload(state: State):
+  """Moves large string fields out of the state and records the state size.
+
+  This must be called after everything has been rendered, since it replaces the field values.
+  """
+  check_handlers(runtime().context()._handlers.values())
+  _offload_fields(state)
+  if profile_enabled:
+    handler_name = flask.g.get("state_payload_handler", RENDER)
+    field_bytes = field_sizes(state)
+    profile.record(handler_name, field_bytes)
+    logger.info("State after %s: %d bytes", handler_name, sum(field_bytes.values()))
+
+
+def _offload_fields(state: State):
+  if not offload_threshold_bytes:
+    return
+  for f in dataclasses.fields(state):
+    value = getattr(state, f.name)
+    if (
+      isinstance(value, str)
+      and not value.startswith(REFERENCE_PREFIX)
+      and len(value.encode("utf-8")) > offload_threshold_bytes
+    ):
+      setattr(state, f.name, REFERENCE_PREFIX + history_store.store.put(value))
+
+
+def format_profile() -> str:
+  """Returns the recorded state sizes as Markdown tables, largest fields first."""
+  sections = []
+  with profile._lock:
+    for handler_name, fields in sorted(profile.handlers.items()):
+      rows = [
+        f"| {name} | {sizes.samples} | {sizes.mean_bytes:.0f} | {sizes.max_bytes} |"
+        for name, sizes in sorted(fields.items(), key=lambda item: -item[1].mean_bytes)
+      ]
+      total = sum(sizes.mean_bytes for sizes in fields.values())
+      sections.append(
+        f"## {handler_name} ({total:.0f} bytes)\n\n"
+        "| Field | Samples | Mean bytes | Max bytes |\n"
+        "| --- | --- | --- | --- |\n" + "\n".join(rows)
+      )
+  if not profile_enabled:
+    return "Set `MESOP_APP_MAKER_STATE_PROFILE=1` to record state sizes."
+  return "\n\n".join(sections) or "No state sizes recorded yet."
+
+
+def field_sizes(state: State) -> dict[str, int]:
+  """Returns the serialized size of each field of the state."""
+  return {
+    name: len(json.dumps(value, cls=MesopJSONEncoder))
+    for name, value in dataclasses.asdict(state).items()
+  }
@@ -0,0 +1,46 @@
+import mesop as me
+import pytest
+from mesop.component_helpers.helper import wrap_handler_with_event
+
+import history_store
+import state_payload
+from history_store import HistoryStore
+from state import State
+
+
+@state_payload.handler
+def on_wrapped(e: me.ClickEvent):
+  pass
+
+
+def on_not_wrapped(e: me.ClickEvent):
+  pass
+
+
+def test_check_handlers_accepts_wrapped_handlers():
+  state_payload.check_handlers([wrap_handler_with_event(on_wrapped, me.ClickEvent)])
+
+
+def test_check_handlers_rejects_unwrapped_handlers():
+  with pytest.raises(TypeError, match="on_not_wrapped"):
+    state_payload.check_handlers([wrap_handler_with_event(on_not_wrapped, me.ClickEvent)])
+
+
+def test_large_fields_are_offloaded_by_default(tmp_path, monkeypatch):
+  monkeypatch.setattr(history_store, "store", HistoryStore(str(tmp_path)))
+  state = State()
+  code = "x = 1\n" * 1000
+  state.code = code
+  state.code_placeholder = code
+  state.prompt = "Make a counter"
+
+  state_payload._offload_fields(state)
+
+  assert state.code.startswith(state_payload.REFERENCE_PREFIX)
+  assert state.code_placeholder == state.code
+  assert state.prompt == "Make a counter"
+
+  state_payload.restore(state)
+
+  assert state.code == code
+  assert state.code_placeholder == code
@@ -9,3 +9,7 @@ from web_components.async_action.async_action_component import (
 from web_components.async_action.async_action_component import (
   AsyncAction as AsyncAction,
 )
+
+from web_components.preview_frame.preview_frame_component import (
+  preview_frame_component as preview_frame_component,
+)
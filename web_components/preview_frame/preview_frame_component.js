@@ -0,0 +1,158 @@
+import {
+  LitElement,
+  html,
+} from "https://cdn.jsdelivr.net/gh/lit/dist@3/core/lit-core.min.js";
+
+// Message sent to the preview asking it to show a new URL in place, and the reply from
+// previews that support it.
+const NAVIGATE_MESSAGE = "mesop-app-maker:navigate";
+const NAVIGATED_MESSAGE = "mesop-app-maker:navigated";
+// Message previews send once loaded to announce what they support, such as "navigate".
+const READY_MESSAGE = "mesop-app-maker:ready";
+
+// How long to wait for a preview that supports swapping to reply before navigating the iframe
+// instead.
+const SWAP_TIMEOUT_MS = 300;
+
+/**
+ * Shows the app preview in an iframe that is kept across runs.
+ *
+ * When a new version is loaded, previews that announced support for it are asked to swap in the
+ * new content over postMessage, which keeps the loaded app and its assets. Other previews, and
+ * those that do not reply in time, are navigated in place without waiting. The iframe is only
+ * rebuilt when the runner changes or when `remountKey` changes.
+ */
+class PreviewFrameComponent extends LitElement {
+  static properties = {
+    url: { type: String },
+    version: { type: Number },
+    remountKey: { type: Number },
+    loadedEvent: { type: String },
+  };
+
+  constructor() {
+    super();
+    this.url = "";
+    this.version = 0;
+    this.remountKey = 0;
+    this.iframe = null;
+    this.pendingSwap = null;
+    // Whether the document in the iframe announced that it can swap in new versions.
+    this.swapSupported = false;
+    this.onMessage = this.onMessage.bind(this);
+  }
+
+  createRenderRoot() {
+    return this;
+  }
+
+  connectedCallback() {
+    super.connectedCallback();
+    window.addEventListener("message", this.onMessage);
+  }
+
+  disconnectedCallback() {
+    window.removeEventListener("message", this.onMessage);
+    super.disconnectedCallback();
+  }
+
+  render() {
+    return html`<div id="preview" style="width: 100%; height: 100%"></div>`;
+  }
+
+  updated(changedProperties) {
+    if (!this.url) {
+      return;
+    }
+    if (!this.iframe || changedProperties.has("remountKey")) {
+      this.remount();
+    } else if (changedProperties.has("url") || changedProperties.has("version")) {
+      this.swap();
+    }
+  }
+
+  remount() {
+    const start = performance.now();
+    this.cancelSwap();
+    if (this.iframe) {
+      this.iframe.remove();
+    }
+    this.swapSupported = false;
+    this.iframe = document.createElement("iframe");
+    this.iframe.style.cssText = "width: 100%; height: 100%; border: 0";
+    this.iframe.addEventListener("load", () => this.dispatchLoaded("remount", start), {
+      once: true,
+    });
+    this.iframe.src = this.url;
+    this.querySelector("#preview").appendChild(this.iframe);
+  }
+
+  swap() {
+    const origin = new URL(this.url, window.location.href).origin;
+    if (!this.iframe.contentWindow || origin !== new URL(this.iframe.src).origin) {
+      // A different runner has none of the loaded app, so start over.
+      this.remount();
+      return;
+    }
+    this.cancelSwap();
+    const start = performance.now();
+    const url = this.url;
+    if (!this.swapSupported) {
+      this.navigate(url, start);
+      return;
+    }
+    this.pendingSwap = {
+      start,
+      timeout: setTimeout(() => {
+        this.pendingSwap = null;
+        this.navigate(url, start);
+      }, SWAP_TIMEOUT_MS),
+    };
+    this.iframe.contentWindow.postMessage({ type: NAVIGATE_MESSAGE, url: url }, origin);
+  }
+
+  navigate(url, start) {
+    // The new document announces again if it supports swapping.
+    this.swapSupported = false;
+    this.iframe.addEventListener("load", () => this.dispatchLoaded("navigate", start), {
+      once: true,
+    });
+    this.iframe.src = url;
+  }
+
+  onMessage(event) {
+    if (!this.iframe || event.source !== this.iframe.contentWindow) {
+      return;
+    }
+    if (event.data?.type === READY_MESSAGE) {
+      this.swapSupported = (event.data.capabilities || []).includes("navigate");
+      return;
+    }
+    if (!this.pendingSwap || event.data?.type !== NAVIGATED_MESSAGE) {
+      return;
+    }
+    const start = this.pendingSwap.start;
+    this.cancelSwap();
+    this.dispatchLoaded("swap", start);
+  }
+
+  cancelSwap() {
+    if (this.pendingSwap) {
+      clearTimeout(this.pendingSwap.timeout);
+      this.pendingSwap = null;
+    }
+  }
+
+  dispatchLoaded(mode, start) {
+    if (this.loadedEvent) {
+      this.dispatchEvent(
+        new MesopEvent(this.loadedEvent, {
+          mode: mode,
+          seconds: (performance.now() - start) / 1000,
+        })
+      );
+    }
+  }
+}
+
+customElements.define("preview-frame-component", PreviewFrameComponent);
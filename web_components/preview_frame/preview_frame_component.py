@@ -0,0 +1,36 @@
+from collections.abc import Callable
+from typing import Any
+
+import mesop.labs as mel
+
+
+@mel.web_component(path="./preview_frame_component.js")
+def preview_frame_component(
+  *,
+  src: str = "",
+  version: int = 0,
+  remount_key: int = 0,
+  on_loaded: Callable[[mel.WebEvent], Any] | None = None,
+  key: str | None = None,
+):
+  """Creates an iframe for the app preview that is reused across runs.
+
+  Changing `src` or `version` swaps in the new content without rebuilding the iframe. Changing
+  `remount_key` rebuilds the iframe. `on_loaded` receives how the preview was loaded and how
+  long it took.
+  """
+  events = {}
+  if on_loaded:
+    events["loadedEvent"] = on_loaded
+
+  return mel.insert_web_component(
+    name="preview-frame-component",
+    key=key,
+    events=events,
+    # Mesop does not allow a property named `src`.
+    properties={
+      "url": src,
+      "version": version,
+      "remountKey": remount_key,
+    },
+  )